@@ -15,6 +15,7 @@ from layout_operation_widget import OperationWindow
 from layout_operation_config_widget import OperationConfigWindow
 from layout_logging_config_widget import LoggingConfigWindow
 from layout_packet_view_widget import PacketViewWindow
+from layout_metrics_widget import MetricsWindow
 
 class MainWindow(QMainWindow):
 
@@ -27,8 +28,10 @@ class MainWindow(QMainWindow):
         tabs.setTabPosition(QTabWidget.TabPosition.West)
         tabs.setMovable(True)
 
-        tabs.addTab(OperationWindow(self.config), "Operation")
+        self.operation = OperationWindow(self.config)
+        tabs.addTab(self.operation, "Operation")
         tabs.addTab(OperationConfigWindow(self.config), "Parameters")
+        tabs.addTab(MetricsWindow(self.config), "Metrics")
         #tabs.addTab(LoggingConfigWindow(self.config), "Logging")
         #tabs.addTab(PacketViewWindow(self.config), "Bus")
 
@@ -41,6 +44,7 @@ class MainWindow(QMainWindow):
 
         if reply:
             event.accept()
+            self.operation.stop_poll()
             self.config.exit()
             print('Window closed')
         else:
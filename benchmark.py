@@ -0,0 +1,232 @@
+""" Benchmarks of the protocol, decode, logging and plotting hot paths
+
+Runs headless on synthetic payloads shaped like parameters_get.csv and reports
+operations per second and memory allocated per operation for every stage.
+Results are compared against benchmark_baseline.json, a stage slower than its
+baseline by more than the tolerance fails the run with exit code 1.
+
+    python benchmark.py [--save-baseline] [--tolerance 0.3] [--only STAGE ...]
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import matplotlib
+
+matplotlib.use('Agg')
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+import numpy as np
+
+import driver_mk2
+from crc import crc_16_batch, crc_16_bytes
+from decimate import MinMaxPyramid
+from live_plot import LivePlot, plot_live
+from params import ParameterSet, ParameterLog
+from reassembler import Reassembler
+from replay import CapturedFrame
+
+baseline_file = Path(__file__).parent / "benchmark_baseline.json"
+params_file = Path(__file__).parent / "parameters_get.csv"
+
+# seconds each stage is timed for, best of `repeats` timings
+min_time = 0.5
+repeats = 3
+
+
+def synthetic_payloads(parameter_set, count: int, seed: int = 0):
+    """Payloads with random values within the bounds of every parameter"""
+    rng = np.random.default_rng(seed)
+    params = [parameter_set[n] for n in parameter_set.parameter_names]
+    values = [rng.integers(p.min, p.max + 1, count).tolist() for p in params]
+    return [bytes(parameter_set.pack(v)) for v in zip(*values)]
+
+
+def ops_per_sec(fn) -> float:
+    """Call fn repeatedly for at least min_time seconds, returns the best call rate of `repeats` timings"""
+    n = 1
+    best = 0.0
+    timings = 0
+    while timings < repeats:
+        start = time.perf_counter()
+        for _ in range(n):
+            fn()
+        elapsed = time.perf_counter() - start
+        if (elapsed >= min_time):
+            # a single timing swings by about 20% with scheduling and cache state
+            best = max(best, n / elapsed)
+            timings += 1
+        else:
+            n = max(2 * n, int(n * min_time / max(elapsed, 1e-9)))
+    return best
+
+
+def allocations(fn, n: int = 200):
+    """Peak and retained bytes traced per call of fn"""
+    fn()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    peak = 0
+    for _ in range(n):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        fn()
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+    retained = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    return peak, retained / n
+
+
+def cycle(items):
+    state = {'i': 0}
+
+    def next_item():
+        state['i'] = (state['i'] + 1) % len(items)
+        return items[state['i']]
+    return next_item
+
+
+def live_plot(log, name):
+    canvas = FigureCanvasAgg(Figure(figsize=(8, 6), dpi=100))
+    axes = canvas.figure.add_subplot(111)
+    plot = LivePlot(canvas, axes)
+    plot.reset(name, (-55, 125))
+    plot.set_live(True)
+    canvas.draw()
+    return plot, MinMaxPyramid(), int(axes.bbox.width)
+
+
+def stages(parameter_set, payloads):
+    next_payload = cycle(payloads)
+    response = cycle([[CapturedFrame(can_id, data, None) for can_id, data in
+                       driver_mk2.pack_response([0x58, 0x44, 0x41, 0x54], [0x10], [0x00, 0x05], [0] * 8 + list(p))]
+                      for p in payloads[:64]])
+    # preamble, header and body of a DATA_GET response as the CRC covers it
+    crc_data = cycle([b"XDAT\x00\x10\x00\x05\xa2" + b"\x00" * 8 + p for p in payloads[:64]])
+    values = cycle([parameter_set.unpack(p) for p in payloads[:64]])
+
+    reassembler = Reassembler()
+
+    def reassemble(frames):
+        for frame in frames:
+            transfer = reassembler.feed(frame, now=0.0)
+        return transfer
+
+    memory_log = ParameterLog(parameter_set)
+
+    plotted = ParameterLog(parameter_set)
+    for _ in range(10000):
+        plotted.log_datapoint(next_payload())
+    plot, pyramid, width = live_plot(plotted, "ECU Temp")
+    plot_live(plot, pyramid, plotted, "ECU Temp", width)
+
+    def plot_after_10k():
+        plotted.log_datapoint(next_payload())
+        plot_live(plot, pyramid, plotted, "ECU Temp", width)
+
+    # the logs are closed before their directory is removed, also when the run stops early
+    with tempfile.TemporaryDirectory(prefix="benchmark_") as logdir:
+        csv_log = ParameterLog(parameter_set, logdir=logdir, log_format="csv")
+        bin_log = ParameterLog(parameter_set, logdir=logdir, log_format="bin")
+        try:
+            yield "crc_16_bytes", lambda: crc_16_bytes(crc_data())
+            yield "crc_16_batch of 1024 payloads", lambda: crc_16_batch(payloads)
+            yield "driver_mk2.pack", lambda: driver_mk2.data_get_send(subsys=0)
+            yield "driver_mk2.unpack", lambda: driver_mk2.data_get_receive(response(), subsys=0)
+            yield "reassemble and unpack", lambda: driver_mk2.data_get_receive(reassemble(response()), subsys=0)
+            yield "ParameterSet.pack", lambda: parameter_set.pack(values())
+            yield "ParameterSet.unpack", lambda: parameter_set.unpack(next_payload())
+            yield "ParameterLog.log_datapoint", lambda: memory_log.log_datapoint(next_payload())
+            yield "ParameterLog.log_datapoint csv", lambda: csv_log.log_datapoint(next_payload())
+            yield "ParameterLog.log_datapoint bin", lambda: bin_log.log_datapoint(next_payload())
+            yield "plot_data after 10k samples", plot_after_10k
+        finally:
+            csv_log.close()
+            bin_log.close()
+
+
+def long_session(parameter_set, payloads, samples: int = 1000000) -> dict:
+    """Log samples into a windowed log with a binary file and plot the last window"""
+    next_payload = cycle(payloads)
+    with tempfile.TemporaryDirectory(prefix="benchmark_") as logdir:
+        log = ParameterLog(parameter_set, logdir=logdir, log_format="bin", window_samples=1 << 16)
+        try:
+            start = time.perf_counter()
+            t = time.time()
+            for i in range(samples):
+                log.log_datapoint(next_payload(), t=t + i * 1e-3)
+            logged = time.perf_counter() - start
+
+            plot, pyramid, width = live_plot(log, "ECU Temp")
+            start = time.perf_counter()
+            plot_live(plot, pyramid, log, "ECU Temp", width)
+            plotted = time.perf_counter() - start
+
+            start = time.perf_counter()
+            log.get_data_series("ECU Temp", start=0.0, end=samples * 1e-3)
+            history = time.perf_counter() - start
+        finally:
+            log.close()
+    return {
+        f"log {samples} samples": samples / logged,
+        f"plot after {samples} samples": 1 / plotted,
+        f"load history of {samples} samples": 1 / history,
+    }
+
+
+def run(only=None) -> dict:
+    parameter_set = ParameterSet(str(params_file), name="Get Parameters", bytes=0x9A, pad=1, check=False)
+    payloads = synthetic_payloads(parameter_set, 1024)
+    results = dict()
+    for name, fn in stages(parameter_set, payloads):
+        if (only and not name in only):
+            continue
+        peak, retained = allocations(fn)
+        results[name] = {"ops_per_sec": ops_per_sec(fn), "peak_bytes": peak, "retained_bytes": retained}
+        print(f"{name:<36} {results[name]['ops_per_sec']:>12.1f} ops/s {peak:>9} B peak {retained:>9.1f} B retained")
+    if (not only):
+        for name, rate in long_session(parameter_set, payloads).items():
+            results[name] = {"ops_per_sec": rate}
+            print(f"{name:<36} {rate:>12.1f} ops/s")
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Stages slower than their baseline by more than tolerance"""
+    regressions = []
+    for name, result in results.items():
+        if (not name in baseline):
+            continue
+        expected = baseline[name]["ops_per_sec"]
+        if (result["ops_per_sec"] < expected * (1 - tolerance)):
+            regressions.append(f"{name}: {result['ops_per_sec']:.1f} ops/s, baseline {expected:.1f} ops/s "
+                               f"({result['ops_per_sec'] / expected - 1:+.0%})")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the protocol, decode, logging and plotting hot paths")
+    parser.add_argument("--save-baseline", action="store_true", help=f"store the results in {baseline_file.name}")
+    parser.add_argument("--tolerance", type=float, default=0.3, help="allowed slowdown against the baseline")
+    parser.add_argument("--only", nargs="+", default=None, help="run only the named stages")
+    args = parser.parse_args()
+
+    results = run(args.only)
+    if (args.save_baseline):
+        with open(baseline_file, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline written to {baseline_file}")
+    elif (baseline_file.is_file()):
+        with open(baseline_file) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for r in regressions:
+            print(f"REGRESSION {r}")
+        if (regressions):
+            sys.exit(1)
+        print("No regressions against the baseline")
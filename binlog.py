@@ -0,0 +1,184 @@
+""" Binary parameter log format
+
+A log file starts with `magic`, the length of the header as a big-endian uint32
+and a utf-8 json header embedding the schema of the parameter set. It is followed
+by fixed-width records of a big-endian float64 timestamp and the raw payload, so
+every parameter sits at its schema offset + 8 within a record.
+
+A sidecar file (log file + ".idx") holds a sparse index of big-endian
+(float64 elapsed time, uint64 file offset) entries for every `index_every` records.
+"""
+
+import csv
+import json
+import struct
+from pathlib import Path
+
+import numpy as np
+
+from log_writer import LogWriter
+
+magic = b"CANLOG\x00\x01"
+index_dtype = np.dtype([('time', '>f8'), ('offset', '>u8')])
+time_struct = struct.Struct(">d")
+
+
+def schema(parameter_set) -> dict:
+    """Describe the layout of a ParameterSet for the log header"""
+    return {
+        "name": parameter_set.set_name,
+        "payload_bytes": parameter_set.byte_length,
+        "parameters": [{"name": p.name, "offset": p.offset, "byte_len": p.byte_len, "signed": p.signed,
+                        "units": p.units} for p in parameter_set],
+    }
+
+
+def record_dtype(schema: dict) -> np.dtype:
+    """Structured dtype of one record: the timestamp followed by the payload fields"""
+    params = schema["parameters"]
+    return np.dtype({
+        'names': ['time'] + [p["name"] for p in params],
+        'formats': ['>f8'] + [f">{'i' if p['signed'] else 'u'}{p['byte_len']}" for p in params],
+        'offsets': [0] + [8 + p["offset"] for p in params],
+        'itemsize': 8 + schema["payload_bytes"],
+    })
+
+
+def encode_header(schema: dict, start_time: float) -> bytes:
+    header = json.dumps(dict(schema, version=1, start_time=start_time)).encode('utf-8')
+    return magic + len(header).to_bytes(4, 'big') + header
+
+
+class BinaryLogWriter(LogWriter):
+    """Writes rows of (time, payload bytes) as fixed-width binary records"""
+
+    def __init__(self, filename, parameter_set, start_time: float, **kwargs):
+        self.schema = schema(parameter_set)
+        self.payload_bytes = parameter_set.byte_length
+        self.pad_byte = parameter_set.pad_byte
+        self.index_file = open(str(filename) + ".idx", 'wb')
+        super(BinaryLogWriter, self).__init__(filename, start_time, **kwargs)
+
+    def encode_header(self) -> bytes:
+        return encode_header(self.schema, self.start_time)
+
+    def encode_row(self, row) -> bytes:
+        t, payload = row
+        if (len(payload) != self.payload_bytes):
+            payload = bytes(payload[:self.payload_bytes]).ljust(self.payload_bytes, self.pad_byte)
+        return time_struct.pack(t) + payload
+
+    def on_index(self, entry):
+        self.index_file.write(np.array([entry], dtype=index_dtype).tobytes())
+
+    def flush(self):
+        super(BinaryLogWriter, self).flush()
+        self.index_file.flush()
+
+    def on_close(self):
+        self.index_file.close()
+
+
+class BinaryLog:
+    """
+    Read access to a binary parameter log through a memory map.
+
+    Records are decoded with the schema embedded in the file, or with the layout
+    of `parameter_set` if given, e.g. to re-decode a capture after the parameter
+    file has been corrected.
+    """
+
+    def __init__(self, filename, parameter_set=None):
+        self.filename = Path(filename)
+        with open(str(self.filename), 'rb') as f:
+            if (f.read(len(magic)) != magic):
+                raise ValueError("Not a binary parameter log!", str(filename))
+            header_len = int.from_bytes(f.read(4), 'big')
+            self.header = json.loads(f.read(header_len).decode('utf-8'))
+        self.data_offset = len(magic) + 4 + header_len
+        self.start_time = self.header["start_time"]
+        self.schema = self.header
+        if (not parameter_set is None):
+            self.schema = schema(parameter_set)
+            if (self.schema["payload_bytes"] != self.header["payload_bytes"]):
+                raise ValueError("Parameter set does not match the payload length of the log!",
+                                 self.schema["payload_bytes"], self.header["payload_bytes"])
+        self.names = [p["name"] for p in self.schema["parameters"]]
+        self.dtype = record_dtype(self.schema)
+
+    @property
+    def count(self) -> int:
+        return (self.filename.stat().st_size - self.data_offset) // self.dtype.itemsize
+
+    def load_index(self) -> np.ndarray:
+        path = Path(str(self.filename) + ".idx")
+        if (not path.is_file()):
+            return np.empty(0, dtype=index_dtype)
+        data = path.read_bytes()
+        return np.frombuffer(data, dtype=index_dtype, count=len(data) // index_dtype.itemsize)
+
+    def records(self, start: float = None, end: float = None) -> np.ndarray:
+        """Memory map the records with elapsed times in [start, end)"""
+        offset = self.data_offset
+        if (not start is None):
+            index = self.load_index()
+            i = int(np.searchsorted(index['time'], start, side='right'))
+            if (i > 0):
+                offset = int(index['offset'][i - 1])
+        count = (self.filename.stat().st_size - offset) // self.dtype.itemsize
+        if (count <= 0):
+            return np.empty(0, dtype=self.dtype)
+        records = np.memmap(str(self.filename), dtype=self.dtype, mode='r', offset=offset, shape=(count,))
+        times = records['time']
+        lo = 0 if (start is None) else int(np.searchsorted(times, self.start_time + start))
+        hi = count if (end is None) else int(np.searchsorted(times, self.start_time + end))
+        return records[lo:hi]
+
+    def series(self, names, start: float = None, end: float = None):
+        """Get native-endian columns and elapsed times of the records in [start, end)"""
+        records = self.records(start, end)
+        columns = {n: records[n].astype(records.dtype.fields[n][0].newbyteorder('=')) for n in names}
+        return columns, records['time'] - self.start_time
+
+
+def csv_to_binlog(csv_file, parameter_set, out_file, index_every: int = 1024):
+    """
+    Convert a csv log with a time column followed by parameter_names columns into a binary log,
+    with a sidecar index every `index_every` records like BinaryLogWriter writes
+    """
+    with open(str(csv_file), newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        rows = [row for row in reader if row]
+    names = header[1:]
+    table = np.array(rows, dtype=np.float64).reshape(len(rows), len(header))
+    start_time = float(table[0, 0]) if (len(rows) > 0) else 0.0
+
+    sch = schema(parameter_set)
+    records = np.zeros(len(rows), dtype=record_dtype(sch))
+    records.view(np.uint8)[:] = parameter_set.pad_byte[0]
+    records['time'] = table[:, 0]
+    for k, n in enumerate(names):
+        records[n] = table[:, k + 1]
+
+    file_header = encode_header(sch, start_time)
+    rows_indexed = np.arange(0, len(records), index_every)
+    index = np.empty(len(rows_indexed), dtype=index_dtype)
+    index['time'] = records['time'][rows_indexed] - start_time
+    index['offset'] = len(file_header) + rows_indexed * records.dtype.itemsize
+
+    with open(str(out_file), 'wb') as f:
+        f.write(file_header)
+        f.write(records.tobytes())
+    with open(str(out_file) + ".idx", 'wb') as f:
+        f.write(index.tobytes())
+
+
+def binlog_to_csv(bin_file, out_file):
+    """Convert a binary log into a csv log with a time column followed by the parameter columns"""
+    log = BinaryLog(bin_file)
+    records = log.records()
+    with open(str(out_file), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["time"] + log.names)
+        writer.writerows(zip(*[records[n].tolist() for n in ["time"] + log.names]))
@@ -0,0 +1,21 @@
+""" The CAN backend selected with the CAN_BACKEND environment variable
+
+"canlib" opens channel 0 of a Kvaser device, "virtual" simulates the ECUs in
+process, see virtual_ecu.py. canlib.canlib loads libcanlib.so when it is imported
+and exits the process without it, so the canlib package is only imported for the
+canlib backend, the virtual backend brings stand-ins for the names the application
+uses.
+"""
+
+import os
+
+channel_backend = os.environ.get("CAN_BACKEND", "canlib")
+
+if (channel_backend == "canlib"):
+    from canlib import Frame, canlib, connected_devices
+    from canlib.canlib import CanNoMsg
+    EXT = canlib.MessageFlag.EXT
+else:
+    from virtual_ecu import CanNoMsg, EXT, Frame
+    canlib = None
+    connected_devices = None
@@ -0,0 +1,194 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from datetime import datetime
+
+from can_backend import CanNoMsg
+from driver_mk2 import *
+from frame_trace import RX, TX
+from reassembler import Reassembler
+import tracing
+
+
+class CanReader(threading.Thread):
+    """
+    Background thread owning the canlib channel.
+
+    Outgoing frames are queued with `write` and sent from this thread, received
+    frames are reassembled into transfers and used to resolve the futures
+    registered with `expect`, or handed to the callbacks registered with
+    `subscribe` for periodic responses. Transfers nobody is waiting for, such as
+    responses arriving after their command timed out, are counted in
+    `unsolicited` and logged.
+
+    Queued frames are written before every read, which blocks for at most
+    `read_timeout` milliseconds, so that bounds how long a command waits to be
+    sent. With `metrics` given, the round trip of every command sent with a
+    future is timed from its last frame being queued to the first and last frame
+    of the response arriving, including that wait.
+
+    Received frames carry the hardware timestamp of the device clock, which is
+    mapped onto host wall-clock time with `clock_offset`, calibrated once when
+    the reader is created.
+    """
+
+    def __init__(self, ch, logger, read_timeout: int = 1, transfer_timeout: float = 1.0, metrics=None,
+                 frame_trace=None):
+        super(CanReader, self).__init__(name="CanReader", daemon=True)
+        self.ch = ch
+        self.logger = logger
+        self.read_timeout = read_timeout
+        self.metrics = metrics
+        self.frame_trace = frame_trace
+
+        self.tx = queue.Queue()
+        self.unsolicited = 0
+
+        self._pending = dict()
+        self._subscriptions = dict()
+        # future -> monotonic time its command was queued, only used on the reader thread
+        self._sent = dict()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+        self.reassembler = Reassembler(transfer_timeout, logger=logger)
+
+        self.clock_offset = None
+        self.calibrate()
+
+    def calibrate(self):
+        """Measure the offset of the device clock against host wall-clock time"""
+        if (self.ch is None):
+            return
+        before = time.time()
+        ticks = self.ch.readTimer()
+        after = time.time()
+        self.clock_offset = (before + after) / 2 - ticks / 1000
+        self.logger.info(f"{datetime.now().isoformat()} -> Device clock calibrated: offset {self.clock_offset:.6f} s, "
+                         f"uncertainty {(after - before) / 2 * 1000:.3f} ms")
+
+    def frame_time(self, frames):
+        """Wall-clock time of the first frame of a transfer from its hardware timestamp, None if unavailable"""
+        if (self.clock_offset is None or frames[0].timestamp is None):
+            return None
+        return self.clock_offset + frames[0].timestamp / 1000
+
+    def write(self, frame, future: Future = None):
+        """Queue a frame, the future expecting the response should be given with the last frame of a command"""
+        self.tx.put((frame, future, time.monotonic()))
+
+    def expect(self, subsys_id: int, cmd_id: int, timeout: float = 1.0, match=None) -> Future:
+        """
+        Register interest in the response to a command, must be called before the command is sent.
+        With `match` only transfers it returns True for resolve the future, others go on to the
+        subscription of the command, e.g. the periodic responses a command is sent among.
+        """
+        future = Future()
+        with self._lock:
+            self._pending.setdefault((subsys_id, cmd_id), deque()).append((future, time.monotonic() + timeout, match))
+        return future
+
+    def subscribe(self, subsys_id: int, cmd_id: int, callback):
+        """Register a callback receiving every unrequested response to a command, called on the reader thread"""
+        with self._lock:
+            self._subscriptions[(subsys_id, cmd_id)] = callback
+
+    def unsubscribe(self, subsys_id: int, cmd_id: int):
+        with self._lock:
+            self._subscriptions.pop((subsys_id, cmd_id), None)
+
+    def stop(self):
+        self._stop_event.set()
+        if (self.is_alive()):
+            self.join()
+
+    def run(self):
+        while (not self._stop_event.is_set()):
+            self.flush_tx()
+            frame = self.read_frame()
+            if (not frame is None):
+                self.on_frame(frame)
+            self.expire()
+        self.flush_tx()
+
+    def flush_tx(self):
+        while True:
+            try:
+                frame, future, queued = self.tx.get_nowait()
+            except queue.Empty:
+                return
+            if (not self.frame_trace is None):
+                self.frame_trace.frame(TX, frame)
+            if (not self.ch is None):
+                self.ch.write(frame)
+                if (not future is None):
+                    self._sent[future] = queued
+
+    def read_frame(self):
+        if (self.ch is None):
+            time.sleep(self.read_timeout / 1000)
+            return None
+        try:
+            frame = self.ch.read(self.read_timeout)
+        except CanNoMsg:
+            return None
+        if (not self.frame_trace is None):
+            self.frame_trace.frame(RX, frame)
+        return frame
+
+    def on_frame(self, frame):
+        frames = self.reassembler.feed(frame)
+        if (not frames is None):
+            with tracing.span("dispatch", frames=len(frames)):
+                self.dispatch(frames)
+
+    def dispatch(self, frames):
+        src_id, dst_id, ftype, frame_cnt = split_id(frames[0].id)
+        cmd_id = int.from_bytes(frames[0].data[1:3], 'big')
+
+        future = None
+        with self._lock:
+            waiting = self._pending.get((src_id, cmd_id))
+            for entry in list(waiting or ()):
+                if (entry[0].done()):
+                    waiting.remove(entry)
+                elif (entry[2] is None or entry[2](frames)):
+                    waiting.remove(entry)
+                    future = entry[0]
+                    break
+            callback = self._subscriptions.get((src_id, cmd_id))
+
+        if (not future is None):
+            sent = self._sent.pop(future, None)
+            if (not sent is None):
+                now = time.monotonic()
+                if (not self.metrics is None):
+                    self.metrics.record(src_id, cmd_id, self.reassembler.started - sent, now - sent)
+                tracing.complete(f"wait {COMMAND_NAMES.get(cmd_id, hex(cmd_id))}", sent, now)
+            future.set_result(frames)
+        elif (not callback is None):
+            try:
+                callback(frames)
+            except Exception:
+                self.logger.exception(f"{datetime.now().isoformat()} -> Subscription callback failed")
+        else:
+            self.unsolicited += 1
+            self.logger.warning(f"{datetime.now().isoformat()} -> Dropped unsolicited "
+                                f"{COMMAND_NAMES.get(cmd_id, hex(cmd_id))} transfer from {hex(src_id)}: "
+                                f"id {hex(frames[0].id)}, {self.unsolicited} so far")
+
+    def expire(self):
+        now = time.monotonic()
+        self.reassembler.expire(now)
+        expired = []
+        with self._lock:
+            for key, waiting in self._pending.items():
+                while (waiting and waiting[0][1] <= now):
+                    expired.append((key, waiting.popleft()[0]))
+        for key, future in expired:
+            if (not self._sent.pop(future, None) is None and not self.metrics is None):
+                self.metrics.timeout(*key)
+            if (not future.done()):
+                future.set_exception(CanNoMsg())
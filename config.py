@@ -1,35 +1,89 @@
+from concurrent.futures import Future
+from functools import lru_cache
 from pathlib import Path
 
-from canlib import canlib, Frame, connected_devices
-from canlib.canlib import MessageFlag
-
-from params import ParameterSet, ParameterLog
+from can_backend import EXT, CanNoMsg, Frame, canlib, channel_backend, connected_devices
+from can_reader import CanReader
+from frame_trace import BinaryFrameTrace, LazyQueueHandler, TextFrameTrace
+from metrics import LatencyMetrics
+import tracing
+from params import ParameterSet, ParameterLog, get_params_file, sent_params_file
 from presets import PresetList
+from virtual_ecu import VirtualEcuChannel
 
 from driver_mk2 import *
 
 from datetime import datetime
+from logging.handlers import QueueListener
 import logging
+import queue
 import sys
 
-sent_params_file = "parameters_send.csv"
-get_params_file = "parameters_get.csv"
-
 logdir = "./logs"
 
+response_timeout = 1.0
+
+# in-memory window of the parameter log, older samples are only kept in the log file
+log_window_samples = None
+log_window_seconds = 600.0
+
+# log file writes are batched and flushed after this many seconds or bytes
+log_flush_interval = 1.0
+log_flush_bytes = 1 << 16
+log_fsync = False
+
+# "csv" for text logs, "bin" for binary logs with an embedded schema and time index, see binlog.py
+log_format = "csv"
+# store only raw payloads and decode columns when they are read, requires the "bin" format
+log_raw = False
+
+# "text" logs every frame sent and received at DEBUG level, "bin" writes them to a compact binary trace
+# next to the session log instead, see frame_trace.py, which replay.py can feed back through decoding.
+# None disables frame tracing
+frame_trace_format = "text"
+
+# cap on how often the live plot is redrawn, independent of the sampling period
+render_fps = 10
+
+# channel_backend is chosen with the CAN_BACKEND environment variable, see can_backend.py
+# settings of the simulated ECUs, see VirtualEcu
+virtual_ecu_settings = {"latency": 0.002, "jitter": 0.0005, "drop_rate": 0.0, "frame_drop_rate": 0.0,
+                        "crc_error_rate": 0.0, "error_rate": 0.0}
+
 DEBUGGING = False
 
 def gen_frame(hx_id: int, hx_data: bytes) -> Frame:
     """Create a Frame from CAN id in hex and data in bytearray"""
-    return Frame(hx_id, hx_data, flags=MessageFlag.EXT)
+    return Frame(hx_id, hx_data, flags=EXT)
+
+
+@lru_cache(maxsize=FRAME_CACHE_SIZE)
+def gen_frames(frames: tuple) -> tuple:
+    """Create the Frames of an encoded command, repeated commands reuse them as they are never modified once sent"""
+    return tuple(gen_frame(frame[0], frame[1]) for frame in frames)
+
+
+def command_key(frames):
+    """Get the (subsystem id, command id) a response to the given command frames is dispatched by"""
+    src_id, dst_id, ftype, frame_cnt = split_id(frames[0][0])
+    return dst_id, int.from_bytes(frames[0][1][1:3], 'big')
 
 
 class Config:
     def __init__(self):
         self.print_log_filename = Path(logdir) / datetime.now().strftime("%Y_%b_%d-%H_%M_%S.log")
         self.targets = logging.StreamHandler(sys.stdout), logging.FileHandler(str(self.print_log_filename), encoding="utf-8")
-        logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.DEBUG, handlers=self.targets, encoding="utf-8")
+        for target in self.targets:
+            target.setFormatter(logging.Formatter('%(levelname)s: %(message)s'))
+        # records are formatted and written by the listener thread, not by the threads logging them
+        self.log_queue = queue.SimpleQueue()
+        self.log_listener = QueueListener(self.log_queue, *self.targets)
+        logging.basicConfig(level=logging.DEBUG, handlers=[LazyQueueHandler(self.log_queue)])
+        self.log_listener.start()
         self.logger = logging.getLogger(__name__)
+        self.metrics = LatencyMetrics()
+        self.metrics_filename = self.print_log_filename.with_suffix(".metrics.json")
+        self.trace_filename = self.print_log_filename.with_suffix(".trace.json")
 
         self.test_mode = False
         self.initialized = False
@@ -41,54 +95,139 @@ class Config:
         self.get_log: ParameterLog = None
 
         self.ch = None
+        self.reader: CanReader = None
+        # subsystem index -> (frames, interval count) of its repeating DATA_GET
+        self.streams = dict()
+        self.frame_trace = None
 
         self.logger.info(self.sent_parameters)
         self.logger.info(self.get_parameters)
 
         self.logger.info('Setting up CANLib...')
-        for dev in connected_devices():
-            self.logger.debug(str(dev.probe_info()))
+        if (channel_backend == "canlib"):
+            for dev in connected_devices():
+                self.logger.debug(str(dev.probe_info()))
 
+        self.new_frame_trace()
         self.set_up_channel()
         self.logger.info('CanLib setup complete!')
-        self.logger.debug(f"canlib version: {str(canlib.dllversion())}")
+        if (channel_backend == "canlib"):
+            self.logger.debug(f"canlib version: {str(canlib.dllversion())}")
 
     def exit(self):
         self.logger.info("exiting")
+        self.remove_channel()
+        self.close_log()
+        self.export_metrics()
+        if (len(tracing.events) > 0):
+            self.export_trace()
+        if (not self.frame_trace is None):
+            self.frame_trace.close()
+        self.log_listener.stop()
+
+    def new_frame_trace(self):
+        if (frame_trace_format == "bin"):
+            self.frame_trace = BinaryFrameTrace(self.print_log_filename.with_suffix(".ftrace"))
+        elif (frame_trace_format == "text"):
+            self.frame_trace = TextFrameTrace()
+        elif (not frame_trace_format is None):
+            raise ValueError("Unknown frame trace format!", frame_trace_format)
 
     def new_log(self):
-        self.get_log = ParameterLog(self.get_parameters, logdir=logdir)
+        self.close_log()
+        self.get_log = ParameterLog(self.get_parameters, logdir=logdir, window_samples=log_window_samples,
+                                    window_seconds=log_window_seconds, flush_interval=log_flush_interval,
+                                    flush_bytes=log_flush_bytes, fsync=log_fsync, log_format=log_format,
+                                    raw=log_raw)
+
+    def close_log(self):
+        if (not self.get_log is None):
+            self.get_log.close()
 
     def set_up_channel(self):
-        if (not DEBUGGING):
+        if (channel_backend == "virtual"):
+            self.ch = VirtualEcuChannel(ParameterSet(get_params_file, name="Virtual ECU Parameters", bytes=0x9A, pad=1,
+                                                     check=False), **virtual_ecu_settings)
+            self.ch.busOn()
+        elif (channel_backend != "canlib"):
+            raise ValueError("Unknown channel backend!", channel_backend)
+        elif (not DEBUGGING):
             self.ch = canlib.openChannel(channel=0, bitrate=canlib.Bitrate.BITRATE_1M)
             self.ch.busOn()
+        self.reader = CanReader(self.ch, self.logger, metrics=self.metrics, frame_trace=self.frame_trace)
+        self.reader.start()
 
     def remove_channel(self):
+        # the ECU keeps repeating DATA_GET responses until a stream is cancelled
+        futures = [(subsys, self.stop_stream(subsys)) for subsys in list(self.streams)]
+        for subsys, future in futures:
+            try:
+                future.result()
+                self.logger.info(f"{datetime.now().isoformat()} -> DATA_GET (cancel repeat) of ECU {subsys + 1} answered")
+            except CanNoMsg:
+                self.logger.error(f"{datetime.now().isoformat()} -> DATA_GET (cancel repeat) of ECU {subsys + 1} timed out!")
+        if (not self.reader is None):
+            self.reader.stop()
+            self.reader = None
         if (not self.ch is None):
             self.ch.busOff()
             self.ch.close()
-
-    def send_frames(self, frames):
-        for frame in frames:
-            self.logger.debug(f"{datetime.now().isoformat()} -> CAN sending: id {hex(frame[0])} | data {frame[1].hex()}")
-            if (not DEBUGGING):
-                self.ch.write(gen_frame(frame[0], frame[1]))
-
-    def receive_frame(self, timeout: int) -> Frame:
-        frame = self.ch.read(timeout)
-        self.logger.debug(f"{datetime.now().isoformat()} -> CAN receive: id {hex(frame.id)} | data {frame.data.hex()}")
-        return frame
-
-    def poll_frames(self):
-        frame = self.receive_frame(1000)
-        buffer = frame.id
-        buffer >>= pad_bits
-        frame_cnt = buffer & ((1 << 8) - 1)
-
-        frames = [frame]
-        for i in range(frame_cnt):
-
-            frame = self.receive_frame(-1)
-            frames.append(frame)
-        return frames
+            self.ch = None
+
+    def send_frames(self, frames, future: Future = None):
+        with tracing.span("send_frames", frames=len(frames)):
+            # frames are traced by the reader when they are written, without a channel they are only traced
+            frames = gen_frames(tuple(frames))
+            for frame in frames[:-1]:
+                self.reader.write(frame)
+            self.reader.write(frames[-1], future)
+
+    def request(self, frames, timeout: float = response_timeout, match=None) -> Future:
+        """Send a command and return a future resolving to the frames of its response, see CanReader.expect"""
+        future = self.reader.expect(*command_key(frames), timeout, match)
+        self.send_frames(frames, future)
+        return future
+
+    def subscribe(self, frames, callback):
+        """Send a repeating command, callback receives the frames of every periodic response on the reader thread"""
+        self.reader.subscribe(*command_key(frames), callback)
+        self.send_frames(frames)
+
+    def unsubscribe(self, frames):
+        self.reader.unsubscribe(*command_key(frames))
+
+    def start_stream(self, interval_count: int, callback, subsys: int = 0):
+        """
+        Start a repeating DATA_GET, callback receives the frames of every response on the reader thread.
+        The interval count is raised to what the bus can carry, see DATA_GET_MIN_INTERVAL.
+        """
+        interval_count = max(interval_count, DATA_GET_MIN_INTERVAL)
+        frames = data_get_send(repeat=True, interval_count=interval_count, subsys=subsys)
+        self.streams[subsys] = (frames, interval_count)
+        self.subscribe(frames, callback)
+
+    def stop_stream(self, subsys: int = 0, timeout: float = response_timeout) -> Future:
+        """
+        Cancel a repeating DATA_GET with a single one. Responses of the stream keep arriving until the ECU
+        has processed it, so the single one is sent with another interval count and its response is told
+        apart by the interval count it echoes. The stream stays subscribed until then.
+        """
+        frames, interval_count = self.streams.pop(subsys)
+        cancel_count = 2 if (interval_count == 1) else 1
+        future = self.request(data_get_send(interval_count=cancel_count, subsys=subsys), timeout,
+                              match=lambda response: data_get_interval(response) == cancel_count)
+        reader = self.reader
+        future.add_done_callback(lambda f: reader.unsubscribe(*command_key(frames)))
+        return future
+
+    def export_metrics(self):
+        self.metrics.export(self.metrics_filename)
+        self.logger.info(f"{datetime.now().isoformat()} -> Command latency metrics written to {self.metrics_filename}")
+
+    def export_trace(self):
+        tracing.export(self.trace_filename)
+        self.logger.info(f"{datetime.now().isoformat()} -> Trace of {len(tracing.events)} spans written to {self.trace_filename}")
+
+    def frame_time(self, frames):
+        """Wall-clock time the ECU sent a response, from hardware timestamps, None if unavailable"""
+        return self.reader.frame_time(frames)
@@ -1,6 +1,14 @@
 """ Util module for generating CRC-16 checksums
+
+Checksums are computed two bytes at a time with `word_table`: the register is as
+wide as a 16 bit word, so shifting in a word w gives word_table[crc ^ w]. `Crc16`
+folds data in chunk by chunk, `crc_16_batch` checksums many payloads at once.
 """
 
+import struct
+
+import numpy as np
+
 crc_table = []
 
 #with open('lookup.txt', 'r') as f:
@@ -20,20 +28,92 @@ for i in range(0, 256):
             b = (b << 1) & bitmask
     crc_table.append(b)
 
+# two byte steps of every register value with zero input
+_table = np.array(crc_table, dtype=np.uint32)
+_words = np.arange(1 << bits, dtype=np.uint32)
+_step = ((_words & 0xff) << 8) ^ _table[_words >> 8]
+word_table_array = ((((_step << 8) & bitmask) ^ _table[_step >> 8])).astype(np.uint16)
+word_table = word_table_array.tolist()
+
+_word_structs = dict()
+
+
+def crc_16_update(crc: int, data) -> int:
+    """Shift bytes-like data into the register crc"""
+    n = len(data) >> 1
+    if (n):
+        unpack = _word_structs.get(n)
+        if (unpack is None):
+            unpack = _word_structs[n] = struct.Struct(f">{n}H").unpack_from
+        table = word_table
+        for word in unpack(data):
+            crc = table[crc ^ word]
+    if (len(data) & 1):
+        crc = ((crc << 8) & 0xffff) ^ crc_table[(crc >> 8) ^ data[-1]]
+    return crc
+
 
 def crc_16(arr: bytearray) -> str:
     """Get CRC-16 checksum for data"""
-    crc = 0
-    for byte in arr:
-        lookup_index = ((crc >> 8) ^ byte) & 0xff
-        crc = ((crc << 8) & 0xffff) ^ crc_table[lookup_index]
-    return f'{crc:0>4X}'
+    return f'{crc_16_update(0, bytes(arr)):0>4X}'
 
 
 def crc_16_bytes(arr: bytes) -> bytes:
     """Get CRC-16 checksum for data"""
-    crc = 0
-    for byte in arr:
-        lookup_index = ((crc >> 8) ^ byte) & 0xff
-        crc = ((crc << 8) & 0xffff) ^ crc_table[lookup_index]
-    return crc.to_bytes(2, "big")
+    return crc_16_update(0, arr).to_bytes(2, "big")
+
+
+class Crc16:
+    """
+    Incremental CRC-16 checksum.
+
+    Updating with consecutive chunks of data gives the checksum of their
+    concatenation, chunks may have any length.
+    """
+
+    __slots__ = ('crc',)
+
+    def __init__(self, data=b"", crc: int = 0):
+        self.crc = crc
+        if (data):
+            self.update(data)
+
+    def update(self, data):
+        self.crc = crc_16_update(self.crc, data)
+        return self
+
+    def digest(self) -> bytes:
+        return self.crc.to_bytes(2, "big")
+
+    def hexdigest(self) -> str:
+        return f'{self.crc:0>4X}'
+
+    def copy(self):
+        return Crc16(crc=self.crc)
+
+
+def crc_16_batch(payloads) -> np.ndarray:
+    """
+    Get the CRC-16 checksums of many payloads as a uint16 array.
+
+    `payloads` is a sequence of bytes-like objects or a 2D uint8 array with a
+    payload per row. Shorter payloads are padded with leading zeros, which leave
+    a register of 0 unchanged, so all rows are shifted in word by word together.
+    """
+    if (isinstance(payloads, np.ndarray)):
+        rows = np.atleast_2d(payloads).astype(np.uint8, copy=False)
+        if (rows.shape[1] & 1):
+            rows = np.pad(rows, ((0, 0), (1, 0)))
+    else:
+        width = max((len(p) for p in payloads), default=0)
+        width += width & 1
+        rows = np.zeros((len(payloads), width), dtype=np.uint8)
+        for i, p in enumerate(payloads):
+            if (len(p)):
+                rows[i, width - len(p):] = np.frombuffer(bytes(p), dtype=np.uint8)
+
+    words = (rows[:, 0::2].astype(np.uint16) << 8) | rows[:, 1::2]
+    crc = np.zeros(len(rows), dtype=np.uint16)
+    for j in range(words.shape[1]):
+        crc = word_table_array[crc ^ words[:, j]]
+    return crc
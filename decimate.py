@@ -0,0 +1,198 @@
+""" Level of detail decimation for plotting long time series
+
+Series are reduced to the minimum and maximum of each bucket of samples, in time
+order, so spikes survive decimation no matter how far the plot is zoomed out.
+"""
+
+import numpy as np
+
+fields = ('t_first', 't_last', 't_min', 'y_min', 't_max', 'y_max')
+
+
+def minmax_points(t_min, y_min, t_max, y_max):
+    """Interleave the min and max point of every bucket in time order"""
+    first = t_min <= t_max
+    t = np.empty(2 * len(t_min), dtype=np.float64)
+    y = np.empty(2 * len(t_min), dtype=np.float64)
+    t[0::2] = np.where(first, t_min, t_max)
+    t[1::2] = np.where(first, t_max, t_min)
+    y[0::2] = np.where(first, y_min, y_max)
+    y[1::2] = np.where(first, y_max, y_min)
+    return t, y
+
+
+def bucket_stats(t, y, size: int):
+    """Min/max statistics of consecutive buckets of `size` samples, trailing samples are ignored"""
+    n = len(t) // size
+    t = np.asarray(t[:n * size]).reshape(n, size)
+    y = np.asarray(y[:n * size]).reshape(n, size)
+    rows = np.arange(n)
+    i_min = np.argmin(y, axis=1)
+    i_max = np.argmax(y, axis=1)
+    return {'t_first': t[:, 0], 't_last': t[:, -1], 't_min': t[rows, i_min], 'y_min': y[rows, i_min],
+            't_max': t[rows, i_max], 'y_max': y[rows, i_max]}
+
+
+def minmax_decimate(t, y, width: int):
+    """Decimate a series to about 2 * width points"""
+    if (len(t) <= 2 * width):
+        return t, y
+    size = -(-len(t) // width)
+    stats = bucket_stats(t, y, size)
+    bt, by = minmax_points(stats['t_min'], stats['y_min'], stats['t_max'], stats['y_max'])
+    rest = len(stats['t_first']) * size
+    return np.concatenate((bt, t[rest:])), np.concatenate((by, y[rest:]))
+
+
+class Level:
+    """Growable arrays of bucket statistics"""
+
+    def __init__(self, size: int):
+        self.size = size
+        # number of buckets trimmed from the front
+        self.start = 0
+        self.count = 0
+        self.capacity = 0
+        self.data = {f: np.empty(0, dtype=np.float64) for f in fields}
+
+    def __getitem__(self, item):
+        return self.data[item][:self.count]
+
+    def extend(self, stats):
+        k = len(stats['t_first'])
+        if (self.count + k > self.capacity):
+            self.capacity = max(2 * self.capacity, self.count + k, 64)
+            for f in fields:
+                column = np.empty(self.capacity, dtype=np.float64)
+                column[:self.count] = self.data[f][:self.count]
+                self.data[f] = column
+        for f in fields:
+            self.data[f][self.count:self.count + k] = stats[f]
+        self.count += k
+
+    def trim(self, t: float):
+        """Drop buckets ending before t, the arrays are compacted the next time they grow"""
+        k = int(np.searchsorted(self['t_last'], t))
+        if (k > 0):
+            self.data = {f: self.data[f][k:] for f in fields}
+            self.start += k
+            self.count -= k
+            self.capacity -= k
+
+
+class MinMaxPyramid:
+    """
+    Multi-resolution min/max summary of a growing time series.
+
+    Level 0 summarises buckets of `base` samples, every further level combines
+    `factor` buckets of the level below. Samples are added incrementally with
+    `extend`, incomplete buckets are kept pending until they fill up. `query`
+    picks the coarsest level that still gives about two points per pixel for the
+    visible range and fills in unaligned edges from finer levels and raw samples.
+    """
+
+    def __init__(self, base: int = 4, factor: int = 4, levels: int = 10):
+        self.levels = [Level(base * factor ** k) for k in range(levels)]
+        self.factor = factor
+        self.last_t = None
+        self._pending_t = np.empty(0, dtype=np.float64)
+        self._pending_y = np.empty(0, dtype=np.float64)
+
+    def extend(self, t, y):
+        """Add the samples of a series that are newer than the last added one"""
+        if (not self.last_t is None):
+            i = int(np.searchsorted(t, self.last_t, side='right'))
+            t, y = t[i:], y[i:]
+        if (len(t) == 0):
+            return
+        self.last_t = t[-1]
+        self._pending_t = np.concatenate((self._pending_t, t))
+        self._pending_y = np.concatenate((self._pending_y, y))
+
+        base = self.levels[0].size
+        stats = bucket_stats(self._pending_t, self._pending_y, base)
+        used = len(stats['t_first']) * base
+        self._pending_t = self._pending_t[used:]
+        self._pending_y = self._pending_y[used:]
+        self.levels[0].extend(stats)
+
+        for lower, upper in zip(self.levels, self.levels[1:]):
+            # first bucket of the lower level that is not yet part of an upper bucket
+            first = (upper.start + upper.count) * self.factor - lower.start
+            if (first < 0):
+                upper.start += -(first // self.factor)
+                first %= self.factor
+            n = (lower.count - first) // self.factor
+            if (n <= 0):
+                break
+            upper.extend(self.combine(lower, first, n))
+
+    def combine(self, lower: Level, first: int, n: int):
+        stop = first + n * self.factor
+        rows = np.arange(n)
+        y_min = lower['y_min'][first:stop].reshape(n, self.factor)
+        y_max = lower['y_max'][first:stop].reshape(n, self.factor)
+        i_min = np.argmin(y_min, axis=1)
+        i_max = np.argmax(y_max, axis=1)
+        return {'t_first': lower['t_first'][first:stop:self.factor],
+                't_last': lower['t_last'][first + self.factor - 1:stop:self.factor],
+                't_min': lower['t_min'][first:stop].reshape(n, self.factor)[rows, i_min],
+                'y_min': y_min[rows, i_min],
+                't_max': lower['t_max'][first:stop].reshape(n, self.factor)[rows, i_max],
+                'y_max': y_max[rows, i_max]}
+
+    def trim(self, t: float):
+        """Forget buckets that ended before t, for series that only keep a window in memory"""
+        for level in self.levels:
+            level.trim(t)
+
+    def query(self, t, y, t0: float, t1: float, width: int):
+        """Get about 2 * width points of the series t, y within [t0, t1]"""
+        lo = int(np.searchsorted(t, t0))
+        hi = int(np.searchsorted(t, t1, side='right'))
+        n = hi - lo
+        if (n <= 2 * width):
+            return t[lo:hi], y[lo:hi]
+        level = 0
+        while (level + 1 < len(self.levels) and self.levels[level].size * width < n):
+            level += 1
+        segments = []
+        self._collect(t, y, t0, t1, level, segments)
+        return np.concatenate([s[0] for s in segments]), np.concatenate([s[1] for s in segments])
+
+    def latest(self, width: int):
+        """
+        Get about 2 * width points of everything added since the last trim from the buckets and the
+        pending samples alone, so the cost does not grow with the length of the series
+        """
+        first = self.levels[0]
+        if (first.count == 0):
+            return self._pending_t, self._pending_y
+        n = first.count * first.size + len(self._pending_t)
+        level = 0
+        while (level + 1 < len(self.levels) and self.levels[level].size * width < n):
+            level += 1
+        segments = []
+        # level 0 starts at the first bucket, so only samples after the last bucket come from the pending ones
+        self._collect(self._pending_t, self._pending_y, first['t_first'][0], self.last_t, level, segments)
+        return np.concatenate([s[0] for s in segments]), np.concatenate([s[1] for s in segments])
+
+    def _collect(self, t, y, t0: float, t1: float, level: int, segments):
+        """Collect points for [t0, t1] from whole buckets of a level and finer data at the edges"""
+        if (t1 < t0):
+            return
+        if (level < 0):
+            lo = int(np.searchsorted(t, t0))
+            hi = int(np.searchsorted(t, t1, side='right'))
+            segments.append((t[lo:hi], y[lo:hi]))
+            return
+        buckets = self.levels[level]
+        b0 = int(np.searchsorted(buckets['t_first'], t0))
+        b1 = int(np.searchsorted(buckets['t_last'], t1, side='right'))
+        if (b1 <= b0):
+            self._collect(t, y, t0, t1, level - 1, segments)
+            return
+        self._collect(t, y, t0, np.nextafter(buckets['t_first'][b0], -np.inf), level - 1, segments)
+        segments.append(minmax_points(buckets['t_min'][b0:b1], buckets['y_min'][b0:b1],
+                                      buckets['t_max'][b0:b1], buckets['y_max'][b0:b1]))
+        self._collect(t, y, np.nextafter(buckets['t_last'][b1 - 1], np.inf), t1, level - 1, segments)
@@ -1,258 +1,101 @@
-from crc import crc_16_bytes
 from datetime import datetime
 
-ID = [0xCC]
-OBC_ID = 0x7d0
+from protocol import Frames, bitmask, bounded, ceildiv, variants
 
-SRC_BITS = 12
-DEST_BITS = 8
-FTYPE_BITS = 1
-FCNT_BITS = 8
+protocol = variants["mk1"]
 
-pad_bits = 29 - SRC_BITS - DEST_BITS - FTYPE_BITS - FCNT_BITS
+ID = list(protocol.subsys_ids)
+OBC_ID = protocol.obc_id
 
-def init_payload_send(test=True):
-    preamble = [0x58, 0x44, 0x41, 0x54]
-    ftype = [0x01]
-    cid = ID
-    cmd_id = [0x00, 0x00]
-    length = [0x01]
-    param = [0x01 if test else 0x00]
+SRC_BITS = protocol.layout.src_bits
+DEST_BITS = protocol.layout.dest_bits
+FTYPE_BITS = protocol.layout.ftype_bits
+FCNT_BITS = protocol.layout.fcnt_bits
 
-    return pack(preamble, ftype, cid, cmd_id, length, param)
+pad_bits = protocol.layout.pad_bits
 
+split_id = protocol.split_id
+pack = protocol.pack
+unpack = protocol.unpack
 
-def init_payload_receive(frames):
-    ftype = [0x00]
-    cid = ID
-    cmd_id = [0x00, 0x00]
-    length = [0x02]
+def init_payload_send(test=True):
+    return protocol.send("INIT_PAYL", [0x01 if test else 0x00])
 
-    return unpack(frames, ftype, cid, cmd_id, length)
 
+def init_payload_receive(frames):
+    return protocol.receive(frames, "INIT_PAYL")
 
-def pma_test_send(params):
-    preamble = [0x58, 0x44, 0x41, 0x54]
-    ftype = [0x01]
-    cid = ID
-    cmd_id = [0x00, 0x07]
-    length = [0x16]
-    param = params
 
-    return pack(preamble, ftype, cid, cmd_id, length, param)
+def pma_test_send(params):
+    return protocol.send("PMA_TEST", params)
 
 
 def ppu_test_send(params):
-    preamble = [0x58, 0x44, 0x41, 0x54]
-    ftype = [0x01]
-    cid = ID
-    cmd_id = [0x00, 0x08]
-    length = [0x0C]
-    param = params
-
-    return pack(preamble, ftype, cid, cmd_id, length, param)
+    return protocol.send("PPU_TEST", params)
 
 
 def set_time_send(yr, month, day, hour, mins, secs):
     t = datetime(yr, month, day, hour, mins, secs)
-
-    preamble = [0x58, 0x44, 0x41, 0x54]
-    ftype = [0x01]
-    cid = ID
-    cmd_id = [0x00, 0x01]
-    length = [0x13]
     # param = t.strftime("%Y-%m-%dT%H:%M:%S")
-    param = [int(i) for i in bytes(t.isoformat(), 'utf-8')]
-
-    return pack(preamble, ftype, cid, cmd_id, length, param)
+    return protocol.send("SET_TIME", bytes(t.isoformat(), 'utf-8'))
 
 
 def start_operation_send(stndby=False, ignite=True):
-    preamble = [0x58, 0x44, 0x41, 0x54]
-    ftype = [0x01]
-    cid = ID
-    cmd_id = [0x00, 0x02]
-    length = [0x02]
-    param = [0x01 if stndby else 0x00, 0x01 if ignite else 0x00]
-
-    return pack(preamble, ftype, cid, cmd_id, length, param)
+    return protocol.send("START_OPERATION", [0x01 if stndby else 0x00, 0x01 if ignite else 0x00])
 
 
 def start_operation_receive(frames):
-    ftype = [0x00]
-    cid = ID
-    cmd_id = [0x00, 0x02]
-    length = [0x04]
-
-    return unpack(frames, ftype, cid, cmd_id, length)
+    return protocol.receive(frames, "START_OPERATION")
 
 
 def stop_operation_send():
-    preamble = [0x58, 0x44, 0x41, 0x54]
-    ftype = [0x01]
-    cid = ID
-    cmd_id = [0x00, 0x03]
-    length = [0x01]
-    param = [0x00]
-
-    return pack(preamble, ftype, cid, cmd_id, length, param)
+    return protocol.send("STOP_OPERATION", [0x00])
 
 
 def stop_operation_receive(frames):
-    ftype = [0x00]
-    cid = ID
-    cmd_id = [0x00, 0x03]
-    length = [0x02]
-
-    return unpack(frames, ftype, cid, cmd_id, length)
+    return protocol.receive(frames, "STOP_OPERATION")
 
 
 # Retry counter (0x01 ~ 0x03) Retry counter to cut off the power
 # Power off time count (0x01~0xFF) Remaining time count to cut off the power. One count is 100 milliseconds
 def stop_payload_send(retry_count=0x03, pwroff_delay=0xff):
-    preamble = [0x58, 0x44, 0x41, 0x54]
-    ftype = [0x01]
-    cid = ID
-    cmd_id = [0x00, 0x04]
-    length = [0x02]
-    param = [bounded(retry_count, 0x01, 0x03), bounded(pwroff_delay, 0x01, 0xff)]
-
-    return pack(preamble, ftype, cid, cmd_id, length, param)
+    return protocol.send("STOP_PAYL", [bounded(retry_count, 0x01, 0x03), bounded(pwroff_delay, 0x01, 0xff)])
 
 
 def stop_payload_receive(frames):
-    ftype = [0x00]
-    cid = ID
-    cmd_id = [0x00, 0x04]
-    length = [0x02]
-
-    return unpack(frames, ftype, cid, cmd_id, length)
+    return protocol.receive(frames, "STOP_PAYL")
 
 
 def data_get_send(repeat=False, interval_count=0x0001, size=0x0054, addr=0x00CC):
-    preamble = [0x58, 0x44, 0x41, 0x54]
-    ftype = [0x01]
-    cid = ID
-    cmd_id = [0x00, 0x05]
-    length = [0x08]
-
     intv_bytes = bounded(interval_count, 0x0001, 0xffff).to_bytes(2, 'big')
     size_bytes = bounded(size, 0x0001, 0xffff).to_bytes(2, 'big')
     addr_bytes = addr.to_bytes(2, 'big')
 
-    param = [0x01, 0x01 if repeat else 0x00, intv_bytes[0], intv_bytes[1], size_bytes[0], size_bytes[1], addr_bytes[0],
-             addr_bytes[1]]
+    param = bytes([0x01, 0x01 if repeat else 0x00]) + intv_bytes + size_bytes + addr_bytes
 
-    return pack(preamble, ftype, cid, cmd_id, length, param)
+    return protocol.send("DATA_GET", param)
 
 
 def data_get_receive(frames):
-    ftype = [0x00]
-    cid = ID
-    cmd_id = [0x00, 0x05]
-    length = [0x5c]
-
-    return unpack(frames, ftype, cid, cmd_id, length)
+    return protocol.receive(frames, "DATA_GET")
 
 
 def data_send_send(data, addr=0x00CC):
-    preamble = [0x58, 0x44, 0x41, 0x54]
-    ftype = [0x01]
-    cid = ID
-    cmd_id = [0x00, 0x06]
-    length = [0x5c]
-
     size = len(data)
     if size > 90:
         return None
     size_bytes = bounded(size, 0x0001, 0xffff).to_bytes(2, 'big')
     addr_bytes = addr.to_bytes(2, 'big')
 
-    param = [0x01, 0x00, 0x00, 0x01, size_bytes[0], size_bytes[1], addr_bytes[0], addr_bytes[1]] + list(data)
+    param = bytes([0x01, 0x00, 0x00, 0x01]) + size_bytes + addr_bytes + bytes(data)
 
-    return pack(preamble, ftype, cid, cmd_id, length, param)
+    return protocol.send("DATA_SEND", param)
 
 def data_send_receive(frames):
-    ftype = [0x00]
-    cid = ID
-    cmd_id = [0x00, 0x06]
-    length = [0x02]
-
-    return unpack(frames, ftype, cid, cmd_id, length)
-
-
-def pack(preamble, frame_type, subsys_id, cmd_id, length, param):
-    crc_data = bytes(preamble + frame_type + subsys_id + cmd_id + length + param)
-    crc = crc_16_bytes(crc_data)
-
-    can_data = bytes(frame_type + cmd_id + length + param) + crc
-    can_data_len = len(can_data)
-
-    frame_cnt = ceildiv(can_data_len, 8)
-    fragments = [can_data[i * 8:min((i + 1) * 8, len(can_data))] for i in range(frame_cnt)]
-
-    frames = []
-    for i in range(frame_cnt):
-        can_id = (OBC_ID & bitmask(SRC_BITS)) << (DEST_BITS + FTYPE_BITS + FCNT_BITS)
-        can_id |= (subsys_id[0] & bitmask(DEST_BITS)) << (FTYPE_BITS + FCNT_BITS)
-        can_id |= ((0 if (frame_cnt == 1) else 1) & bitmask(FTYPE_BITS)) << FCNT_BITS
-        can_id |= ((frame_cnt - 1) - i) & bitmask(FCNT_BITS)
-
-        frames.append((can_id, fragments[i]))
-
-    return frames
-
-
-def unpack(frames, frame_type, subsys_id, cmd_id, length):
-    data = bytearray()
-    for i in range(len(frames)):
-        frame = frames[i]
-        buffer = frame.id
-        frame_cnt = buffer & bitmask(FCNT_BITS)
-        if frame_cnt != len(frames) - i - 1:
-            return f"Identifier frame count Mismatch: Expected {len(frames) - i}, got {frame_cnt}"
-        buffer >>= FCNT_BITS
-        ftype = buffer & bitmask(FTYPE_BITS)
-        if ftype != int(len(frames) > 1):
-            return f"Identifier frame type Mismatch: Expected {int(len(frames) > 1)}, got {ftype}"
-        buffer >>= FTYPE_BITS
-        src_id = buffer & bitmask(SRC_BITS)
-        if src_id != OBC_ID:
-            return f"Identifier SRC_ID mismatch: Expected {hex(OBC_ID)}, got {hex(src_id)}"
-        buffer >>= SRC_BITS
-        dst_id = buffer
-        if dst_id != subsys_id[0]:
-            return f"Identifier DST_ID mismatch: Expected {subsys_id[0]}, got {hex(dst_id)}"
-        data.extend(frame.data)
-
-    crc = crc_16_bytes(data[:-2])
-
-    if crc == data[-2:]:
-        return f"CRC Mismatch: Expected {crc.hex()}, got {data[-2:].hex()}"
-
-    data = data[:-2]
-    if frame_type[0] != data[0]:
-        return f"Frame type Mismatch: Expected {hex(frame_type[0])}, got {hex(data[0])}"
-    if bytearray(cmd_id) != data[1:3]:
-        return f"Command id Mismatch: Expected {bytes(cmd_id).hex()}, got {data[1:3].hex()}"
-    if length[0] != data[3]:
-        return f"Length Mismatch: Expected {hex(length[0])}, got {hex(data[3])}"
-    return data[4:]
-
-
-def bitmask(b):
-    return (1 << b) - 1
-
-
-def ceildiv(a, b):
-    return -(a // -b)
-
-
-def bounded(inp, lower, upper):
-    return max(min(inp, upper), lower)
+    return protocol.receive(frames, "DATA_SEND")
 
 
 def debug_command(frames):
     for frame in frames:
         data = frame[1].hex()
-        print(hex(frame[0]), [data[i:i + 2] for i in range(0, len(data), 2)], sep=', ')
\ No newline at end of file
+        print(hex(frame[0]), [data[i:i + 2] for i in range(0, len(data), 2)], sep=', ')
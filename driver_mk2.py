@@ -1,268 +1,130 @@
-from crc import crc_16_bytes
 from datetime import datetime
 
-ID = [[0x10], [0x11]]
-OBC_ID = 0x08
+from protocol import FRAME_CACHE_SIZE, Frames, bitmask, bounded, ceildiv, variants
 
-SRC_BITS = 8
-DEST_BITS = 8
-FTYPE_BITS = 1
-FCNT_BITS = 8
+protocol = variants["mk2"]
 
-pad_bits = 29 - SRC_BITS - DEST_BITS - FTYPE_BITS - FCNT_BITS
+ID = [[i] for i in protocol.subsys_ids]
+OBC_ID = protocol.obc_id
 
+SRC_BITS = protocol.layout.src_bits
+DEST_BITS = protocol.layout.dest_bits
+FTYPE_BITS = protocol.layout.ftype_bits
+FCNT_BITS = protocol.layout.fcnt_bits
 
-def init_payload_send(test=True, subsys=0):
-    preamble = [0x58, 0x44, 0x41, 0x54]
-    ftype = [0x01]
-    cid = ID[subsys]
-    cmd_id = [0x00, 0x00]
-    length = [0x01]
-    param = [0x01 if test else 0x00]
+pad_bits = protocol.layout.pad_bits
 
-    return pack(preamble, ftype, cid, cmd_id, length, param)
+# One DATA_GET interval count in milliseconds when the ECU repeats the response. The payload interface
+# documentation does not give the unit of the interval count, milliseconds is an assumption
+DATA_GET_INTERVAL_MS = 1
 
+# Time one 8 byte extended frame takes on the 1 Mbit/s bus, including stuff bits
+FRAME_TIME_US = 130
 
-def init_payload_receive(frames, subsys=0):
-    ftype = [0x00]
-    cid = ID[subsys]
-    cmd_id = [0x00, 0x00]
-    length = [0x02]
+# A DATA_GET response is 21 frames, the ECU cannot repeat it faster than the bus carries them
+DATA_GET_RESPONSE_FRAMES = ceildiv(6 + protocol.command("DATA_GET").response_length, 8)
+DATA_GET_MIN_PERIOD_MS = ceildiv(DATA_GET_RESPONSE_FRAMES * FRAME_TIME_US, 1000)
+# Smallest interval count a stream is started with. A stream is cancelled with a single shot DATA_GET of
+# another interval count, assuming two things of the firmware the payload interface documentation does not
+# state: a single shot DATA_GET ends a repeating one whatever its interval count, and every DATA_GET
+# response echoes the interval count of its command (see data_get_interval), which tells the response to
+# the cancel apart from streamed ones still on the bus
+DATA_GET_MIN_INTERVAL = ceildiv(DATA_GET_MIN_PERIOD_MS, DATA_GET_INTERVAL_MS)
 
-    return unpack(frames, ftype, cid, cmd_id, length)
+# Command id -> name, as used in logs and metrics
+COMMAND_NAMES = protocol.command_names
 
+split_id = protocol.split_id
+pack = protocol.pack
+unpack = protocol.unpack
+pack_response = protocol.pack_response
 
-def pma_test_send(params, subsys=0):
-    preamble = [0x58, 0x44, 0x41, 0x54]
-    ftype = [0x01]
-    cid = ID[subsys]
-    cmd_id = [0x00, 0x07]
-    length = [0x16]
-    param = params
 
-    return pack(preamble, ftype, cid, cmd_id, length, param)
+def init_payload_send(test=True, subsys=0):
+    return protocol.send("INIT_PAYL", [0x01 if test else 0x00], subsys)
 
 
-def ppu_test_send(params, subsys=0):
-    preamble = [0x58, 0x44, 0x41, 0x54]
-    ftype = [0x01]
-    cid = ID[subsys]
-    cmd_id = [0x00, 0x08]
-    length = [0x0C]
-    param = params
+def init_payload_receive(frames, subsys=0):
+    return protocol.receive(frames, "INIT_PAYL", subsys)
 
-    return pack(preamble, ftype, cid, cmd_id, length, param)
+
+def pma_test_send(params, subsys=0):
+    return protocol.send("PMA_TEST", params, subsys)
+
+
+def ppu_test_send(params, subsys=0):
+    return protocol.send("PPU_TEST", params, subsys)
 
 
 def set_time_send(yr, month, day, hour, mins, secs, subsys=0):
     t = datetime(yr, month, day, hour, mins, secs)
-
-    preamble = [0x58, 0x44, 0x41, 0x54]
-    ftype = [0x01]
-    cid = ID[subsys]
-    cmd_id = [0x00, 0x01]
-    length = [0x13]
     # param = t.strftime("%Y-%m-%dT%H:%M:%S")
-    param = [int(i) for i in bytes(t.isoformat(), 'utf-8')]
-
-    return pack(preamble, ftype, cid, cmd_id, length, param)
+    return protocol.send("SET_TIME", bytes(t.isoformat(), 'utf-8'), subsys)
 
 
 def start_operation_send(param=0, subsys=0):  # 0 for thruster 1, 1 for thruster 2, 2 for custom ignition
-    preamble = [0x58, 0x44, 0x41, 0x54]
-    ftype = [0x01]
-    cid = ID[subsys]
-    cmd_id = [0x00, 0x02]
-    length = [0x01]
-    param = [0x01 if param == 0 else (0x02 if param == 1 else 0x03)]
-
-    return pack(preamble, ftype, cid, cmd_id, length, param)
+    return protocol.send("START_OPERATION", [0x01 if param == 0 else (0x02 if param == 1 else 0x03)], subsys)
 
 
 def set_time_receive(frames, subsys=0):
-    ftype = [0x00]
-    cid = ID[subsys]
-    cmd_id = [0x00, 0x01]
-    length = [0x02]
-
-    return unpack(frames, ftype, cid, cmd_id, length)
+    return protocol.receive(frames, "SET_TIME", subsys)
 
 
 def start_operation_receive(frames, subsys=0):
-    ftype = [0x00]
-    cid = ID[subsys]
-    cmd_id = [0x00, 0x02]
-    length = [0x04]
-
-    return unpack(frames, ftype, cid, cmd_id, length)
+    return protocol.receive(frames, "START_OPERATION", subsys)
 
 
 def stop_operation_send(test=False, subsys=0):
-    preamble = [0x58, 0x44, 0x41, 0x54]
-    ftype = [0x01]
-    cid = ID[subsys]
-    cmd_id = [0x00, 0x09] if test else [0x00, 0x03]
-    length = [0x01]
-    param = [0x00]
-
-    return pack(preamble, ftype, cid, cmd_id, length, param)
+    return protocol.send("STOP_OPERATION_TEST" if test else "STOP_OPERATION", [0x00], subsys)
 
 
 def stop_operation_receive(frames, test=False, subsys=0):
-    ftype = [0x00]
-    cid = ID[subsys]
-    cmd_id = [0x00, 0x09] if test else [0x00, 0x03]
-    length = [0x02]
-
-    return unpack(frames, ftype, cid, cmd_id, length)
+    return protocol.receive(frames, "STOP_OPERATION_TEST" if test else "STOP_OPERATION", subsys)
 
 
 # Retry counter (0x01 ~ 0x03) Retry counter to cut off the power
 # Power off time count (0x01~0xFF) Remaining time count to cut off the power. One count is 100 milliseconds
 def stop_payload_send(retry_count=0x03, pwroff_delay=0xff, subsys=0):
-    preamble = [0x58, 0x44, 0x41, 0x54]
-    ftype = [0x01]
-    cid = ID[subsys]
-    cmd_id = [0x00, 0x04]
-    length = [0x02]
-    param = [bounded(retry_count, 0x01, 0x03), bounded(pwroff_delay, 0x01, 0xff)]
-
-    return pack(preamble, ftype, cid, cmd_id, length, param)
+    return protocol.send("STOP_PAYL", [bounded(retry_count, 0x01, 0x03), bounded(pwroff_delay, 0x01, 0xff)], subsys)
 
 
 def stop_payload_receive(frames, subsys=0):
-    ftype = [0x00]
-    cid = ID[subsys]
-    cmd_id = [0x00, 0x04]
-    length = [0x02]
-
-    return unpack(frames, ftype, cid, cmd_id, length)
+    return protocol.receive(frames, "STOP_PAYL", subsys)
 
 
 def data_get_send(repeat=False, interval_count=0x0001, size=0x009A, addr=0xA010, subsys=0):
-    preamble = [0x58, 0x44, 0x41, 0x54]
-    ftype = [0x01]
-    cid = ID[subsys]
-    cmd_id = [0x00, 0x05]
-    length = [0x08]
-
     intv_bytes = bounded(interval_count, 0x0001, 0xffff).to_bytes(2, 'big')
     size_bytes = bounded(size, 0x0001, 0xffff).to_bytes(2, 'big')
     addr_bytes = addr.to_bytes(2, 'big')
 
-    param = [0x01, 0x01 if repeat else 0x00, intv_bytes[0], intv_bytes[1], size_bytes[0], size_bytes[1], addr_bytes[0],
-             addr_bytes[1]]
+    param = bytes([0x01, 0x01 if repeat else 0x00]) + intv_bytes + size_bytes + addr_bytes
 
-    return pack(preamble, ftype, cid, cmd_id, length, param)
+    return protocol.send("DATA_GET", param, subsys)
 
 
 def data_get_receive(frames, subsys=0):
-    ftype = [0x00]
-    cid = ID[subsys]
-    cmd_id = [0x00, 0x05]
-    length = [0xA2]
+    return protocol.receive(frames, "DATA_GET", subsys)
 
-    return unpack(frames, ftype, cid, cmd_id, length)
 
+def data_get_interval(frames):
+    """Interval count a DATA_GET response echoes from its command, read from the first frame before it is checked"""
+    return int.from_bytes(frames[0].data[6:8], 'big')
 
-def data_send_send(data, addr=0xA010, test=False, subsys=0):
-    preamble = [0x58, 0x44, 0x41, 0x54]
-    ftype = [0x01]
-    cid = ID[subsys]
-    cmd_id = [0x00, 0x07 if test else 0x06]
-    length = [0x44]
 
+def data_send_send(data, addr=0xA010, test=False, subsys=0):
     size = len(data)
     if size > 90:
         return None
     size_bytes = bounded(size, 0x0001, 0xffff).to_bytes(2, 'big')
     addr_bytes = addr.to_bytes(2, 'big')
 
-    param = [0x01, 0x00, 0x00, 0x01, size_bytes[0], size_bytes[1], addr_bytes[0], addr_bytes[1]] + list(data)
+    param = bytes([0x01, 0x00, 0x00, 0x01]) + size_bytes + addr_bytes + bytes(data)
 
-    return pack(preamble, ftype, cid, cmd_id, length, param)
+    return protocol.send("DATA_SEND_TEST" if test else "DATA_SEND", param, subsys)
 
 
 def data_send_receive(frames, test=False, subsys=0):
-    ftype = [0x00]
-    cid = ID[subsys]
-    cmd_id = [0x00, 0x07 if test else 0x06]
-    length = [0x02]
-
-    return unpack(frames, ftype, cid, cmd_id, length)
-
-
-def pack(preamble, frame_type, subsys_id, cmd_id, length, param):
-    crc_data = bytes(preamble + frame_type + subsys_id + cmd_id + length + param)
-    crc = crc_16_bytes(crc_data)
-
-    can_data = bytes(frame_type + cmd_id + length + param) + crc
-    can_data_len = len(can_data)
-
-    frame_cnt = ceildiv(can_data_len, 8)
-    fragments = [can_data[i * 8:min((i + 1) * 8, len(can_data))] for i in range(frame_cnt)]
-
-    frames = []
-    for i in range(frame_cnt):
-        can_id = (OBC_ID & bitmask(SRC_BITS)) << (DEST_BITS + FTYPE_BITS + FCNT_BITS + pad_bits)
-        can_id |= (subsys_id[0] & bitmask(DEST_BITS)) << (FTYPE_BITS + FCNT_BITS + pad_bits)
-        can_id |= ((0 if (frame_cnt == 1) else 1) & bitmask(FTYPE_BITS)) << (FCNT_BITS + pad_bits)
-        can_id |= (((frame_cnt - 1) - i) & bitmask(FCNT_BITS)) << pad_bits
-        can_id |= bitmask(pad_bits)
-
-        frames.append((can_id, fragments[i]))
-
-    return frames
-
-
-def unpack(frames, frame_type, subsys_id, cmd_id, length):
-    data = bytearray()
-    for i in range(len(frames)):
-        frame = frames[i]
-        buffer = frame.id
-        buffer >>= pad_bits
-        frame_cnt = buffer & bitmask(FCNT_BITS)
-        if frame_cnt != len(frames) - i - 1:
-            return f"Identifier frame count Mismatch: Expected {len(frames) - i}, got {frame_cnt}"
-        buffer >>= FCNT_BITS
-        ftype = buffer & bitmask(FTYPE_BITS)
-        if ftype != int(len(frames) > 1):
-            return f"Identifier frame type Mismatch: Expected {int(len(frames) > 1)}, got {ftype}"
-        buffer >>= FTYPE_BITS
-        src_id = buffer & bitmask(SRC_BITS)
-        if src_id != OBC_ID:
-            return f"Identifier SRC_ID mismatch: Expected {hex(OBC_ID)}, got {hex(src_id)}"
-        buffer >>= SRC_BITS
-        dst_id = buffer
-        if dst_id != subsys_id[0]:
-            return f"Identifier DST_ID mismatch: Expected {subsys_id[0]}, got {hex(dst_id)}"
-        data.extend(frame.data)
-
-    crc = crc_16_bytes(data[:-2])
-
-    if crc == data[-2:]:
-        return f"CRC Mismatch: Expected {crc.hex()}, got {data[-2:].hex()}"
-
-    data = data[:-2]
-    if frame_type[0] != data[0]:
-        return f"Frame type Mismatch: Expected {hex(frame_type[0])}, got {hex(data[0])}"
-    if bytearray(cmd_id) != data[1:3]:
-        return f"Command id Mismatch: Expected {bytes(cmd_id).hex()}, got {data[1:3].hex()}"
-    if length[0] != data[3]:
-        return f"Length Mismatch: Expected {hex(length[0])}, got {hex(data[3])}"
-    return data[4:]
-
-
-def bitmask(b):
-    return (1 << b) - 1
-
-
-def ceildiv(a, b):
-    return -(a // -b)
-
-
-def bounded(inp, lower, upper):
-    return max(min(inp, upper), lower)
+    return protocol.receive(frames, "DATA_SEND_TEST" if test else "DATA_SEND", subsys)
 
 
 def debug_command(frames):
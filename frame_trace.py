@@ -0,0 +1,91 @@
+""" Tracing of the frames sent and received on the channel
+
+`TextFrameTrace` logs frames at DEBUG level to the "frames" logger. Arguments are
+only formatted when a handler emits the record, which with `LazyQueueHandler`
+happens on the logging listener thread instead of the CAN reader thread.
+
+`BinaryFrameTrace` writes fixed-width records of
+(float64 host time, uint8 direction, uint32 id, uint8 dlc, 8 data bytes,
+int64 hardware timestamp or -1) from a background writer, after `magic`.
+"""
+
+import logging
+import struct
+import time
+from datetime import datetime
+from logging.handlers import QueueHandler
+
+import numpy as np
+
+from log_writer import LogWriter
+
+RX = 0
+TX = 1
+
+magic = b"CANTRACE\x00\x01"
+record_dtype = np.dtype([('time', '>f8'), ('direction', 'u1'), ('id', '>u4'), ('dlc', 'u1'), ('data', 'u1', 8),
+                         ('timestamp', '>i8')])
+record_struct = struct.Struct(">dBIB8sq")
+
+logger = logging.getLogger("frames")
+
+
+class LazyQueueHandler(QueueHandler):
+    """Queues records unformatted, the listener's handlers format them on its thread"""
+
+    def prepare(self, record):
+        return record
+
+
+class Hex:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return hex(self.value) if (isinstance(self.value, int)) else bytes(self.value).hex()
+
+
+class WallTime:
+    __slots__ = ('value',)
+
+    def __init__(self, value: float):
+        self.value = value
+
+    def __str__(self):
+        return datetime.fromtimestamp(self.value).isoformat()
+
+
+class TextFrameTrace:
+    def frame(self, direction: int, frame):
+        if (logger.isEnabledFor(logging.DEBUG)):
+            logger.debug("%s -> CAN %s: id %s | data %s | timestamp %s", WallTime(time.time()),
+                         "receive" if (direction == RX) else "sending", Hex(frame.id), Hex(frame.data), frame.timestamp)
+
+    def close(self):
+        pass
+
+
+class BinaryFrameTrace(LogWriter):
+    def __init__(self, filename, **kwargs):
+        super(BinaryFrameTrace, self).__init__(filename, time.time(), **kwargs)
+
+    def encode_header(self) -> bytes:
+        return magic
+
+    def encode_row(self, row) -> bytes:
+        t, direction, can_id, data, timestamp = row
+        return record_struct.pack(t, direction, can_id, len(data), data, -1 if (timestamp is None) else timestamp)
+
+    def frame(self, direction: int, frame):
+        self.write((time.time(), direction, frame.id, bytes(frame.data), frame.timestamp))
+
+
+def read_frame_trace(filename) -> np.ndarray:
+    """Load the records of a binary frame trace"""
+    with open(str(filename), 'rb') as f:
+        if (f.read(len(magic)) != magic):
+            raise ValueError("Not a binary frame trace!", str(filename))
+        data = f.read()
+    return np.frombuffer(data, dtype=record_dtype, count=len(data) // record_dtype.itemsize)
@@ -0,0 +1,86 @@
+from PyQt6.QtCore import QTimer
+from PyQt6.QtWidgets import (
+    QCheckBox,
+    QHBoxLayout,
+    QHeaderView,
+    QLabel,
+    QPushButton,
+    QTableWidget,
+    QTableWidgetItem,
+    QVBoxLayout,
+    QWidget,
+)
+
+from config import Config
+import tracing
+
+
+class MetricsWindow(QWidget):
+    """
+    Status panel with the round-trip latencies of every command sent so far and
+    the switch for tracing pipeline stages
+    """
+
+    columns = ["Command", "Subsystem", "Count", "Timeouts",
+               "First p50 (ms)", "First p99 (ms)", "First max (ms)",
+               "Complete p50 (ms)", "Complete p99 (ms)", "Complete max (ms)"]
+
+    def __init__(self, config: Config):
+        super(MetricsWindow, self).__init__()
+        self.config = config
+
+        self.vlayout = QVBoxLayout()
+        self.button_row = QHBoxLayout()
+
+        self.table = QTableWidget(0, len(self.columns), parent=self)
+        self.table.setHorizontalHeaderLabels(self.columns)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.ResizeToContents)
+        self.table.verticalHeader().setVisible(False)
+
+        self.export_button = QPushButton("Export", parent=self)
+        self.export_label = QLabel("", parent=self)
+        self.trace_check = QCheckBox("Trace Stages", parent=self)
+        self.trace_check.setChecked(tracing.enabled)
+        self.export_trace_button = QPushButton("Export Trace", parent=self)
+
+        self.button_row.addWidget(self.export_button)
+        self.button_row.addWidget(self.trace_check)
+        self.button_row.addWidget(self.export_trace_button)
+        self.button_row.addWidget(self.export_label)
+        self.button_row.addStretch()
+
+        self.vlayout.addWidget(self.table)
+        self.vlayout.addLayout(self.button_row)
+        self.setLayout(self.vlayout)
+
+        self.export_button.clicked.connect(self.on_export)
+        self.trace_check.clicked.connect(self.on_trace_setting)
+        self.export_trace_button.clicked.connect(self.on_export_trace)
+
+        self.timer = QTimer()
+        self.timer.setInterval(1000)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start()
+
+    def refresh(self):
+        if (not self.isVisible()):
+            return
+        summary = self.config.metrics.summary()
+        self.table.setRowCount(len(summary))
+        for row, entry in enumerate(summary):
+            first, complete = entry["first_frame"], entry["complete"]
+            cells = [entry["command"], entry["subsystem"], str(complete["count"]), str(entry["timeouts"])]
+            cells += [f"{h[k] * 1e3:.2f}" for h in (first, complete) for k in ("p50", "p99", "max")]
+            for col, text in enumerate(cells):
+                self.table.setItem(row, col, QTableWidgetItem(text))
+
+    def on_export(self):
+        self.config.export_metrics()
+        self.export_label.setText(str(self.config.metrics_filename))
+
+    def on_trace_setting(self):
+        tracing.enable(self.trace_check.isChecked())
+
+    def on_export_trace(self):
+        self.config.export_trace()
+        self.export_label.setText(str(self.config.trace_filename))
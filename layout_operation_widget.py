@@ -1,7 +1,7 @@
 import time
+from functools import partial
 
-import canlib
-from PyQt6.QtCore import Qt, QTimer
+from PyQt6.QtCore import Qt, QTimer, pyqtSignal
 from PyQt6.QtWidgets import (
     QWidget,
     QHBoxLayout,
@@ -14,9 +14,13 @@ from PyQt6.QtWidgets import (
 )
 
 from PyQt6.QtGui import QPalette, QColor, QFont
-from canlib.canlib import CanNoMsg
 
-from config import Config
+from can_backend import CanNoMsg
+from config import Config, render_fps
+from decimate import MinMaxPyramid, minmax_decimate
+from live_plot import LivePlot, plot_live
+from scheduler import PeriodicScheduler
+import tracing
 from widget_state_label import StateLabel
 
 import matplotlib
@@ -42,10 +46,15 @@ class MplCanvas(FigureCanvasQTAgg):
 
 
 class OperationWindow(QWidget):
+    response_received = pyqtSignal(object, object)
+    warning_raised = pyqtSignal(str)
 
     def __init__(self, config: Config):
         super(OperationWindow, self).__init__()
         self.timer = None
+        self.render_timer = None
+        self.data_get_pending = False
+        self.stream_ecu = None
         self.config = config
 
         self.hlayout = QHBoxLayout()
@@ -63,6 +72,7 @@ class OperationWindow(QWidget):
 
         self.logging_ind_row = QHBoxLayout()
         self.logging_period_row = QHBoxLayout()
+        self.rates_row = QHBoxLayout()
 
         self.ecu_sel_combo = QComboBox()
         self.ecu_sel_combo.addItems(['ECU 1', 'ECU 2'])
@@ -99,6 +109,11 @@ class OperationWindow(QWidget):
         self.logging_period2_label.setSizePolicy(QSizePolicy.Policy.Fixed, QSizePolicy.Policy.Preferred)
         self.logging_period2_label.setFixedWidth(30)
 
+        self.stream_check = QCheckBox("ECU Stream", parent=self)
+
+        self.sample_rate_label = QLabel("- Hz", parent=self)
+        self.render_rate_label = QLabel("- fps", parent=self)
+
         self.logging_toggle = QPushButton("Start Log")
 
         self.sel_ecu_row.addWidget(QLabel("Selected ECU", parent=self))
@@ -129,6 +144,11 @@ class OperationWindow(QWidget):
         self.logging_period_row.addWidget(self.logging_period)
         self.logging_period_row.addWidget(self.logging_period2_label)
 
+        self.rates_row.addWidget(QLabel("Sampling:", parent=self))
+        self.rates_row.addWidget(self.sample_rate_label)
+        self.rates_row.addWidget(QLabel("Plot:", parent=self))
+        self.rates_row.addWidget(self.render_rate_label)
+
         self.left_col.addLayout(self.sel_ecu_row)
         self.left_col.addLayout(self.status_row)
         self.left_col.addLayout(self.errors_row1)
@@ -141,6 +161,8 @@ class OperationWindow(QWidget):
         self.left_col.addStretch()
         self.left_col.addLayout(self.logging_ind_row)
         self.left_col.addLayout(self.logging_period_row)
+        self.left_col.addLayout(self.rates_row)
+        self.left_col.addWidget(self.stream_check)
         self.left_col.addWidget(self.logging_toggle)
 
         self.param_select_row = QHBoxLayout()
@@ -150,6 +172,8 @@ class OperationWindow(QWidget):
         self.param_select_combo = QComboBox(parent=self)
         self.canvas = MplCanvas(self, width=8, height=6, dpi=100)
         self.toolbar = NavigationToolbar2QT(self.canvas, self)
+        self.live_plot = LivePlot(self.canvas, self.canvas.axes)
+        self.lod = MinMaxPyramid()
 
         self.param_select_row.addWidget(self.param_select_label)
         self.param_select_row.addWidget(self.param_select_combo)
@@ -200,9 +224,32 @@ class OperationWindow(QWidget):
         self.logging_toggle.clicked.connect(self.on_log_button_press)
 
         self.set_time_button.clicked.connect(self.on_set_time)
+        self.stream_check.clicked.connect(self.on_change_stream_setting)
+
+        self.response_received.connect(self.on_response)
+        self.warning_raised.connect(self.on_warning)
+        # zooming, panning, the toolbar's home/back/forward and scrolling all change the x limits,
+        # the visible range is replotted once they settle for a render interval
+        self.plotted_xlim = None
+        self.navigate_timer = QTimer()
+        self.navigate_timer.setSingleShot(True)
+        self.navigate_timer.setInterval(int(1000 / render_fps))
+        self.navigate_timer.timeout.connect(self.on_plot_navigate)
+        self.canvas.axes.callbacks.connect('xlim_changed', self.on_xlim_changed)
 
         self.logging_period.setValue(500)
 
+    def request(self, frames, callback):
+        """Send a command, callback is invoked on the GUI thread with the response future"""
+        future = self.config.request(frames)
+        future.add_done_callback(lambda f: self.response_received.emit(callback, f))
+
+    def on_response(self, callback, future):
+        callback(future)
+
+    def on_warning(self, text):
+        QMessageBox.warning(self, 'Error', text)
+
     def on_log_button_press(self):
         self.logging_enable(not self.live_log)
 
@@ -218,11 +265,22 @@ class OperationWindow(QWidget):
     def is_currtime_checked(self):
         return self.current_time_check.isChecked()
 
+    def is_stream_checked(self):
+        return self.stream_check.isChecked()
+
+    def on_change_stream_setting(self):
+        # the ECU schedules streamed responses itself, so it is not bound by the polling round trip,
+        # only by the bus time of a response
+        self.logging_period.setMinimum(DATA_GET_MIN_PERIOD_MS if self.is_stream_checked() else 50)
+
     def on_init_payload(self):
-        self.config.send_frames(init_payload_send(self.is_test_checked(), subsys=self.selected_ecu))
+        self.request(init_payload_send(self.is_test_checked(), subsys=self.selected_ecu),
+                     partial(self.on_init_payload_resp, self.selected_ecu))
         self.config.logger.info(f'{datetime.now().isoformat()} -> INIT_PAYL sent')
+
+    def on_init_payload_resp(self, subsys, future):
         try:
-            resp = init_payload_receive(self.config.poll_frames(), subsys=self.selected_ecu)
+            resp = init_payload_receive(future.result(), subsys=subsys)
         except CanNoMsg as e:
             self.config.logger.error(f'{datetime.now().isoformat()} -> INIT_PAYL timed out!')
             QMessageBox.warning(self, 'Error',
@@ -249,10 +307,12 @@ class OperationWindow(QWidget):
 
     def on_stop_payload(self):
         self.logging_enable(False)
-        self.config.send_frames(stop_payload_send(subsys=self.selected_ecu))
+        self.request(stop_payload_send(subsys=self.selected_ecu), partial(self.on_stop_payload_resp, self.selected_ecu))
         self.config.logger.info(f'{datetime.now().isoformat()} -> STOP_PAYL sent')
+
+    def on_stop_payload_resp(self, subsys, future):
         try:
-            resp = stop_payload_receive(self.config.poll_frames(), subsys=self.selected_ecu)
+            resp = stop_payload_receive(future.result(), subsys=subsys)
         except CanNoMsg as e:
             self.config.logger.error(f'{datetime.now().isoformat()} -> STOP_PAYL timed out!')
             QMessageBox.warning(self, 'Error',
@@ -300,10 +360,13 @@ class OperationWindow(QWidget):
 
     def on_start_operation(self):
         self.config.logger.info(self.config.sent_parameters)
-        self.config.send_frames(data_send_send(self.config.sent_parameters.pack(), test=self.is_test_checked(), subsys=self.selected_ecu))
+        self.request(data_send_send(self.config.sent_parameters.pack(), test=self.is_test_checked(), subsys=self.selected_ecu),
+                     partial(self.on_data_send_resp, self.selected_ecu))
         self.config.logger.info(f'{datetime.now().isoformat()} -> {"DATA_SEND" if (not self.is_test_checked()) else "DATA_SEND_TEST_MODE"} sent')
+
+    def on_data_send_resp(self, subsys, future):
         try:
-            resp = data_send_receive(self.config.poll_frames(), test=self.is_test_checked(), subsys=self.selected_ecu)
+            resp = data_send_receive(future.result(), test=self.is_test_checked(), subsys=subsys)
         except CanNoMsg as e:
             self.config.logger.error(f'{datetime.now().isoformat()} -> {"DATA_SEND" if (not self.is_test_checked()) else "DATA_SEND_TEST_MODE"} timed out!')
             QMessageBox.warning(self, 'Error',
@@ -325,35 +388,40 @@ class OperationWindow(QWidget):
             self.start_label.curr = 1
 
         if (not self.is_test_checked()):
-            self.config.send_frames(start_operation_send(subsys=self.selected_ecu))
+            self.request(start_operation_send(subsys=subsys), partial(self.on_start_operation_resp, subsys))
             self.config.logger.info(f'{datetime.now().isoformat()} -> START_OPERATION sent')
-            try:
-                resp = start_operation_receive(self.config.poll_frames(), subsys=self.selected_ecu)
-            except CanNoMsg as e:
-                self.config.logger.error(f'{datetime.now().isoformat()} -> START_OPERATION timed out!')
-                QMessageBox.warning(self, 'Error', f'START_OPERATION timed out!')
-                return
-
-            if (not isinstance(resp, str)) and resp[:2].hex() == '0000':
-                self.start = True
-                self.init_button.setDisabled(True)
 
-                self.start_operation.setDisabled(True)
-                self.stop_operation.setDisabled(False)
+    def on_start_operation_resp(self, subsys, future):
+        try:
+            resp = start_operation_receive(future.result(), subsys=subsys)
+        except CanNoMsg as e:
+            self.config.logger.error(f'{datetime.now().isoformat()} -> START_OPERATION timed out!')
+            QMessageBox.warning(self, 'Error', f'START_OPERATION timed out!')
+            return
+
+        if (not isinstance(resp, str)) and resp[:2].hex() == '0000':
+            self.start = True
+            self.init_button.setDisabled(True)
+
+            self.start_operation.setDisabled(True)
+            self.stop_operation.setDisabled(False)
 
-                self.start_label.curr = 1
-                #self.logging_enable(True)
-            else:
-                self.config.logger.error(f'{datetime.now().isoformat()} -> START_OPERATION failed: {resp if isinstance(resp, str) else f"Error Vector: {resp[:2].hex()}"}')
-                QMessageBox.warning(self, 'Error',
-                                    f'START_OPERATION failed: {resp if isinstance(resp, str) else f"Error Vector: {resp[:2].hex()}"}')
+            self.start_label.curr = 1
+            #self.logging_enable(True)
+        else:
+            self.config.logger.error(f'{datetime.now().isoformat()} -> START_OPERATION failed: {resp if isinstance(resp, str) else f"Error Vector: {resp[:2].hex()}"}')
+            QMessageBox.warning(self, 'Error',
+                                f'START_OPERATION failed: {resp if isinstance(resp, str) else f"Error Vector: {resp[:2].hex()}"}')
 
     def on_stop_operation(self):
         self.logging_enable(False)
-        self.config.send_frames(stop_operation_send(test=self.is_test_checked(), subsys=self.selected_ecu))
+        self.request(stop_operation_send(test=self.is_test_checked(), subsys=self.selected_ecu),
+                     partial(self.on_stop_operation_resp, self.selected_ecu))
         self.config.logger.info(f'{datetime.now().isoformat()} -> STOP_OPERATION sent')
+
+    def on_stop_operation_resp(self, subsys, future):
         try:
-            resp = stop_operation_receive(self.config.poll_frames(), test=self.is_test_checked(), subsys=self.selected_ecu)
+            resp = stop_operation_receive(future.result(), test=self.is_test_checked(), subsys=subsys)
         except CanNoMsg as e:
             self.config.logger.error(f'{datetime.now().isoformat()} -> STOP_OPERATION timed out!')
             QMessageBox.warning(self, 'Error',
@@ -382,16 +450,19 @@ class OperationWindow(QWidget):
 
     def on_set_time(self):
         dt = datetime.now() if self.is_currtime_checked() else self.date_picker.dateTime()
-        self.config.send_frames(set_time_send(dt.date().year,
-                                              dt.date().month,
-                                              dt.date().day,
-                                              dt.time().hour,
-                                              dt.time().minute,
-                                              dt.time().second,
-                                              subsys=self.selected_ecu))
+        self.request(set_time_send(dt.date().year,
+                                   dt.date().month,
+                                   dt.date().day,
+                                   dt.time().hour,
+                                   dt.time().minute,
+                                   dt.time().second,
+                                   subsys=self.selected_ecu),
+                     partial(self.on_set_time_resp, self.selected_ecu))
         self.config.logger.info(f'{datetime.now().isoformat()} -> SET_TIME sent')
+
+    def on_set_time_resp(self, subsys, future):
         try:
-            resp = set_time_receive(self.config.poll_frames(), subsys=self.selected_ecu)
+            resp = set_time_receive(future.result(), subsys=subsys)
         except CanNoMsg as e:
             self.config.logger.error(f'{datetime.now().isoformat()} -> SET_TIME timed out!')
             QMessageBox.warning(self, 'Error',
@@ -413,27 +484,91 @@ class OperationWindow(QWidget):
         if (start and not self.live_log):
             if not self.live_log:
                 self.config.new_log()
-                self.timer = QTimer()
-                self.timer.setInterval(self.logging_period.value())
-                self.timer.timeout.connect(self.update_plot)
-                self.timer.start()
                 self.live_log = True
+                # the ECU paces a stream itself, otherwise DATA_GET is polled on a precise timer
+                if (self.is_stream_checked()):
+                    self.stream_enable(True)
+                else:
+                    self.timer = PeriodicScheduler(self.logging_period.value() / 1000, self.update_plot,
+                                                   logger=self.config.logger, name="DATA_GET poll")
+                    self.timer.start()
+                # the plot is redrawn independently at a capped frame rate
+                self.frame_samples = 0
+                self.rate_time = time.monotonic()
+                self.rate_samples = 0
+                self.rate_frames = 0
+                self.render_timer = QTimer()
+                self.render_timer.setInterval(int(1000 / render_fps))
+                self.render_timer.timeout.connect(self.render_frame)
+                self.render_timer.start()
+                self.lod = MinMaxPyramid()
+                self.live_plot.reset(self.selected_param, self.parameter_bounds(self.selected_param))
+                self.live_plot.set_live(True)
+                self.stream_check.setDisabled(True)
                 self.logging_label.curr = 1
                 self.logging_toggle.setText("Stop Log")
         elif (not start and self.live_log):
-            self.timer.stop()
+            self.stop_poll()
+            self.render_timer.stop()
             self.live_log = False
+            self.stream_enable(False)
+            self.config.close_log()
+            self.live_plot.set_live(False)
+            self.plot_data()
+            self.stream_check.setDisabled(False)
             self.logging_label.curr = 0
             self.logging_toggle.setText("Start Log")
 
-    def load_recv(self) -> bool:
-        """Load data get into receive buffer and check if output is valid"""
+    def stop_poll(self):
+        """Stop polling DATA_GET, also called before the config exits so no tick sends on a removed reader"""
+        if (not self.timer is None):
+            self.timer.stop()
+            self.config.logger.info(f'{datetime.now().isoformat()} -> {self.timer.report()}')
+            self.timer = None
+
+    def stream_enable(self, start: bool):
+        """Subscribe to or cancel the repeating DATA_GET responses of the selected ECU"""
+        if (start and self.stream_ecu is None):
+            interval = max(self.logging_period.value() // DATA_GET_INTERVAL_MS, DATA_GET_MIN_INTERVAL)
+            self.stream_ecu = self.selected_ecu
+            self.config.start_stream(interval, partial(self.on_stream_frames, self.stream_ecu), subsys=self.stream_ecu)
+            self.config.logger.info(f'{datetime.now().isoformat()} -> DATA_GET (repeat) sent')
+        elif (not start and not self.stream_ecu is None):
+            # a single shot DATA_GET replaces the repeating request on the ECU
+            future = self.config.stop_stream(self.stream_ecu)
+            future.add_done_callback(lambda f: self.response_received.emit(self.on_stream_cancel_resp, f))
+            self.stream_ecu = None
+            self.config.logger.info(f'{datetime.now().isoformat()} -> DATA_GET (cancel repeat) sent')
+
+    def on_stream_cancel_resp(self, future):
+        try:
+            future.result()
+        except CanNoMsg as e:
+            self.config.logger.error(f'{datetime.now().isoformat()} -> DATA_GET (cancel repeat) timed out!')
+
+    def on_stream_frames(self, subsys, frames):
+        """Log a streamed DATA_GET response, runs on the CAN reader thread"""
+        if not self.live_log:
+            return
+        with tracing.span("data_get_receive"):
+            fr = data_get_receive(frames, subsys=subsys)
+        if isinstance(fr, str):
+            self.config.logger.error(f"{datetime.now().isoformat()} -> {fr}")
+            return
+        if not fr[:2].hex() == '0000':
+            self.config.logger.error(f"{datetime.now().isoformat()} -> DATA_GET Response Error: {fr[:2].hex()}")
+            return
+        t = self.config.frame_time(frames)
+        self.config.get_log.log_datapoint(fr[8:], t=time.time() if (t is None) else t)
+
+    def load_recv(self, subsys, future) -> bool:
+        """Load data get of the ECU it was sent to into receive buffer and check if output is valid, runs on the CAN reader thread"""
         try:
-            fr = data_get_receive(self.config.poll_frames())
+            with tracing.span("data_get_receive"):
+                fr = data_get_receive(future.result(), subsys=subsys)
         except CanNoMsg as e:
             self.config.logger.error(f'{datetime.now().isoformat()} -> DATA_GET timed out!')
-            QMessageBox.warning(self, 'Error',
-                                f'DATA_GET timed out!')
+            self.warning_raised.emit('DATA_GET timed out!')
             return False
 
         if isinstance(fr, str):
@@ -449,38 +584,114 @@ class OperationWindow(QWidget):
         self.recv = fr[8:]
         return True
 
-    def update_plot(self) -> None:
+    def update_plot(self, t: float) -> bool:
         """
-        Query data from ECU, cache data and replot graph
+        Query data from ECU, the response is logged on the CAN reader thread as it arrives
+        and shown with the next plot frame, so a slow redraw never holds up the next query.
+        Runs on the poll scheduler thread, t is the wall-clock time of the tick.
+        Returns False for a tick declined while the previous query is still in flight.
         """
 
+        # skip the tick while the previous query is still in flight, the scheduler counts it
+        if self.data_get_pending:
+            return False
+
         # data get frames
-        self.config.send_frames(data_get_send(subsys=self.selected_ecu))
+        self.data_get_pending = True
+        with tracing.span("data_get_send"):
+            frames = data_get_send(subsys=self.selected_ecu)
+        future = self.config.request(frames)
+        future.add_done_callback(partial(self.on_data_get_resp, self.selected_ecu, t))
         self.config.logger.info(f'{datetime.now().isoformat()} -> DATA_GET sent')
+        return True
 
-        if not self.load_recv():
+    def on_data_get_resp(self, subsys, t, future) -> None:
+        """Log a polled DATA_GET response, runs on the CAN reader thread like on_stream_frames"""
+        self.data_get_pending = False
+        if not self.live_log:
+            return
+        if not self.load_recv(subsys, future):
             return
 
-        self.config.get_log.log_datapoint(self.recv, t=time.time())
-
+        # stamped with when the ECU answered, or else with the tick the query was sent on,
+        # never with when it was decoded
+        frame_time = self.config.frame_time(future.result())
+        self.config.get_log.log_datapoint(self.recv, t=t if (frame_time is None) else frame_time)
+
+    def render_frame(self) -> None:
+        """Redraw with the samples that arrived since the last frame and report achieved rates once a second"""
+        samples = self.config.get_log.samples
+        if (samples != self.frame_samples):
+            self.frame_samples = samples
+            self.rate_frames += 1
+            self.refresh_plot()
+
+        now = time.monotonic()
+        if (now - self.rate_time >= 1.0):
+            self.sample_rate_label.setText(f"{(samples - self.rate_samples) / (now - self.rate_time):.1f} Hz")
+            self.render_rate_label.setText(f"{self.rate_frames / (now - self.rate_time):.1f} fps")
+            self.rate_time = now
+            self.rate_samples = samples
+            self.rate_frames = 0
+
+    def refresh_plot(self) -> None:
+        self.config.get_log.unpack_latest()
         self.error_vector1_label.setText(f"0x{self.config.get_parameters['Error Vector 1'].value:0>4X}")
         self.error_vector2_label.setText(f"0x{self.config.get_parameters['Error Vector 2'].value:0>8X}")
 
         self.plot_data()
 
-    def plot_data(self):
-        if (not self.config.get_log is None):
-            self.canvas.axes.cla()
-            self.canvas.axes.set_ylabel(self.selected_param)
-            self.canvas.axes.set_xlabel('time (s)')
-            data = self.config.get_log.get_data_series(self.selected_param, elapsed=True)
-            range_min = min(self.config.get_parameters[self.selected_param].min, min(data[0]))
-            range_max = max(self.config.get_parameters[self.selected_param].max, max(data[0]))
-            self.canvas.axes.set_ylim([range_min, range_max])
-            self.canvas.axes.plot(data[1], data[0])
-            self.canvas.draw()
+    def parameter_bounds(self, name):
+        param = self.config.get_parameters[name]
+        return param.min, param.max
+
+    def plot_data(self, xlim=None, ylim=None):
+        """Plot the selected parameter decimated to the canvas width, over the given x range or everything in memory"""
+        if (self.config.get_log is None):
+            return
+        with tracing.span("plot_data", live=self.live_log):
+            self.draw_data(xlim, ylim)
+        self.plotted_xlim = self.canvas.axes.get_xlim()
+
+    def draw_data(self, xlim, ylim):
+        width = max(int(self.canvas.axes.bbox.width), 1)
+        if (self.live_log and xlim is None):
+            plot_live(self.live_plot, self.lod, self.config.get_log, self.selected_param, width)
+            return
+
+        values, times = self.config.get_log.get_data_series(self.selected_param, elapsed=True)
+        self.lod.extend(times, values)
+        if (len(times) > 0):
+            self.lod.trim(times[0])
+
+        if (xlim is None):
+            x, y = self.lod.query(times, values, times[0], times[-1], width) if (len(times) > 0) else (times, values)
+        elif (len(times) > 0 and xlim[0] >= times[0]):
+            x, y = self.lod.query(times, values, xlim[0], xlim[1], width)
+        else:
+            # samples older than the in-memory window are paged in from the log file
+            values, times = self.config.get_log.get_data_series(self.selected_param, elapsed=True,
+                                                                start=xlim[0], end=xlim[1])
+            x, y = minmax_decimate(times, values, width)
+        self.live_plot.show(x, y, xlim, ylim)
+
+    def on_xlim_changed(self, axes):
+        if (not self.live_log):
+            self.navigate_timer.start()
+
+    def on_plot_navigate(self):
+        """Replot at the detail level of the visible range after navigating, paging in history if needed"""
+        if (self.live_log or self.config.get_log is None):
+            return
+        # limits set by plotting itself need no replot
+        xlim = self.canvas.axes.get_xlim()
+        if (xlim == self.plotted_xlim):
+            return
+        self.plot_data(xlim, self.canvas.axes.get_ylim())
 
     def on_param_sel_change(self, param):
         self.selected_param = param
+        self.lod = MinMaxPyramid()
+        self.live_plot.reset(param, self.parameter_bounds(param))
         self.plot_data()
 
@@ -0,0 +1,131 @@
+import numpy as np
+from matplotlib.lines import Line2D
+
+
+class LivePlot:
+    """
+    Persistent line on a matplotlib axes for live data.
+
+    While live, the line is an animated artist drawn on top of a cached background
+    with blitting, so a redraw only costs the line itself. The axes are rescaled,
+    with headroom, only when new points fall outside the current limits, which is
+    the only time the whole figure is drawn again.
+    """
+
+    # fraction of the current span added when the axes have to grow
+    x_headroom = 0.5
+    y_headroom = 0.1
+
+    def __init__(self, canvas, axes):
+        self.canvas = canvas
+        self.axes = axes
+        self.line = Line2D([], [])
+        self.axes.add_line(self.line)
+        self.background = None
+        self.live = False
+        self.bounds = (0, 1)
+        self.last_x = None
+        self.y_min = None
+        self.y_max = None
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+
+    def reset(self, ylabel: str, bounds=(0, 1)):
+        """Clear the line for a new parameter, the y axis starts at the given bounds"""
+        self.axes.set_ylabel(ylabel)
+        self.axes.set_xlabel('time (s)')
+        if (bounds[0] >= bounds[1]):
+            # parameters without a range, e.g. error vectors with bounds (0, 0), start on a unit span
+            bounds = (bounds[0], bounds[0] + 1)
+        self.bounds = bounds
+        self.line.set_data([], [])
+        self.last_x = None
+        self.y_min = None
+        self.y_max = None
+        self.axes.set_ylim(bounds)
+        self.axes.set_xlim(0, 1)
+
+    def set_live(self, live: bool):
+        # animated artists are left out of full draws, which the saved figure needs when not live
+        self.live = live
+        self.background = None
+        self.line.set_animated(live)
+        self.canvas.draw_idle()
+
+    def on_draw(self, event):
+        if (self.live):
+            self.background = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
+            self.axes.draw_artist(self.line)
+
+    def update(self, x, y):
+        """Show the series, only the points added since the last update are scanned for rescaling"""
+        self.line.set_data(x, y)
+        if (len(x) == 0):
+            return
+        new = y if (self.last_x is None) else y[np.searchsorted(x, self.last_x, side='right'):]
+        self.last_x = x[-1]
+        if (len(new) > 0):
+            # plain floats, unsigned sample dtypes would wrap around in the limit arithmetic
+            new_min, new_max = float(new.min()), float(new.max())
+            self.y_min = new_min if (self.y_min is None) else min(self.y_min, new_min)
+            self.y_max = new_max if (self.y_max is None) else max(self.y_max, new_max)
+
+        if (self.rescale(x[0], x[-1]) or not self.live or self.background is None):
+            self.canvas.draw()
+            return
+        self.canvas.restore_region(self.background)
+        self.axes.draw_artist(self.line)
+        self.canvas.blit(self.axes.bbox)
+
+    def rescale(self, x_first, x_last) -> bool:
+        """Grow the axes limits if the data left them, returns whether they changed"""
+        changed = False
+        x_lo, x_hi = self.axes.get_xlim()
+        # also follow the data once a windowed log has moved on from the start of the axis
+        if (x_last > x_hi or x_first < x_lo or x_first - x_lo > self.x_headroom * (x_hi - x_lo)):
+            span = max(x_last - x_first, 1)
+            self.axes.set_xlim(x_first, x_last + self.x_headroom * span)
+            changed = True
+
+        y_lo, y_hi = self.axes.get_ylim()
+        if (self.y_min < y_lo or self.y_max > y_hi):
+            lo = min(self.bounds[0], self.y_min)
+            hi = max(self.bounds[1], self.y_max)
+            margin = self.y_headroom * max(hi - lo, 1)
+            self.axes.set_ylim(lo - (margin if (self.y_min < self.bounds[0]) else 0),
+                               hi + (margin if (self.y_max > self.bounds[1]) else 0))
+            changed = True
+        return changed
+
+    def show(self, x, y, xlim=None, ylim=None):
+        """Draw a complete series, fitting the axes to it or to the given ranges"""
+        self.last_x = None
+        self.y_min = None
+        self.y_max = None
+        self.line.set_data(x, y)
+        lo, hi = self.bounds
+        if (not ylim is None):
+            lo, hi = ylim
+        elif (len(y) > 0):
+            lo = min(lo, np.min(y))
+            hi = max(hi, np.max(y))
+        self.axes.set_ylim(lo, hi)
+        if (not xlim is None):
+            self.axes.set_xlim(xlim)
+        elif (len(x) > 0):
+            self.axes.set_xlim(x[0], max(x[-1], x[0] + 1))
+        self.canvas.draw()
+
+
+def plot_live(plot: LivePlot, pyramid, log, name: str, width: int):
+    """
+    Update a live plot of a parameter with the samples logged since the last update. Only those
+    are read from the log and added to the pyramid, which alone gives the points of the in-memory
+    range decimated to width buckets, so a frame costs the same however many samples are held.
+    """
+    values, times = log.get_data_after(name, pyramid.last_t)
+    pyramid.extend(times, values)
+    start = log.window_start()
+    if (not start is None):
+        pyramid.trim(start)
+    times, values = pyramid.latest(width)
+    plot.update(times, values)
@@ -0,0 +1,179 @@
+import csv
+import io
+import os
+import queue
+import threading
+import time
+from abc import ABC, abstractmethod
+
+import tracing
+
+
+class LogWriter(threading.Thread, ABC):
+    """
+    Background writer for log files.
+
+    Rows are queued with `write` and written in batches from this thread. The file
+    is flushed once `flush_interval` seconds have passed or `flush_bytes` bytes
+    have been written since the last flush, and optionally fsynced after every
+    flush. Every `index_every` rows the elapsed time and file offset of the row
+    are added to `index`. At most `max_queued` items wait in the queue, `write`
+    blocks while it is full so a stalled disk cannot use up the memory. Subclasses
+    define how rows and optionally the header are encoded.
+    """
+
+    def __init__(self, filename, start_time: float, index_every: int = 1024, flush_interval: float = 1.0,
+                 flush_bytes: int = 1 << 16, fsync: bool = False, max_queued: int = 1 << 16):
+        super(LogWriter, self).__init__(name=type(self).__name__, daemon=True)
+        self.filename = filename
+        self.start_time = start_time
+        self.index_every = index_every
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.fsync = fsync
+
+        self.index = []
+        self.rows_written = 0
+        self.closed = False
+        # exception the writer thread stopped with, raised again by sync
+        self.error = None
+
+        self.queue = queue.Queue(maxsize=max_queued)
+        # offsets are tracked while writing, tell() would flush the file
+        self.file = open(str(self.filename), 'wb')
+        self.offset = 0
+        self.write_bytes(self.encode_header())
+        self.flush()
+        self.start()
+
+    def encode_header(self) -> bytes:
+        return b""
+
+    @abstractmethod
+    def encode_row(self, row) -> bytes:
+        """Encode a queued row into the bytes written to the file"""
+
+    def write(self, row):
+        """Queue a row, raises the error the writer stopped with instead of queueing rows nobody writes"""
+        if (not self.error is None):
+            raise self.error
+        if (not self.closed and not self.put(row)):
+            raise self.error if (not self.error is None) else RuntimeError("Log writer stopped!", str(self.filename))
+
+    def put(self, item) -> bool:
+        """Queue an item, waiting while the queue is full, returns False if the writer stopped before taking it"""
+        while True:
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                if (not self.is_alive()):
+                    return False
+
+    def sync(self, timeout: float = 10.0):
+        """Block until every row queued so far is written and flushed, raises the error the writer stopped with"""
+        if (self.closed):
+            return
+        done = threading.Event()
+        self.put(done)
+        deadline = time.monotonic() + timeout
+        while (not done.wait(0.1)):
+            if (not self.is_alive()):
+                if (not self.error is None):
+                    raise self.error
+                raise RuntimeError("Log writer stopped before syncing!", str(self.filename))
+            if (time.monotonic() >= deadline):
+                raise TimeoutError("Log writer did not sync in time!", str(self.filename), timeout)
+
+    def close(self):
+        """Write all queued rows, flush and close the file"""
+        if (self.closed):
+            return
+        self.closed = True
+        self.put(None)
+        self.join()
+
+    def run(self):
+        try:
+            self.write_loop()
+        except Exception as e:
+            self.error = e
+            raise
+
+    def write_loop(self):
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                item = False
+
+            # drain everything that is already queued in one batch
+            items = [item]
+            while (isinstance(item, tuple)):
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                items.append(item)
+
+            with tracing.span("write_rows", rows=len(items)):
+                for item in items:
+                    if (isinstance(item, tuple)):
+                        self.write_row(item)
+                    elif (item is None):
+                        self.flush()
+                        self.on_close()
+                        self.file.close()
+                        return
+                    elif (isinstance(item, threading.Event)):
+                        self.flush()
+                        item.set()
+
+            if (time.monotonic() >= deadline or self.offset - self._flushed_at >= self.flush_bytes):
+                self.flush()
+            if (time.monotonic() >= deadline):
+                deadline = time.monotonic() + self.flush_interval
+
+    def write_row(self, row):
+        if (self.rows_written % self.index_every == 0):
+            self.index.append((row[0] - self.start_time, self.offset))
+            self.on_index(self.index[-1])
+        self.rows_written += 1
+        self.write_bytes(self.encode_row(row))
+
+    def write_bytes(self, data: bytes):
+        self.file.write(data)
+        self.offset += len(data)
+
+    def on_index(self, entry):
+        pass
+
+    def on_close(self):
+        pass
+
+    def flush(self):
+        with tracing.span("flush", fsync=self.fsync):
+            self.file.flush()
+            if (self.fsync):
+                os.fsync(self.file.fileno())
+        self._flushed_at = self.offset
+
+
+class CsvLogWriter(LogWriter):
+    """Writes rows of (time, value, ...) as csv text"""
+
+    def __init__(self, filename, header, start_time: float, **kwargs):
+        self.header = header
+        self._buffer = io.StringIO()
+        self.writer = csv.writer(self._buffer)
+        super(CsvLogWriter, self).__init__(filename, start_time, **kwargs)
+
+    def encode_header(self) -> bytes:
+        return self.encode_row(self.header)
+
+    def encode_row(self, row) -> bytes:
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        self.writer.writerow(row)
+        return self._buffer.getvalue().encode('utf-8')
@@ -0,0 +1,114 @@
+import json
+import threading
+
+import numpy as np
+
+from driver_mk2 import COMMAND_NAMES
+
+
+class LatencyHistogram:
+    """
+    HDR-style histogram of latencies in microseconds.
+
+    Values below 2 * `sub_buckets` are counted exactly, above that every power of
+    two is split into `sub_buckets` linear buckets, so recorded values keep a
+    relative precision of 1 / `sub_buckets` from microseconds up to hours with a
+    fixed amount of memory.
+    """
+
+    sub_buckets = 32
+    magnitudes = 40
+
+    def __init__(self):
+        self.counts = np.zeros(2 * self.sub_buckets + self.magnitudes * self.sub_buckets, dtype=np.int64)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def index(self, value: int) -> int:
+        if (value < 2 * self.sub_buckets):
+            return value
+        shift = value.bit_length() - self.sub_buckets.bit_length()
+        return 2 * self.sub_buckets + (shift - 1) * self.sub_buckets + (value >> shift) - self.sub_buckets
+
+    def highest_equivalent(self, index: int) -> int:
+        """Largest value counted in the bucket"""
+        if (index < 2 * self.sub_buckets):
+            return index
+        shift = (index - 2 * self.sub_buckets) // self.sub_buckets + 1
+        top = (index - 2 * self.sub_buckets) % self.sub_buckets + self.sub_buckets
+        return ((top + 1) << shift) - 1
+
+    def record(self, seconds: float):
+        value = max(int(seconds * 1e6), 0)
+        self.counts[min(self.index(value), len(self.counts) - 1)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, q: float) -> float:
+        """Latency in seconds that q percent of the recorded values are at or below"""
+        if (self.count == 0):
+            return 0.0
+        i = int(np.searchsorted(np.cumsum(self.counts), max(q / 100 * self.count, 1)))
+        return min(self.highest_equivalent(i), self.max) / 1e6
+
+    def mean(self) -> float:
+        return self.total / self.count / 1e6 if (self.count > 0) else 0.0
+
+    def to_dict(self) -> dict:
+        nonzero = np.flatnonzero(self.counts)
+        return {
+            "count": self.count,
+            "mean": self.mean(),
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "max": self.max / 1e6,
+            # highest equivalent value in microseconds -> count
+            "buckets": {str(self.highest_equivalent(int(i))): int(self.counts[i]) for i in nonzero},
+        }
+
+
+class CommandLatency:
+    def __init__(self):
+        self.first_frame = LatencyHistogram()
+        self.complete = LatencyHistogram()
+        self.timeouts = 0
+
+
+class LatencyMetrics:
+    """
+    Round-trip latencies of commands per (subsystem id, command id).
+
+    `first_frame` measures from the last frame of the command leaving the host to
+    the first frame of the response arriving, `complete` to the response being
+    reassembled. Commands that were not answered within their timeout are counted.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.commands = dict()
+
+    def record(self, subsys_id: int, cmd_id: int, first_frame: float, complete: float):
+        with self.lock:
+            latency = self.commands.setdefault((subsys_id, cmd_id), CommandLatency())
+            latency.first_frame.record(first_frame)
+            latency.complete.record(complete)
+
+    def timeout(self, subsys_id: int, cmd_id: int):
+        with self.lock:
+            self.commands.setdefault((subsys_id, cmd_id), CommandLatency()).timeouts += 1
+
+    def summary(self) -> list:
+        with self.lock:
+            return [{
+                "command": COMMAND_NAMES.get(cmd_id, hex(cmd_id)),
+                "subsystem": hex(subsys_id),
+                "timeouts": latency.timeouts,
+                "first_frame": latency.first_frame.to_dict(),
+                "complete": latency.complete.to_dict(),
+            } for (subsys_id, cmd_id), latency in sorted(self.commands.items())]
+
+    def export(self, filename):
+        with open(str(filename), 'w') as f:
+            json.dump(self.summary(), f, indent=2)
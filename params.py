@@ -1,7 +1,24 @@
 import csv
+import io
+import struct
+import threading
 import time
+from operator import itemgetter
 from pathlib import Path
 
+import numpy as np
+
+from binlog import BinaryLog, BinaryLogWriter
+from log_writer import CsvLogWriter
+import tracing
+
+# parameter files of the commands sent to and the telemetry read from the ECUs
+sent_params_file = "parameters_send.csv"
+get_params_file = "parameters_get.csv"
+
+# struct format characters for each supported parameter byte length, (unsigned, signed)
+struct_codes = {1: ('B', 'b'), 2: ('H', 'h'), 4: ('I', 'i'), 8: ('Q', 'q')}
+
 
 class Parameter:
     def __init__(self, name: str, byte_len: int, signed: bool, units: str, offset: int, param_min: int, param_max: int,
@@ -89,16 +106,89 @@ class ParameterSet:
         else:
             self._bytes = bytes
 
+        self._values = tuple(p.value for p in self.params.values())
+        self._stale = False
+        self.compile()
+
+    def compile(self):
+        """Compile the parameter layout into struct codecs for the whole payload"""
+        ordered = sorted(enumerate(self.params.values()), key=lambda x: x[1].offset)
+        pad_byte = self.pad_byte
+
+        unpack_fmt = ">"
+        pack_fmt = ">"
+        self._pack_args = []
+        self._pack_index = [0] * len(ordered)
+        pos = 0
+        for i, param in ordered:
+            if (param.offset < pos):
+                raise ValueError("Parameter overlaps with the previous parameter!", param.name, param.offset, pos)
+            if (not param.byte_len in struct_codes):
+                raise ValueError("Unsupported parameter byte length!", param.name, param.byte_len)
+            if (param.offset > pos):
+                unpack_fmt += f"{param.offset - pos}x"
+                pack_fmt += f"{param.offset - pos}s"
+                self._pack_args.append(pad_byte * (param.offset - pos))
+            code = struct_codes[param.byte_len][int(param.signed)]
+            unpack_fmt += code
+            pack_fmt += code
+            self._pack_index[i] = len(self._pack_args)
+            self._pack_args.append(param.default)
+            pos = param.offset + param.byte_len
+        if (self._bytes > pos):
+            pack_fmt += f"{self._bytes - pos}s"
+            self._pack_args.append(pad_byte * (self._bytes - pos))
+
+        self._unpack_struct = struct.Struct(unpack_fmt)
+        self._pack_struct = struct.Struct(pack_fmt)
+
+        # struct fields come out in offset order, reorder them into parameter_names order
+        order = [i for i, param in ordered]
+        inverse = sorted(range(len(order)), key=lambda x: order[x])
+        if (inverse == list(range(len(order))) or len(order) < 2):
+            self._reorder = None
+        else:
+            self._reorder = itemgetter(*inverse)
+
+        self._dtype = np.dtype({
+            'names': [param.name for param in self.params.values()],
+            'formats': [f">{'i' if param.signed else 'u'}{param.byte_len}" for param in self.params.values()],
+            'offsets': [param.offset for param in self.params.values()],
+            'itemsize': self._bytes,
+        })
+
+    def _sync(self):
+        """Write the last unpacked values back into the parameter objects"""
+        if (self._stale):
+            self._stale = False
+            for param, val in zip(self.params.values(), self._values):
+                param.value = val
+
     @property
     def byte_length(self):
         return self._bytes
 
+    @property
+    def pad(self):
+        return self._pad
+
+    @property
+    def pad_byte(self) -> bytes:
+        """Byte filling the payload outside of the parameters"""
+        return b"\xff" if (self._pad) else b"\x00"
+
+    @property
+    def dtype(self) -> np.dtype:
+        """Structured dtype of one payload, fields in parameter_names order"""
+        return self._dtype
+
     @property
     def parameter_names(self):
         return list(self.params.keys())
 
     @property
     def values(self):
+        self._sync()
         out = dict()
         for key, param in self.params.items():
             out[param.name] = param.value
@@ -111,74 +201,354 @@ class ParameterSet:
         return new_ps
 
     def __getitem__(self, item) -> Parameter:
+        self._sync()
         return self.params[item]
 
     def __setitem__(self, key, value):
+        self._sync()
         self.params[key].value = value
 
     def __iter__(self):
+        self._sync()
         for x in self.params.values():
             yield x
 
     def __repr__(self):
+        self._sync()
         out = f"Parameter Set {self.set_name} from file {self.file}\n"
         for p in self.params.values():
             out += str(p) + "\n"
         return out
 
-    def pack(self):
-        out = bytearray([0xff if self._pad else 0x0] * self._bytes)
-        for key, param in self.params.items():
-            byte_start = param.offset
-            byte_end = param.offset + param.byte_len
-            out[byte_start:byte_end] = bytes(param)
-        return out
+    def pack(self, values: tuple = None):
+        """Pack values given in parameter_names order, or the current parameter values, into the payload"""
+        if (values is None):
+            self._sync()
+            values = [param.value for param in self.params.values()]
+        args = list(self._pack_args)
+        for i, val in zip(self._pack_index, values):
+            args[i] = val
+        return bytearray(self._pack_struct.pack(*args))
+
+    def unpack_batch(self, data, count: int = -1, offset: int = 0) -> np.ndarray:
+        """Decode a buffer of back to back payloads into a structured array without copying"""
+        return np.frombuffer(data, dtype=self._dtype, count=count, offset=offset)
 
-    def unpack(self, data: bytearray):
+    def unpack(self, data) -> tuple:
+        """Unpack the payload from any bytes-like object, a memoryview is read in place, returns the values in parameter_names order"""
         if (len(data) < self.min_len):
             raise AttributeError("Given data is too small to be unpacked into parameter set!", self.min_len, len(data))
 
-        for key, param in self.params.items():
-            byte_start = param.offset
-            byte_end = param.offset + param.byte_len
-            param.from_bytes(data[byte_start:byte_end])
+        vals = self._unpack_struct.unpack_from(data)
+        if (not self._reorder is None):
+            vals = self._reorder(vals)
+        self._values = vals
+        self._stale = True
+        if (self.check):
+            # bounds are enforced by the parameter setter, so checked sets can't be synced lazily
+            self._sync()
+        return vals
 
 
 class ParameterLog:
-    def __init__(self, parameter_set: ParameterSet, logdir=None):
+    """
+    Columnar log of unpacked parameter sets.
+
+    Every parameter is stored in its own preallocated NumPy array of the matching
+    integer width, times in a float64 array of seconds since `start_time`. New
+    datapoints are staged as tuples and committed to the columns in chunks.
+
+    Without a window the arrays grow geometrically. With `window_samples` and/or
+    `window_seconds` only the most recent samples are kept in a fixed ring buffer,
+    older samples are read back from the on-disk log when requested.
+
+    With `raw` only the payload bytes are stored, in a 2D uint8 array and the
+    binary log, and columns are decoded vectorized when they are first read.
+
+    `start_time` defaults to the time the log is created, a log of samples
+    stamped earlier, e.g. a replayed capture, starts at the first of them.
+    """
+
+    # samples kept in memory when only a time window is given
+    default_window_samples = 1 << 16
+    # rows between entries of the time to file offset index of the csv log
+    index_every = 1024
+
+    def __init__(self, parameter_set: ParameterSet, logdir=None, capacity: int = 4096, chunk: int = 256,
+                 window_samples: int = None, window_seconds: float = None, flush_interval: float = 1.0,
+                 flush_bytes: int = 1 << 16, fsync: bool = False, log_format: str = "csv", raw: bool = False,
+                 start_time: float = None):
         self.parameter_set = parameter_set
-        self.data = dict()
-        self.time = []
         self.names = self.parameter_set.parameter_names
-        for n in self.names:
-            self.data[n] = []
+        self.count = 0
+        self.chunk = chunk
 
+        self.window_seconds = window_seconds
+        if (window_samples is None and not window_seconds is None):
+            window_samples = self.default_window_samples
+        self.window_samples = window_samples
+        if (not self.window_samples is None):
+            # ring buffer written twice so the window is always one contiguous slice
+            capacity = 2 * self.window_samples
+            self.chunk = min(self.chunk, self.window_samples)
+        self.capacity = capacity
+
+        self.raw = raw
+        self.dtypes = {n: self.parameter_set.dtype.fields[n][0].newbyteorder('=') for n in self.names}
+        self.data = dict()
+        if (self.raw):
+            self.payloads = np.empty((self.capacity, self.parameter_set.byte_length), dtype=np.uint8)
+            self._decoded = dict()
+        else:
+            for n in self.names:
+                self.data[n] = np.empty(self.capacity, dtype=self.dtypes[n])
+        self.time = np.empty(self.capacity, dtype=np.float64)
+        self._row_dtype = np.dtype([(n, self.dtypes[n]) for n in self.names])
+        self._staged = []
+        self._staged_time = []
+        self._last_payload = None
+
+        if (not self.window_samples is None and logdir is None):
+            raise ValueError("A log directory is required to keep samples outside of the in-memory window!")
+        if (self.raw and not logdir is None and log_format != "bin"):
+            raise ValueError("Raw capture requires the binary log format!", log_format)
+
+        self.start_time = time.time() if (start_time is None) else start_time
+
+        if (not log_format in ("csv", "bin")):
+            raise ValueError("Unknown log format!", log_format)
+        self.log_format = log_format
         self.csv = False
+        self.filename = None
+        self.writer = None
+        self._binary_log: BinaryLog = None
         if (not (logdir is None)):
             Path(logdir).mkdir(parents=True, exist_ok=True)
-            self.filename = Path(logdir) / time.strftime("%Y_%b_%d-%H_%M_%S.csv")
-            self.file = open(str(self.filename), 'w', newline='')
-            self.writer = csv.writer(self.file)
-            self.writer.writerow(["time"] + self.names)
-            self.file.flush()
-            self.csv = True
+            writer_args = dict(index_every=self.index_every, flush_interval=flush_interval, flush_bytes=flush_bytes,
+                               fsync=fsync)
+            if (self.log_format == "csv"):
+                self.filename = Path(logdir) / time.strftime("%Y_%b_%d-%H_%M_%S.csv")
+                self.writer = CsvLogWriter(self.filename, ["time"] + self.names, self.start_time, **writer_args)
+                self.csv = True
+            else:
+                self.filename = Path(logdir) / time.strftime("%Y_%b_%d-%H_%M_%S.clog")
+                self.writer = BinaryLogWriter(self.filename, self.parameter_set, self.start_time, **writer_args)
+
+        # datapoints may be logged from the CAN reader thread while the GUI reads series
+        self.lock = threading.Lock()
+
+    def _grow(self, required: int):
+        while (self.capacity < required):
+            self.capacity *= 2
+        for n in self.data:
+            column = np.empty(self.capacity, dtype=self.data[n].dtype)
+            column[:self.count] = self.data[n][:self.count]
+            self.data[n] = column
+        if (self.raw):
+            payloads = np.empty((self.capacity, self.payloads.shape[1]), dtype=np.uint8)
+            payloads[:self.count] = self.payloads[:self.count]
+            self.payloads = payloads
+        column = np.empty(self.capacity, dtype=np.float64)
+        column[:self.count] = self.time[:self.count]
+        self.time = column
 
-        self.start_time = time.time()
+    def _commit(self):
+        """Move staged datapoints into the columns, must hold the lock"""
+        k = len(self._staged)
+        if (k == 0):
+            return
+        if (self.window_samples is None and self.count + k > self.capacity):
+            self._grow(self.count + k)
+
+        if (self.raw):
+            rows = np.frombuffer(b"".join(self._staged), dtype=np.uint8).reshape(k, self.payloads.shape[1])
+            columns = [(self.payloads, rows)]
+        else:
+            rows = np.array(self._staged, dtype=self._row_dtype)
+            columns = [(self.data[n], rows[n]) for n in self.names]
+        columns.append((self.time, np.array(self._staged_time, dtype=np.float64)))
+        self._staged = []
+        self._staged_time = []
+
+        if (self.window_samples is None):
+            i = self.count
+            for column, rows in columns:
+                column[i:i + k] = rows
+        else:
+            idx = (self.count + np.arange(k)) % self.window_samples
+            mirror = idx + self.window_samples
+            for column, rows in columns:
+                column[idx] = rows
+                column[mirror] = rows
+        self.count += k
+
+    def _column(self, name, i: int, j: int):
+        """Get the values of a parameter in the column slice [i, j), must hold the lock"""
+        if (not self.raw):
+            return self.data[name][i:j]
+        if (not self.window_samples is None):
+            return self._decode(name, i, j)
+        # decoded columns of a growing capture are cached and only extended by new samples
+        column, decoded = self._decoded.get(name, (None, 0))
+        if (column is None or len(column) < self.capacity):
+            grown = np.empty(self.capacity, dtype=self.dtypes[name])
+            if (not column is None):
+                grown[:decoded] = column[:decoded]
+            column = grown
+        if (decoded < j):
+            column[decoded:j] = self._decode(name, decoded, j)
+            decoded = j
+        self._decoded[name] = (column, decoded)
+        return column[i:j]
+
+    def _decode(self, name, i: int, j: int):
+        return self.payloads[i:j].view(self.parameter_set.dtype)[:, 0][name].astype(self.dtypes[name])
+
+    def _window(self):
+        """Get the slice of the columns holding the in-memory samples, must hold the lock"""
+        if (self.window_samples is None):
+            start, stop = 0, self.count
+        elif (self.count <= self.window_samples):
+            start, stop = 0, self.count
+        else:
+            start = self.count % self.window_samples
+            stop = start + self.window_samples
+        if (not self.window_seconds is None and stop > start):
+            start += int(np.searchsorted(self.time[start:stop], self.time[stop - 1] - self.window_seconds))
+        return start, stop
 
     def log_datapoint(self, data, t=None):
         if (t is None):
             t = time.time()
-        row = [t]
-        self.parameter_set.unpack(data)
-        vals = self.parameter_set.values
-        for p in self.names:
-            self.data[p].append(vals[p])
-            row.append(vals[p])
-        self.time.append(t)
-        if (self.csv):
-            self.writer.writerow(row)
-            #print(row)
-            self.file.flush()
-
-    def get_data_series(self, name, elapsed=True):
-        return [i for i in self.data[name]], [(i-self.start_time if elapsed else i) for i in self.time]
+        if (not self.writer is None and not self.writer.error is None):
+            # the log file misses everything from here on, fail instead of only keeping it in memory
+            raise self.writer.error
+        with tracing.span("log_datapoint"), self.lock:
+            if (self.raw):
+                payload = self.payload_bytes(data)
+                self._last_payload = payload
+                self._staged.append(payload)
+            else:
+                vals = self.parameter_set.unpack(data)
+                self._staged.append(vals)
+            self._staged_time.append(t - self.start_time)
+            if (len(self._staged) >= self.chunk):
+                self._commit()
+            if (self.csv):
+                self.writer.write((t,) + vals)
+            elif (not self.writer is None):
+                self.writer.write((t, payload if (self.raw) else bytes(data)))
+
+    @property
+    def samples(self) -> int:
+        """Number of datapoints logged so far, including ones not yet moved into the columns"""
+        return self.count + len(self._staged)
+
+    def payload_bytes(self, data) -> bytes:
+        """Copy a payload at the length of the parameter set, padding it if it is short"""
+        if (len(data) < self.parameter_set.min_len):
+            raise AttributeError("Given data is too small to be unpacked into parameter set!",
+                                 self.parameter_set.min_len, len(data))
+        payload = bytes(data[:self.parameter_set.byte_length])
+        if (len(payload) < self.parameter_set.byte_length):
+            payload = payload.ljust(self.parameter_set.byte_length, self.parameter_set.pad_byte)
+        return payload
+
+    def unpack_latest(self):
+        """Unpack the most recent payload into the parameter set, raw captures skip this while logging"""
+        with self.lock:
+            if (self.raw and not self._last_payload is None):
+                self.parameter_set.unpack(self._last_payload)
+
+    def close(self):
+        """Write out and close the log file, the in-memory samples stay available"""
+        if (not self.writer is None):
+            self.writer.close()
+
+    def window_start(self):
+        """Elapsed time of the oldest sample held in memory, None if there are none"""
+        with self.lock:
+            self._commit()
+            start, stop = self._window()
+            return self.time[start] if (stop > start) else None
+
+    def get_data_series(self, name, elapsed=True, start: float = None, end: float = None):
+        """
+        Get the logged values and times of a parameter.
+
+        Without a range the in-memory samples of a growing log are returned as
+        views, only elapsed times are zero-copy. Those of a windowed log are
+        copied, as later commits wrap around into the slice a view would cover. A range in elapsed seconds reaching back past the
+        in-memory window is completed from the on-disk log.
+        """
+        with self.lock:
+            self._commit()
+            i, j = self._window()
+            values, times = self._column(name, i, j), self.time[i:j]
+            if (not self.window_samples is None):
+                # raw windowed columns are already decoded into a new array
+                values, times = (values if (self.raw) else values.copy()), times.copy()
+            oldest = self.time[i] if (j > i) else None
+            dropped = self.count > j - i
+
+        if (not start is None or not end is None):
+            lo = 0 if (start is None) else int(np.searchsorted(times, start))
+            hi = len(times) if (end is None) else int(np.searchsorted(times, end))
+            values, times = values[lo:hi], times[lo:hi]
+            if (dropped and not start is None and (oldest is None or start < oldest)):
+                history_end = end if (oldest is None or (not end is None and end < oldest)) else oldest
+                history, history_times = self.load_history(start, history_end, names=[name])
+                values = np.concatenate((history[name], values))
+                times = np.concatenate((history_times, times))
+        return values, (times if elapsed else times + self.start_time)
+
+    def get_data_after(self, name, after: float = None):
+        """
+        Get copies of the in-memory values and elapsed times of a parameter logged after the
+        elapsed time `after`, only the new rows are copied, for following a growing log.
+        """
+        with self.lock:
+            self._commit()
+            i, j = self._window()
+            if (not after is None):
+                i += int(np.searchsorted(self.time[i:j], after, side='right'))
+            values = self._column(name, i, j)
+            return (values if (self.raw and not self.window_samples is None) else values.copy()), self.time[i:j].copy()
+
+    def load_history(self, start: float = None, end: float = None, names=None):
+        """Read samples with elapsed times in [start, end) back from the log file"""
+        if (self.writer is None):
+            raise ValueError("Log has no file to load history from!")
+        names = self.names if (names is None) else names
+        if (self.log_format == "bin"):
+            self.writer.sync()
+            if (self._binary_log is None):
+                self._binary_log = BinaryLog(self.filename)
+            return self._binary_log.series(names, start, end)
+        columns = [self.names.index(n) + 1 for n in names]
+        self.writer.sync()
+        offset = 0
+        if (not start is None):
+            for t, pos in list(self.writer.index):
+                if (t > start):
+                    break
+                offset = pos
+
+        times = []
+        rows = []
+        with open(str(self.filename), 'rb') as f:
+            if (offset == 0):
+                f.readline()
+            else:
+                f.seek(offset)
+            for row in csv.reader(io.TextIOWrapper(f, newline='')):
+                t = float(row[0]) - self.start_time
+                if (not start is None and t < start):
+                    continue
+                if (not end is None and t >= end):
+                    break
+                times.append(t)
+                rows.append([int(row[c]) for c in columns])
+
+        values = np.array(rows, dtype=np.int64).reshape(len(rows), len(columns))
+        return {n: values[:, k].astype(self.dtypes[n]) for k, n in enumerate(names)}, np.array(times, dtype=np.float64)
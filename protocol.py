@@ -0,0 +1,275 @@
+""" Protocol engine of the payload command interface
+
+A firmware variant is a `Protocol`: the layout of its CAN identifiers, the id of
+the OBC and its subsystems, and a table of its commands. The variants are
+registered in `variants`, driver_mk1 and driver_mk2 wrap one each with the
+functions of their command set. Every protocol keeps its own caches, so
+variants can be used side by side in one process.
+"""
+
+from collections import namedtuple
+from functools import lru_cache
+
+from crc import crc_16_bytes
+
+PREAMBLE = bytes([0x58, 0x44, 0x41, 0x54])
+
+# frame type of the payload header
+COMMAND = 0x01
+RESPONSE = 0x00
+
+# Encoded commands kept per protocol, least recently used ones are evicted first
+FRAME_CACHE_SIZE = 64
+
+# length and response_length are the length fields of the command and its response header,
+# commands without a response_length are not answered with data that is checked
+Command = namedtuple('Command', ['name', 'cmd_id', 'length', 'response_length'])
+
+
+def bitmask(b):
+    return (1 << b) - 1
+
+
+def ceildiv(a, b):
+    return -(a // -b)
+
+
+def bounded(inp, lower, upper):
+    return max(min(inp, upper), lower)
+
+
+class Frames(list):
+    """
+    Frames of a transfer with their data reassembled into a memoryview and the
+    checksum of it up to the CRC field folded in as they arrived, see `Reassembler`
+    """
+
+    def __init__(self, frames=(), crc: bytes = None, data: memoryview = None):
+        super(Frames, self).__init__(frames)
+        self.crc = crc
+        self.data = data
+
+
+class IdLayout:
+    """
+    Layout of the 29 bit extended identifier of a firmware variant.
+
+    From the top a command identifier holds the OBC id in `src_bits`, the
+    subsystem id in `dest_bits`, the frame type (1 for a multi-frame transfer),
+    the count of frames still to follow and pad bits set to one. A response
+    holds the OBC id in a `src_bits` field above the frame type and the
+    subsystem id in the bits above that.
+
+    Shifts and masks are computed once, the identifiers of a transfer are
+    cached per (subsystem, OBC, frame count).
+    """
+
+    id_bits = 29
+
+    def __init__(self, src_bits: int, dest_bits: int, ftype_bits: int = 1, fcnt_bits: int = 8):
+        self.src_bits = src_bits
+        self.dest_bits = dest_bits
+        self.ftype_bits = ftype_bits
+        self.fcnt_bits = fcnt_bits
+        self.pad_bits = self.id_bits - src_bits - dest_bits - ftype_bits - fcnt_bits
+        if (self.pad_bits < 0):
+            raise ValueError("Identifier fields exceed 29 bits!", src_bits, dest_bits, ftype_bits, fcnt_bits)
+
+        self.pad = bitmask(self.pad_bits)
+        self.fcnt_shift = self.pad_bits
+        self.ftype_shift = self.fcnt_shift + fcnt_bits
+        self.dst_shift = self.ftype_shift + ftype_bits
+        self.src_shift = self.dst_shift + dest_bits
+        self.src_mask = bitmask(src_bits)
+        self.dest_mask = bitmask(dest_bits)
+        self.ftype_mask = bitmask(ftype_bits)
+        self.fcnt_mask = bitmask(fcnt_bits)
+
+        self._command_ids = dict()
+        self._response_headers = dict()
+
+    def transfer_flags(self, frame_cnt: int) -> list:
+        """Frame type, frame count and pad bits of every frame of a transfer"""
+        ftype = ((0 if (frame_cnt == 1) else 1) & self.ftype_mask) << self.ftype_shift
+        return [ftype | ((((frame_cnt - 1) - i) & self.fcnt_mask) << self.fcnt_shift) | self.pad
+                for i in range(frame_cnt)]
+
+    def command_ids(self, subsys_id: int, obc_id: int, frame_cnt: int) -> tuple:
+        """Identifiers of the frames of a command from the OBC to a subsystem"""
+        key = (subsys_id, obc_id, frame_cnt)
+        ids = self._command_ids.get(key)
+        if (ids is None):
+            base = ((obc_id & self.src_mask) << self.src_shift) | ((subsys_id & self.dest_mask) << self.dst_shift)
+            ids = self._command_ids[key] = tuple(base | flags for flags in self.transfer_flags(frame_cnt))
+        return ids
+
+    def response_ids(self, subsys_id: int, obc_id: int, frame_cnt: int) -> tuple:
+        """Identifiers of the frames of a response from a subsystem to the OBC"""
+        base = (subsys_id << (self.dst_shift + self.src_bits)) | ((obc_id & self.src_mask) << self.dst_shift)
+        return tuple(base | flags for flags in self.transfer_flags(frame_cnt))
+
+    def response_headers(self, subsys_id: int, obc_id: int, frame_cnt: int) -> tuple:
+        """Identifiers of the frames of a response without their pad bits, as a response is checked"""
+        key = (subsys_id, obc_id, frame_cnt)
+        headers = self._response_headers.get(key)
+        if (headers is None):
+            headers = tuple(can_id >> self.pad_bits for can_id in self.response_ids(subsys_id, obc_id, frame_cnt))
+            self._response_headers[key] = headers
+        return headers
+
+    def split(self, can_id: int):
+        """Split a CAN identifier into (src_id, dst_id, frame type, frame count)"""
+        return ((can_id >> self.src_shift) & self.src_mask, (can_id >> self.dst_shift) & self.dest_mask,
+                (can_id >> self.ftype_shift) & self.ftype_mask, (can_id >> self.fcnt_shift) & self.fcnt_mask)
+
+
+class Protocol:
+    """
+    Command set of a firmware variant.
+
+    `subsys_ids` are the ids of the subsystems commands are addressed to, by
+    index, `commands` the table of commands. Commands are encoded through an
+    LRU cache keyed by subsystem, command and parameter bytes, holding the
+    (id, data) frames ready to write.
+    """
+
+    def __init__(self, name: str, layout: IdLayout, obc_id: int, subsys_ids, commands, preamble: bytes = PREAMBLE):
+        self.name = name
+        self.layout = layout
+        self.obc_id = obc_id
+        self.subsys_ids = list(subsys_ids)
+        self.preamble = preamble
+        self.commands = {c.name: c for c in commands}
+
+        # command id -> name, ids shared by several commands list all of them
+        self.command_names = dict()
+        for c in commands:
+            names = self.command_names.get(c.cmd_id)
+            self.command_names[c.cmd_id] = c.name if (names is None) else f"{names}/{c.name}"
+
+        self.pack_template = lru_cache(maxsize=FRAME_CACHE_SIZE)(self.encode)
+        self.split_id = layout.split
+
+    def command(self, name: str) -> Command:
+        command = self.commands.get(name)
+        if (command is None):
+            raise ValueError("Unknown command!", self.name, name)
+        return command
+
+    def send(self, name: str, param, subsys: int = 0) -> tuple:
+        """Encode a command with its parameter bytes to the subsystem at index subsys"""
+        command = self.command(name)
+        return self.pack_template(self.preamble, bytes([COMMAND]), self.subsys_ids[subsys],
+                                  command.cmd_id.to_bytes(2, 'big'), bytes([command.length]), bytes(param))
+
+    def receive(self, frames, name: str, subsys: int = 0):
+        """Check the frames of a response to a command, returns its body or an error message"""
+        command = self.command(name)
+        if (command.response_length is None):
+            raise ValueError("Command has no response!", self.name, name)
+        return self.decode(frames, RESPONSE, self.subsys_ids[subsys], command.cmd_id.to_bytes(2, 'big'),
+                           command.response_length)
+
+    def encode(self, preamble: bytes, frame_type: bytes, subsys_id: int, cmd_id: bytes, length: bytes,
+               param: bytes) -> tuple:
+        crc = crc_16_bytes(preamble + frame_type + bytes([subsys_id]) + cmd_id + length + param)
+        can_data = frame_type + cmd_id + length + param + crc
+        ids = self.layout.command_ids(subsys_id, self.obc_id, ceildiv(len(can_data), 8))
+        return tuple((can_id, can_data[i * 8:(i + 1) * 8]) for i, can_id in enumerate(ids))
+
+    def encode_response(self, preamble: bytes, subsys_id: int, cmd_id: bytes, param: bytes) -> tuple:
+        """Encode the frames a subsystem answers a command with, the CRC covers the same fields as for a command"""
+        header = bytes([RESPONSE]) + cmd_id + bytes([len(param)])
+        crc = crc_16_bytes(preamble + header[:1] + bytes([subsys_id]) + header[1:] + param)
+        can_data = header + param + crc
+        ids = self.layout.response_ids(subsys_id, self.obc_id, ceildiv(len(can_data), 8))
+        return tuple((can_id, can_data[i * 8:(i + 1) * 8]) for i, can_id in enumerate(ids))
+
+    def decode(self, frames, frame_type: int, subsys_id: int, cmd_id: bytes, length: int):
+        """Check the frames of a response, the body is returned as a memoryview into the reassembled data"""
+        headers = self.layout.response_headers(subsys_id, self.obc_id, len(frames))
+        pad_bits = self.layout.pad_bits
+        for i in range(len(frames)):
+            if (frames[i].id >> pad_bits != headers[i]):
+                return self.header_error(frames, i, subsys_id)
+
+        reassembled = isinstance(frames, Frames) and not frames.data is None
+        if (reassembled):
+            data = frames.data
+        else:
+            data = bytearray()
+            for frame in frames:
+                data.extend(frame.data)
+            data = memoryview(data)
+
+        crc = frames.crc if (reassembled and not frames.crc is None) else crc_16_bytes(data[:-2])
+
+        if crc == data[-2:]:
+            return f"CRC Mismatch: Expected {crc.hex()}, got {data[-2:].hex()}"
+
+        data = data[:-2]
+        if frame_type != data[0]:
+            return f"Frame type Mismatch: Expected {hex(frame_type)}, got {hex(data[0])}"
+        if cmd_id != data[1:3]:
+            return f"Command id Mismatch: Expected {cmd_id.hex()}, got {data[1:3].hex()}"
+        if length != data[3]:
+            return f"Length Mismatch: Expected {hex(length)}, got {hex(data[3])}"
+        return data[4:]
+
+    def header_error(self, frames, i: int, subsys_id: int) -> str:
+        """Describe why the identifier of frame i does not match the expected response"""
+        layout = self.layout
+        buffer = frames[i].id >> layout.pad_bits
+        frame_cnt = buffer & layout.fcnt_mask
+        if frame_cnt != len(frames) - i - 1:
+            return f"Identifier frame count Mismatch: Expected {len(frames) - i}, got {frame_cnt}"
+        buffer >>= layout.fcnt_bits
+        ftype = buffer & layout.ftype_mask
+        if ftype != int(len(frames) > 1):
+            return f"Identifier frame type Mismatch: Expected {int(len(frames) > 1)}, got {ftype}"
+        buffer >>= layout.ftype_bits
+        src_id = buffer & layout.src_mask
+        if src_id != self.obc_id:
+            return f"Identifier SRC_ID mismatch: Expected {hex(self.obc_id)}, got {hex(src_id)}"
+        buffer >>= layout.src_bits
+        return f"Identifier DST_ID mismatch: Expected {subsys_id}, got {hex(buffer)}"
+
+    def pack(self, preamble, frame_type, subsys_id, cmd_id, length, param) -> tuple:
+        """Encode a command given as lists of header fields and parameter bytes"""
+        return self.pack_template(bytes(preamble), bytes(frame_type), subsys_id[0], bytes(cmd_id), bytes(length),
+                                  bytes(param))
+
+    def unpack(self, frames, frame_type, subsys_id, cmd_id, length):
+        """Check the frames of a response against header fields given as lists"""
+        return self.decode(frames, frame_type[0], subsys_id[0], bytes(cmd_id), length[0])
+
+    def pack_response(self, preamble, subsys_id, cmd_id, param) -> tuple:
+        return self.encode_response(bytes(preamble), subsys_id[0], bytes(cmd_id), bytes(param))
+
+
+variants = {
+    "mk1": Protocol("mk1", IdLayout(src_bits=12, dest_bits=8), obc_id=0x7d0, subsys_ids=[0xCC], commands=[
+        Command("INIT_PAYL", 0x00, 0x01, 0x02),
+        Command("SET_TIME", 0x01, 0x13, None),
+        Command("START_OPERATION", 0x02, 0x02, 0x04),
+        Command("STOP_OPERATION", 0x03, 0x01, 0x02),
+        Command("STOP_PAYL", 0x04, 0x02, 0x02),
+        Command("DATA_GET", 0x05, 0x08, 0x5C),
+        Command("DATA_SEND", 0x06, 0x5C, 0x02),
+        Command("PMA_TEST", 0x07, 0x16, None),
+        Command("PPU_TEST", 0x08, 0x0C, None),
+    ]),
+    "mk2": Protocol("mk2", IdLayout(src_bits=8, dest_bits=8), obc_id=0x08, subsys_ids=[0x10, 0x11], commands=[
+        Command("INIT_PAYL", 0x00, 0x01, 0x02),
+        Command("SET_TIME", 0x01, 0x13, 0x02),
+        Command("START_OPERATION", 0x02, 0x01, 0x04),
+        Command("STOP_OPERATION", 0x03, 0x01, 0x02),
+        Command("STOP_PAYL", 0x04, 0x02, 0x02),
+        Command("DATA_GET", 0x05, 0x08, 0xA2),
+        Command("DATA_SEND", 0x06, 0x44, 0x02),
+        Command("PMA_TEST", 0x07, 0x16, None),
+        Command("DATA_SEND_TEST", 0x07, 0x44, 0x02),
+        Command("PPU_TEST", 0x08, 0x0C, None),
+        Command("STOP_OPERATION_TEST", 0x09, 0x01, 0x02),
+    ]),
+}
@@ -0,0 +1,121 @@
+import time
+
+from crc import Crc16, crc_16_bytes
+from driver_mk2 import *
+
+
+class Transfer:
+    def __init__(self, frame, deadline: float, started: float):
+        self.frames = [frame]
+        self.remaining = split_id(frame.id)[3]
+        self.deadline = deadline
+        self.started = started
+        # data is copied into place as fragments arrive, sized for the frame count of the first one
+        self.buffer = memoryview(bytearray(8 * (self.remaining + 1)))
+        self.length = 0
+        # the last 2 bytes received may be the CRC field, they are folded in once more data follows
+        self.crc = Crc16()
+        self.checked = 0
+        self.add(frame)
+
+    def append(self, frame):
+        self.frames.append(frame)
+        self.add(frame)
+
+    def add(self, frame):
+        end = self.length + len(frame.data)
+        self.buffer[self.length:end] = frame.data
+        self.length = end
+        if (end - 2 > self.checked):
+            self.crc.update(self.buffer[self.checked:end - 2])
+            self.checked = end - 2
+
+    def complete(self) -> Frames:
+        return Frames(self.frames, crc=self.crc.digest(), data=self.buffer[:self.length])
+
+
+class Reassembler:
+    """
+    Incremental reassembler for multi-frame transfers.
+
+    Frames are fed one at a time, partial transfers are kept per (src_id, dst_id)
+    so transfers from different nodes can be interleaved on the bus. A transfer
+    is returned as `Frames` as soon as its last fragment (count 0) arrives, with
+    its data reassembled into one buffer and the checksum folded in fragment by
+    fragment, so unpack needs neither a copy nor a second pass over the data.
+    `started` then holds the time its first fragment was fed.
+
+    A transfer that breaks off counts as one drop: the (src_id, dst_id) key is
+    kept in `broken` and its remaining continuation frames are discarded
+    silently until the next first fragment or single frame from that key.
+    """
+
+    def __init__(self, timeout: float = 1.0, logger=None):
+        self.timeout = timeout
+        self.logger = logger
+        self.partial = dict()
+        self.broken = set()
+        self.dropped = 0
+        self.started = None
+
+    def feed(self, frame, now: float = None):
+        """Feed a single frame, returns the frames of a completed transfer or None"""
+        if (now is None):
+            now = time.monotonic()
+        src_id, dst_id, ftype, frame_cnt = split_id(frame.id)
+        key = (src_id, dst_id)
+        transfer = self.partial.get(key)
+
+        if (not transfer is None):
+            if (ftype == 1 and frame_cnt == transfer.remaining - 1):
+                transfer.append(frame)
+                transfer.remaining = frame_cnt
+                transfer.deadline = now + self.timeout
+                if (frame_cnt == 0):
+                    del self.partial[key]
+                    self.started = transfer.started
+                    return transfer.complete()
+                return None
+            del self.partial[key]
+            self.drop(key, len(transfer.frames), f"expected frame count {transfer.remaining - 1}, got {frame_cnt}")
+
+        if (ftype == 0):
+            self.broken.discard(key)
+            self.started = now
+            data = memoryview(frame.data)
+            return Frames([frame], crc=crc_16_bytes(data[:-2]), data=data)
+        if (not self.is_first_fragment(frame, frame_cnt)):
+            if (not key in self.broken):
+                self.drop(key, 0, "continuation frame without a transfer in progress")
+            return None
+        self.broken.discard(key)
+        self.partial[key] = Transfer(frame, now + self.timeout, now)
+        return None
+
+    @staticmethod
+    def is_first_fragment(frame, frame_cnt: int) -> bool:
+        """
+        Check a frame for the header a first fragment carries: a frame type and a known command id.
+        Continuation frames hold arbitrary data, which passes this in about one of a million frames.
+        The length field is left to unpack, so a transfer whose length disagrees with its frame count
+        is still reassembled by frame count and reported as a Length Mismatch to whoever awaits it,
+        rather than dropped and left to time out.
+        """
+        if (frame_cnt == 0 or len(frame.data) < 4):
+            return False
+        return frame.data[0] <= 1 and int.from_bytes(frame.data[1:3], 'big') in COMMAND_NAMES
+
+    def expire(self, now: float = None):
+        """Drop partial transfers that have not received a fragment within the timeout"""
+        if (now is None):
+            now = time.monotonic()
+        for key in [k for k, t in self.partial.items() if t.deadline <= now]:
+            self.drop(key, len(self.partial.pop(key).frames), "timed out")
+
+    def drop(self, key, frames: int, reason: str):
+        """Count a broken transfer once, continuation frames of it that follow are discarded without a drop"""
+        self.broken.add(key)
+        self.dropped += 1
+        if (not self.logger is None):
+            self.logger.warning(f"Dropped partial transfer from {hex(key[0])} to {hex(key[1])} "
+                                f"({frames} frames): {reason}")
@@ -0,0 +1,132 @@
+""" Replay of captured CAN traffic
+
+A capture is the binary frame trace written with `frame_trace_format = "bin"`,
+see frame_trace.py. `Replay` feeds the received frames of a capture back
+through reassembly and DATA_GET decoding into a ParameterLog, either as fast as
+possible or at the original timing.
+
+    python replay.py CAPTURE [--realtime] [--speed FACTOR] [--logdir DIR] [--format csv|bin]
+"""
+
+import argparse
+import time
+from collections import Counter, namedtuple
+
+import numpy as np
+
+from driver_mk2 import *
+from frame_trace import RX, read_frame_trace
+from params import ParameterSet, ParameterLog, get_params_file
+from reassembler import Reassembler
+
+CapturedFrame = namedtuple('CapturedFrame', ['id', 'data', 'timestamp'])
+
+
+class Replay:
+    """
+    Feeds a frame capture through the receive pipeline.
+
+    Samples are stamped like live ones: with the hardware timestamp of the first
+    frame of a response, mapped onto the host clock of the capture. The offset is
+    estimated as the smallest difference between host and hardware time over the
+    capture, the host clock always being later by the receive latency. Logs
+    created with `new_log` start at the first host time of the capture, so
+    elapsed times count from the start of the capture.
+    """
+
+    def __init__(self, filename, log: ParameterLog = None, realtime: bool = False, speed: float = 1.0, logger=None):
+        self.records = read_frame_trace(filename)
+        self.start_time = float(self.records['time'][0]) if (len(self.records) > 0) else None
+        self.records = self.records[self.records['direction'] == RX]
+        self.log = log
+        self.realtime = realtime
+        self.speed = speed
+        self.logger = logger
+
+        stamped = self.records['timestamp'] >= 0
+        self.clock_offset = None
+        if (np.any(stamped)):
+            self.clock_offset = float(np.min(self.records['time'][stamped] - self.records['timestamp'][stamped] / 1000))
+
+        self.reassembler = Reassembler(timeout=1.0, logger=logger)
+        self.commands = Counter()
+        self.samples = 0
+        self.errors = 0
+
+    def new_log(self, parameter_set: ParameterSet, **kwargs) -> ParameterLog:
+        """Create the ParameterLog replayed samples are logged to, starting at the capture"""
+        self.log = ParameterLog(parameter_set, start_time=self.start_time, **kwargs)
+        return self.log
+
+    def frames(self):
+        """Get the captured frames with their host receive times"""
+        times = self.records['time'].astype(np.float64)
+        ids = self.records['id'].tolist()
+        dlcs = self.records['dlc'].tolist()
+        data = self.records['data'].tobytes()
+        stamps = self.records['timestamp'].tolist()
+        for i in range(len(ids)):
+            yield times[i], CapturedFrame(ids[i], data[8 * i:8 * i + dlcs[i]], None if (stamps[i] < 0) else stamps[i])
+
+    def frame_time(self, frames, host_time: float) -> float:
+        if (self.clock_offset is None or frames[0].timestamp is None):
+            return host_time
+        return self.clock_offset + frames[0].timestamp / 1000
+
+    def run(self) -> dict:
+        start = time.monotonic()
+        first = None
+        for host_time, frame in self.frames():
+            if (first is None):
+                first = host_time
+            if (self.realtime):
+                wait = (host_time - first) / self.speed - (time.monotonic() - start)
+                if (wait > 0):
+                    time.sleep(wait)
+            # reassembly timeouts run on the captured clock
+            frames = self.reassembler.feed(frame, now=host_time)
+            if (not frames is None):
+                self.on_transfer(frames, host_time)
+        return self.stats(time.monotonic() - start)
+
+    def on_transfer(self, frames, host_time: float):
+        src_id, dst_id, ftype, frame_cnt = split_id(frames[0].id)
+        cmd_id = int.from_bytes(frames[0].data[1:3], 'big')
+        self.commands[COMMAND_NAMES.get(cmd_id, hex(cmd_id))] += 1
+        if (cmd_id != 0x05 or not [src_id] in ID):
+            return
+        fr = data_get_receive(frames, subsys=ID.index([src_id]))
+        if (isinstance(fr, str) or fr[:2].hex() != '0000'):
+            self.errors += 1
+            if (not self.logger is None):
+                self.logger.error(f"Replayed DATA_GET response rejected: {fr if isinstance(fr, str) else fr[:2].hex()}")
+            return
+        self.log.log_datapoint(fr[8:], t=self.frame_time(frames, host_time))
+        self.samples += 1
+
+    def stats(self, elapsed: float) -> dict:
+        return {
+            "frames": len(self.records),
+            "samples": self.samples,
+            "errors": self.errors,
+            "dropped_transfers": self.reassembler.dropped,
+            "commands": dict(self.commands),
+            "elapsed": elapsed,
+            "frames_per_second": len(self.records) / elapsed if (elapsed > 0) else 0.0,
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay a binary frame capture into a parameter log")
+    parser.add_argument("capture")
+    parser.add_argument("--realtime", action="store_true", help="keep the original timing instead of running flat out")
+    parser.add_argument("--speed", type=float, default=1.0, help="time scale of a realtime replay")
+    parser.add_argument("--logdir", default=None, help="write the decoded samples to a log in this directory")
+    parser.add_argument("--format", default="csv", choices=["csv", "bin"])
+    args = parser.parse_args()
+
+    parameters = ParameterSet(get_params_file, name="Get Parameters", bytes=0x9A, pad=1, check=False)
+    replay = Replay(args.capture, realtime=args.realtime, speed=args.speed)
+    log = replay.new_log(parameters, logdir=args.logdir, log_format=args.format)
+    print(replay.run())
+    log.close()
@@ -0,0 +1,107 @@
+import threading
+import time
+
+import numpy as np
+
+
+class PeriodicScheduler(threading.Thread):
+    """
+    Calls a function periodically from its own thread.
+
+    Ticks target absolute deadlines start + k * period on the monotonic clock, so
+    a late tick does not delay the ones after it and the period does not drift.
+    If a call runs past the next deadline the missed ticks are skipped and counted
+    instead of being run back to back. The lateness of every tick is recorded in
+    a histogram. The callback gets the wall-clock time of the tick, derived from
+    the monotonic clock so it is not affected by clock adjustments. A callback
+    returning False declined the tick, e.g. while its previous work is still in
+    flight, which is counted in `declined` as a tick that did no work.
+    """
+
+    # upper edges of the lateness histogram bins in seconds, the last bin is open ended
+    lateness_bins = np.array([50e-6, 100e-6, 200e-6, 500e-6, 1e-3, 2e-3, 5e-3, 10e-3, 20e-3, 50e-3, 100e-3])
+
+    def __init__(self, period: float, callback, logger=None, name: str = "PeriodicScheduler"):
+        super(PeriodicScheduler, self).__init__(name=name, daemon=True)
+        if (period <= 0):
+            raise ValueError("Period has to be positive!", period)
+        self.period = period
+        self.callback = callback
+        self.logger = logger
+
+        self.ticks = 0
+        self.skipped = 0
+        self.declined = 0
+        self.overruns = 0
+        self.max_lateness = 0.0
+        self.total_lateness = 0.0
+        self.histogram = np.zeros(len(self.lateness_bins) + 1, dtype=np.int64)
+
+        self.wall_offset = time.time() - time.monotonic()
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+        if (self.is_alive() and threading.current_thread() is not self):
+            self.join()
+
+    def run(self):
+        start = time.monotonic()
+        k = 0
+        while True:
+            deadline = start + k * self.period
+            wait = deadline - time.monotonic()
+            if (self._stop_event.wait(wait) if (wait > 0) else self._stop_event.is_set()):
+                return
+            now = time.monotonic()
+            self.record(now - deadline)
+            try:
+                if (self.callback(now + self.wall_offset) is False):
+                    self.declined += 1
+            except Exception as e:
+                if (not self.logger is None):
+                    self.logger.exception(f"Scheduled call of {self.name} failed: {e}")
+
+            k += 1
+            done = time.monotonic()
+            if (done > start + k * self.period):
+                # the call overran the next deadline, resume at the first one still ahead
+                resume = int((done - start) // self.period) + 1
+                self.overruns += 1
+                self.skipped += resume - k
+                k = resume
+
+    def record(self, lateness: float):
+        self.ticks += 1
+        self.total_lateness += lateness
+        self.max_lateness = max(self.max_lateness, lateness)
+        self.histogram[np.searchsorted(self.lateness_bins, lateness)] += 1
+
+    def percentile(self, q: float) -> float:
+        """Upper bound of the q-th percentile of the tick lateness in seconds, from the histogram bins"""
+        if (self.ticks == 0):
+            return 0.0
+        i = int(np.searchsorted(np.cumsum(self.histogram), q / 100 * self.ticks))
+        return float(self.lateness_bins[i]) if (i < len(self.lateness_bins)) else self.max_lateness
+
+    def stats(self) -> dict:
+        return {
+            "period": self.period,
+            "ticks": self.ticks,
+            "skipped": self.skipped,
+            "declined": self.declined,
+            "overruns": self.overruns,
+            "mean_lateness": self.total_lateness / self.ticks if (self.ticks > 0) else 0.0,
+            "p50_lateness": self.percentile(50),
+            "p99_lateness": self.percentile(99),
+            "max_lateness": self.max_lateness,
+            "histogram": dict(zip([f"<={b * 1e3:g}ms" for b in self.lateness_bins] + ["more"],
+                                  self.histogram.tolist())),
+        }
+
+    def report(self) -> str:
+        s = self.stats()
+        return (f"{self.name}: {s['ticks']} ticks of {s['period'] * 1e3:g} ms, {s['skipped']} skipped in "
+                f"{s['overruns']} overruns, {s['declined']} declined as busy, lateness mean {s['mean_lateness'] * 1e3:.3f} ms, "
+                f"p50 <= {s['p50_lateness'] * 1e3:g} ms, p99 <= {s['p99_lateness'] * 1e3:g} ms, "
+                f"max {s['max_lateness'] * 1e3:.3f} ms, histogram {s['histogram']}")
@@ -0,0 +1,25 @@
+import os
+import sys
+from collections import namedtuple
+from pathlib import Path
+
+import pytest
+
+root = Path(__file__).parent.parent
+sys.path.insert(0, str(root))
+# the tests run without a Kvaser device or libcanlib.so
+os.environ.setdefault("CAN_BACKEND", "virtual")
+
+# stand-in for a received canlib Frame
+CanFrame = namedtuple('CanFrame', ['id', 'data', 'timestamp'], defaults=[None])
+
+
+def can_frames(frames):
+    """Turn the (id, data) tuples of an encoded command or response into received frames"""
+    return [CanFrame(can_id, bytearray(data)) for can_id, data in frames]
+
+
+@pytest.fixture
+def get_parameters():
+    from params import ParameterSet, get_params_file
+    return ParameterSet(str(root / get_params_file), name="Get Parameters", bytes=0x9A, pad=1, check=False)
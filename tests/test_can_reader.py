@@ -0,0 +1,103 @@
+import logging
+import time
+
+import driver_mk2
+from can_backend import EXT, Frame
+from can_reader import CanReader
+from conftest import can_frames
+from virtual_ecu import VirtualEcuChannel
+
+PREAMBLE = [0x58, 0x44, 0x41, 0x54]
+DATA_GET = 0x05
+logger = logging.getLogger(__name__)
+
+
+def data_get_response(interval_count: int, subsys_id: int = 0x10):
+    """Frames of a DATA_GET response echoing the interval count of its command"""
+    body = [0x00, 0x00] + list(interval_count.to_bytes(2, 'big')) + [0x00, 0x9A, 0xA0, 0x10] + [0] * 0x9A
+    return can_frames(driver_mk2.pack_response(PREAMBLE, [subsys_id], [0x00, DATA_GET], body))
+
+
+def is_cancel(cancel_count: int):
+    return lambda frames: driver_mk2.data_get_interval(frames) == cancel_count
+
+
+def send(reader, frames, future=None):
+    for i, (can_id, data) in enumerate(frames):
+        reader.write(Frame(can_id, data, flags=EXT), future if (i == len(frames) - 1) else None)
+
+
+def test_match_passes_streamed_responses_on():
+    reader = CanReader(None, logger)
+    streamed = []
+    reader.subscribe(0x10, DATA_GET, streamed.append)
+    future = reader.expect(0x10, DATA_GET, match=is_cancel(1))
+
+    stream_response = data_get_response(3)
+    reader.dispatch(stream_response)
+    assert not future.done()
+    assert streamed == [stream_response]
+
+    cancel_response = data_get_response(1)
+    reader.dispatch(cancel_response)
+    assert future.result(timeout=0) is cancel_response
+    assert streamed == [stream_response]
+
+    # once answered, responses go to the subscription again
+    reader.dispatch(data_get_response(1))
+    assert len(streamed) == 2
+    assert reader.unsolicited == 0
+
+
+def test_match_without_subscription():
+    reader = CanReader(None, logger)
+    future = reader.expect(0x10, DATA_GET, match=is_cancel(2))
+    reader.dispatch(data_get_response(1))
+    assert not future.done()
+    assert reader.unsolicited == 1
+    reader.dispatch(data_get_response(2))
+    assert driver_mk2.data_get_interval(future.result(timeout=0)) == 2
+
+
+def test_expect_without_match():
+    reader = CanReader(None, logger)
+    streamed = []
+    reader.subscribe(0x10, DATA_GET, streamed.append)
+    first = reader.expect(0x10, DATA_GET)
+    second = reader.expect(0x10, DATA_GET)
+    responses = [data_get_response(i) for i in (3, 4, 5)]
+    for response in responses:
+        reader.dispatch(response)
+    assert first.result(timeout=0) is responses[0]
+    assert second.result(timeout=0) is responses[1]
+    assert streamed == [responses[2]]
+
+
+def test_stream_cancel_on_virtual_ecu(get_parameters):
+    ch = VirtualEcuChannel(get_parameters, seed=0, latency=0.0005, jitter=0.0)
+    ch.busOn()
+    reader = CanReader(ch, logger)
+    streamed = []
+    reader.subscribe(0x10, DATA_GET, streamed.append)
+    reader.start()
+    try:
+        send(reader, driver_mk2.data_get_send(repeat=True, interval_count=driver_mk2.DATA_GET_MIN_INTERVAL, subsys=0))
+        deadline = time.monotonic() + 2.0
+        while (len(streamed) < 5 and time.monotonic() < deadline):
+            time.sleep(0.005)
+        assert len(streamed) >= 5
+
+        future = reader.expect(0x10, DATA_GET, match=is_cancel(1))
+        send(reader, driver_mk2.data_get_send(interval_count=1, subsys=0), future)
+        response = future.result(timeout=2.0)
+        assert bytes(driver_mk2.data_get_receive(response, subsys=0)[:2]) == b"\x00\x00"
+        assert all(driver_mk2.data_get_interval(f) == driver_mk2.DATA_GET_MIN_INTERVAL for f in streamed)
+
+        # the ECU stopped repeating once it answered the cancel
+        count = len(streamed)
+        time.sleep(10 * driver_mk2.DATA_GET_MIN_PERIOD_MS / 1000)
+        assert len(streamed) == count
+        assert ch.ecus[0x10].next_stream is None
+        assert reader.unsolicited == 0
+    finally:
+        reader.stop()
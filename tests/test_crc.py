@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from crc import Crc16, crc_16, crc_16_batch, crc_16_bytes
+
+
+def reference(data: bytes) -> int:
+    """Bitwise CRC-16 with polynomial 0x8005, zero initial value and no reflection"""
+    crc = 0
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x8005) & 0xffff if (crc & 0x8000) else (crc << 1) & 0xffff
+    return crc
+
+
+def payloads(seed: int = 0):
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0, 256, n, dtype=np.uint8).tobytes() for n in list(range(0, 33)) + [161, 162, 168]]
+
+
+def test_check_value():
+    assert reference(b"123456789") == 0xFEE8
+    assert crc_16_bytes(b"123456789") == b"\xfe\xe8"
+    assert crc_16(bytearray(b"123456789")) == "FEE8"
+
+
+@pytest.mark.parametrize("data", payloads())
+def test_crc_16_bytes(data):
+    assert crc_16_bytes(data) == reference(data).to_bytes(2, "big")
+    assert crc_16_bytes(memoryview(data)) == reference(data).to_bytes(2, "big")
+
+
+@pytest.mark.parametrize("chunk", [1, 2, 3, 7, 8])
+def test_incremental(chunk):
+    for data in payloads(1):
+        crc = Crc16()
+        for i in range(0, len(data), chunk):
+            crc.update(memoryview(data)[i:i + chunk])
+        assert crc.crc == reference(data)
+        assert crc.digest() == crc_16_bytes(data)
+        assert crc.hexdigest() == crc_16(bytearray(data))
+
+
+def test_incremental_copy():
+    data = payloads(2)[-1]
+    head = Crc16(data[:5])
+    tail = head.copy().update(data[5:])
+    assert head.crc == reference(data[:5])
+    assert tail.crc == reference(data)
+
+
+def test_batch():
+    data = payloads(3)
+    assert crc_16_batch(data).tolist() == [reference(p) for p in data]
+
+
+def test_batch_array():
+    rng = np.random.default_rng(4)
+    for width in (1, 8, 161):
+        rows = rng.integers(0, 256, (16, width), dtype=np.uint8)
+        assert crc_16_batch(rows).tolist() == [reference(row.tobytes()) for row in rows]
+
+
+def test_batch_empty():
+    assert crc_16_batch([]).tolist() == []
+    assert crc_16_batch([b""]).tolist() == [0]
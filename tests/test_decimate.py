@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+from decimate import MinMaxPyramid, minmax_decimate
+
+
+def series(n: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    return 0.01 * np.arange(n), rng.normal(size=n)
+
+
+def check_points(t, y, qt, qy, t0: float, t1: float):
+    """Points are samples of [t0, t1] in time order, each at most once, with the extremes of the range"""
+    inside = (t0 <= t) & (t <= t1)
+    i = np.searchsorted(t, qt)
+    np.testing.assert_array_equal(t[i], qt)
+    np.testing.assert_array_equal(y[i], qy)
+    assert np.all(np.diff(qt) > 0)
+    assert inside[i].all()
+    assert qy.min() == y[inside].min()
+    assert qy.max() == y[inside].max()
+
+
+def check_levels(pyramid, t, y):
+    """Every bucket holds the min/max of the samples it covers, counted from the first sample added"""
+    for level in pyramid.levels:
+        for i in range(level.count):
+            j = (level.start + i) * level.size
+            bt, by = t[j:j + level.size], y[j:j + level.size]
+            assert (level['t_first'][i], level['t_last'][i]) == (bt[0], bt[-1])
+            assert (level['t_min'][i], level['y_min'][i]) == (bt[np.argmin(by)], by.min())
+            assert (level['t_max'][i], level['y_max'][i]) == (bt[np.argmax(by)], by.max())
+
+
+def test_minmax_decimate_keeps_spikes():
+    t, y = series(10000)
+    y[1234], y[8765] = 100.0, -100.0
+    dt, dy = minmax_decimate(t, y, 100)
+    assert len(dt) <= 2 * 100 + 100
+    check_points(t, y, dt, dy, t[0], t[-1])
+
+
+def test_query_keeps_spikes():
+    t, y = series(20000)
+    y[777], y[15001] = 100.0, -100.0
+    pyramid = MinMaxPyramid()
+    pyramid.extend(t, y)
+    qt, qy = pyramid.query(t, y, t[0], t[-1], 200)
+    assert len(qt) < 4 * 200
+    check_points(t, y, qt, qy, t[0], t[-1])
+    assert 100.0 in qy and -100.0 in qy
+
+
+def test_latest_keeps_spikes():
+    t, y = series(20003)
+    y[5], y[20001] = 100.0, -100.0
+    pyramid = MinMaxPyramid()
+    pyramid.extend(t, y)
+    lt, ly = pyramid.latest(200)
+    assert len(lt) < 4 * 200
+    # the last samples are pending, not yet part of a bucket
+    check_points(t, y, lt, ly, t[0], t[-1])
+    assert 100.0 in ly and -100.0 in ly
+
+
+def test_extend_and_trim():
+    t, y = series(30000, seed=1)
+    window = 5000
+    pyramid = MinMaxPyramid()
+    rng = np.random.default_rng(2)
+    end = 0
+    while (end < len(t)):
+        # overlapping windows of a ring buffer, growing by uneven steps
+        end = min(end + int(rng.integers(1, 700)), len(t))
+        start = max(end - window, 0)
+        pyramid.extend(t[start:end], y[start:end])
+        pyramid.trim(t[start])
+        check_levels(pyramid, t, y)
+        wt, wy = t[start:end], y[start:end]
+        if (end - start > 2):
+            check_points(wt, wy, *pyramid.query(wt, wy, wt[0], wt[-1], 50), wt[0], wt[-1])
+        if (pyramid.levels[0].count > 0):
+            first = int(np.searchsorted(t, pyramid.levels[0]['t_first'][0]))
+            check_points(t[first:end], y[first:end], *pyramid.latest(50), t[first], t[end - 1])
+    assert pyramid.levels[0].start > 0
+
+
+@pytest.mark.parametrize("lo, hi", [(1, 9998), (3, 4097), (17, 5000), (1023, 1045), (4095, 8193), (250, 260)])
+def test_unaligned_edges(lo, hi):
+    t, y = series(10000, seed=3)
+    # spikes on the first and last sample of the range and just outside of it
+    y[lo], y[hi] = 50.0, 60.0
+    y[lo - 1], y[hi + 1] = 500.0, 600.0
+    pyramid = MinMaxPyramid()
+    pyramid.extend(t, y)
+    # bounds between samples as well as on them
+    for t0, t1 in ((t[lo], t[hi]), (t[lo] - 0.004, t[hi] + 0.004)):
+        qt, qy = pyramid.query(t, y, t0, t1, 10)
+        check_points(t, y, qt, qy, t0, t1)
+        assert 50.0 in qy and 60.0 in qy
+        assert not (500.0 in qy or 600.0 in qy)
@@ -0,0 +1,33 @@
+import warnings
+
+import numpy as np
+import pytest
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from live_plot import LivePlot
+
+
+@pytest.fixture
+def live_plot():
+    canvas = FigureCanvasAgg(Figure())
+    return LivePlot(canvas, canvas.figure.add_subplot())
+
+
+def test_reset_without_range(live_plot):
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        live_plot.reset("Error Vector 1", (0, 0))
+        assert live_plot.axes.get_ylim() == (0, 1)
+        live_plot.show(np.array([]), np.array([]))
+        live_plot.update(np.arange(4.0), np.zeros(4))
+    assert live_plot.axes.get_ylim() == (0, 1)
+
+
+def test_update_grows_limits(live_plot):
+    live_plot.reset("ECU Temp", (0, 100))
+    live_plot.update(np.arange(4.0), np.array([10.0, 20.0, 30.0, 40.0]))
+    assert live_plot.axes.get_ylim() == (0, 100)
+    live_plot.update(np.arange(5.0), np.array([10.0, 20.0, 30.0, 40.0, 150.0]))
+    lo, hi = live_plot.axes.get_ylim()
+    assert lo == 0 and hi > 150
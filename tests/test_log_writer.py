@@ -0,0 +1,58 @@
+import threading
+
+import pytest
+
+from log_writer import CsvLogWriter
+from test_params import fill, new_log
+
+
+class StalledWriter(CsvLogWriter):
+    """Csv writer whose thread waits for `resume` before writing each row"""
+
+    def __init__(self, *args, **kwargs):
+        self.resume = threading.Event()
+        super(StalledWriter, self).__init__(*args, **kwargs)
+
+    def encode_row(self, row) -> bytes:
+        if (isinstance(row[0], float)):
+            self.resume.wait()
+        return super(StalledWriter, self).encode_row(row)
+
+
+def test_queue_is_bounded(tmp_path):
+    writer = StalledWriter(tmp_path / "log.csv", ["time", "value"], 0.0, max_queued=4)
+    rows = [(float(i), i) for i in range(10)]
+    done = threading.Event()
+
+    def write_all():
+        for row in rows:
+            writer.write(row)
+        done.set()
+
+    thread = threading.Thread(target=write_all, daemon=True)
+    thread.start()
+    # one row is taken by the stalled writer thread, four more fill the queue
+    assert not done.wait(0.3)
+    assert writer.queue.qsize() == 4
+    writer.resume.set()
+    assert done.wait(5.0)
+    writer.close()
+    assert (tmp_path / "log.csv").read_text().splitlines()[1:] == [f"{t},{v}" for t, v in rows]
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_writer_error_stops_logging(get_parameters, tmp_path):
+    log = new_log(get_parameters, tmp_path, "bin")
+    fill(log, get_parameters, 3)
+    log.writer.sync()
+    # the writer thread fails on the next row it writes
+    log.writer.file.close()
+    fill(log, get_parameters, 1, first=3)
+    log.writer.join(5.0)
+    assert isinstance(log.writer.error, ValueError)
+    with pytest.raises(ValueError):
+        fill(log, get_parameters, 1, first=4)
+    with pytest.raises(ValueError):
+        log.writer.write((0.0, b""))
+    assert log.samples == 4
+    log.close()
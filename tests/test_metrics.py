@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from metrics import LatencyHistogram
+
+sub_buckets = LatencyHistogram.sub_buckets
+# the largest value the histogram resolves, the top bucket of the last magnitude ends there
+top = LatencyHistogram().highest_equivalent(len(LatencyHistogram().counts) - 1)
+
+
+def values(seed: int = 0):
+    """Microsecond values from exact ones over every magnitude up to the top bucket"""
+    rng = np.random.default_rng(seed)
+    exact = np.arange(4 * sub_buckets)
+    spread = np.exp2(rng.uniform(0, np.log2(top), 2000)).astype(np.int64)
+    return np.concatenate((exact, spread, [top - 1, top, 1 << 45, 1 << 20]))
+
+
+def test_index_exact():
+    h = LatencyHistogram()
+    for v in range(2 * sub_buckets):
+        assert h.index(v) == v
+        assert h.highest_equivalent(v) == v
+
+
+def test_index_buckets():
+    h = LatencyHistogram()
+    v = np.concatenate((np.arange(1 << 16), values()))
+    index = np.array([h.index(int(x)) for x in v])
+    highest = np.array([h.highest_equivalent(int(i)) for i in index])
+    below = np.array([h.highest_equivalent(int(i) - 1) if (i > 0) else -1 for i in index])
+    # every value falls in the bucket between the highest values of the one below and its own
+    assert np.all((below < v) & (v <= highest))
+    assert np.all(index < len(h.counts))
+    # buckets are at most 1 / sub_buckets of their values wide
+    assert np.all(highest - below <= np.maximum(1, highest / sub_buckets))
+    order = np.argsort(v, kind='stable')
+    assert np.all(np.diff(index[order]) >= 0)
+
+
+def test_top_bucket():
+    h = LatencyHistogram()
+    last = len(h.counts) - 1
+    first = h.highest_equivalent(last - 1) + 1
+    assert h.index(first) == h.index(top) == last
+    assert top - first < top / sub_buckets
+    # larger values are counted in the top bucket and bounded by the maximum
+    h.record(2 * top / 1e6)
+    assert h.counts[last] == 1
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_percentiles(seed):
+    h = LatencyHistogram()
+    v = values(seed)
+    np.random.default_rng(seed).shuffle(v)
+    for x in v:
+        h.record(x / 1e6)
+    # the values as they were recorded, in whole microseconds
+    recorded = np.array([int(x / 1e6 * 1e6) for x in v])
+    assert h.max == recorded.max()
+    assert h.mean() == pytest.approx(recorded.mean() / 1e6)
+    for q in (0.1, 1, 10, 25, 50, 75, 90, 99, 99.9, 100):
+        # the smallest recorded value with at least q percent at or below it
+        expected = np.percentile(recorded, q, method='inverted_cdf')
+        got = h.percentile(q) * 1e6
+        assert expected <= got + 1e-6
+        assert got <= expected * (1 + 1 / sub_buckets) + 1e-6
+
+
+def test_percentile_bounded_by_max():
+    h = LatencyHistogram()
+    for x in (1000, 1001, top - 1):
+        h.record(x / 1e6)
+    assert h.percentile(100) * 1e6 == pytest.approx(h.max)
+    assert h.percentile(50) * 1e6 <= 1001 * (1 + 1 / sub_buckets)
+    assert LatencyHistogram().percentile(50) == 0.0
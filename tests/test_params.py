@@ -0,0 +1,176 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from binlog import BinaryLog, binlog_to_csv, csv_to_binlog
+from params import ParameterLog
+
+start_time = 1000.0
+name = "ECU Temp"
+
+
+def payload(parameter_set, i: int) -> bytes:
+    values = [0] * len(parameter_set.parameter_names)
+    values[parameter_set.parameter_names.index(name)] = i % 100
+    return bytes(parameter_set.pack(values))
+
+
+def fill(log, parameter_set, count: int, first: int = 0):
+    for i in range(first, first + count):
+        log.log_datapoint(payload(parameter_set, i), t=start_time + 0.1 * i)
+
+
+def expected(lo: int, hi: int):
+    return np.arange(lo, hi) % 100, 0.1 * np.arange(lo, hi)
+
+
+@pytest.fixture(params=["csv", "bin", "raw"])
+def log_format(request):
+    return request.param
+
+
+def new_log(parameter_set, tmp_path, log_format, **kwargs):
+    return ParameterLog(parameter_set, logdir=tmp_path, log_format="csv" if (log_format == "csv") else "bin",
+                        raw=log_format == "raw", start_time=start_time, **kwargs)
+
+
+def test_pack_unpack(get_parameters):
+    values = get_parameters.unpack(payload(get_parameters, 42))
+    assert values[get_parameters.parameter_names.index(name)] == 42
+    assert len(get_parameters.pack(values)) == get_parameters.byte_length
+    assert get_parameters.unpack(get_parameters.pack(values)) == values
+
+
+def test_growing(get_parameters, tmp_path, log_format):
+    log = new_log(get_parameters, tmp_path, log_format, capacity=4, chunk=3)
+    fill(log, get_parameters, 50)
+    assert log.samples == 50
+    values, times = log.get_data_series(name)
+    lo_values, lo_times = expected(0, 50)
+    np.testing.assert_array_equal(values, lo_values)
+    np.testing.assert_allclose(times, lo_times)
+    np.testing.assert_allclose(log.get_data_series(name, elapsed=False)[1], lo_times + start_time)
+    log.close()
+
+def test_ring_wraparound(get_parameters, tmp_path, log_format):
+    log = new_log(get_parameters, tmp_path, log_format, window_samples=16, chunk=5)
+    for count in (7, 16, 23, 60):
+        fill(log, get_parameters, count - log.samples, first=log.samples)
+        values, times = log.get_data_series(name)
+        exp_values, exp_times = expected(max(count - 16, 0), count)
+        np.testing.assert_array_equal(values, exp_values)
+        np.testing.assert_allclose(times, exp_times)
+        assert log.window_start() == pytest.approx(exp_times[0])
+    log.close()
+
+
+def test_ring_series_are_copies(get_parameters, tmp_path):
+    log = new_log(get_parameters, tmp_path, "csv", window_samples=8, chunk=1)
+    fill(log, get_parameters, 8)
+    values, times = log.get_data_series(name)
+    fill(log, get_parameters, 8, first=8)
+    np.testing.assert_array_equal(values, expected(0, 8)[0])
+    np.testing.assert_allclose(times, expected(0, 8)[1])
+    log.close()
+
+
+def test_window_seconds(get_parameters, tmp_path):
+    log = new_log(get_parameters, tmp_path, "csv", window_seconds=1.0, chunk=4)
+    fill(log, get_parameters, 40)
+    values, times = log.get_data_series(name)
+    np.testing.assert_array_equal(values, expected(29, 40)[0])
+    log.close()
+
+
+def test_data_after(get_parameters, tmp_path, log_format):
+    log = new_log(get_parameters, tmp_path, log_format, window_samples=16, chunk=5)
+    fill(log, get_parameters, 30)
+    values, times = log.get_data_after(name, 0.1 * 25)
+    np.testing.assert_array_equal(values, expected(26, 30)[0])
+    values, times = log.get_data_after(name)
+    np.testing.assert_array_equal(values, expected(14, 30)[0])
+    log.close()
+
+
+@pytest.mark.parametrize("lo, hi", [(0, 60), (3, 20), (10, 50), (45, 60), (0, 5)])
+def test_history(get_parameters, tmp_path, log_format, monkeypatch, lo, hi):
+    # a sparse time index, so loading seeks into the file
+    monkeypatch.setattr(ParameterLog, "index_every", 4)
+    log = new_log(get_parameters, tmp_path, log_format, window_samples=16, chunk=5)
+    fill(log, get_parameters, 60)
+    # the bounds are between samples, the range is [start, end)
+    values, times = log.get_data_series(name, start=0.1 * lo - 0.05, end=0.1 * hi - 0.05)
+    exp_values, exp_times = expected(lo, hi)
+    np.testing.assert_array_equal(values, exp_values)
+    np.testing.assert_allclose(times, exp_times)
+    log.close()
+
+
+def test_history_after_close(get_parameters, tmp_path, log_format):
+    log = new_log(get_parameters, tmp_path, log_format, window_samples=16, chunk=5)
+    fill(log, get_parameters, 40)
+    log.close()
+    columns, times = log.load_history(0.1 * 10 - 0.05, 0.1 * 20 - 0.05, names=[name])
+    np.testing.assert_array_equal(columns[name], expected(10, 20)[0])
+    np.testing.assert_allclose(times, expected(10, 20)[1])
+
+
+def test_history_requires_logdir(get_parameters):
+    with pytest.raises(ValueError):
+        ParameterLog(get_parameters, window_samples=16)
+    log = ParameterLog(get_parameters)
+    with pytest.raises(ValueError):
+        log.load_history()
+
+
+def test_binary_log_padding(get_parameters, tmp_path):
+    log = new_log(get_parameters, tmp_path, "bin")
+    short = payload(get_parameters, 42)[:get_parameters.min_len]
+    log.log_datapoint(short, t=start_time)
+    log.close()
+    record, = BinaryLog(log.filename).records()
+    assert record.tobytes()[8:] == short.ljust(get_parameters.byte_length, get_parameters.pad_byte)
+
+
+def test_payload_padding(get_parameters, tmp_path):
+    log = new_log(get_parameters, tmp_path, "raw")
+    short = bytes(get_parameters.min_len)
+    assert log.payload_bytes(short) == short.ljust(get_parameters.byte_length, get_parameters.pad_byte)
+    log.close()
+
+
+def test_csv_binlog_round_trip(get_parameters, tmp_path, monkeypatch):
+    monkeypatch.setattr(ParameterLog, "index_every", 4)
+    (tmp_path / "csv").mkdir()
+    (tmp_path / "bin").mkdir()
+    csv_log = new_log(get_parameters, tmp_path / "csv", "csv")
+    bin_log = new_log(get_parameters, tmp_path / "bin", "bin")
+    for log in (csv_log, bin_log):
+        fill(log, get_parameters, 30)
+        log.close()
+
+    converted = tmp_path / "converted.clog"
+    csv_to_binlog(csv_log.filename, get_parameters, converted, index_every=4)
+    # the same index a binary log written as the samples arrived has
+    assert Path(str(converted) + ".idx").read_bytes() == Path(str(bin_log.filename) + ".idx").read_bytes()
+
+    binlog_to_csv(converted, tmp_path / "round_trip.csv")
+    original = np.loadtxt(csv_log.filename, delimiter=',', skiprows=1)
+    np.testing.assert_array_equal(np.loadtxt(tmp_path / "round_trip.csv", delimiter=',', skiprows=1), original)
+
+
+@pytest.mark.parametrize("lo, hi", [(0, 30), (3, 20), (9, 10), (25, 30)])
+def test_converted_binlog_seek(get_parameters, tmp_path, lo, hi):
+    log = new_log(get_parameters, tmp_path, "csv")
+    fill(log, get_parameters, 30)
+    log.close()
+    converted = tmp_path / "converted.clog"
+    csv_to_binlog(log.filename, get_parameters, converted, index_every=4)
+    binary = BinaryLog(converted)
+    index = binary.load_index()
+    np.testing.assert_allclose(index['time'], 0.1 * np.arange(0, 30, 4))
+    columns, times = binary.series([name], start=0.1 * lo - 0.05, end=0.1 * hi - 0.05)
+    exp_values, exp_times = expected(lo, hi)
+    np.testing.assert_array_equal(columns[name], exp_values)
+    np.testing.assert_allclose(times, exp_times)
@@ -0,0 +1,122 @@
+import pytest
+
+import driver_mk1
+import driver_mk2
+from conftest import CanFrame, can_frames
+from crc import crc_16_bytes
+from protocol import Frames
+from reassembler import Reassembler
+
+
+def frames(*pairs):
+    return [(can_id, bytes.fromhex(data)) for can_id, data in pairs]
+
+
+# frames the per-command pack functions encoded before they were cached and shared the protocol engine
+commands = [
+    (lambda: driver_mk2.init_payload_send(test=True, subsys=0),
+     frames((0x102000f, '0100000101bc70'))),
+    (lambda: driver_mk2.data_get_send(repeat=True, interval_count=500, subsys=1),
+     frames((0x102301f, '01000508010101f4'), (0x102300f, '009aa0103b3a'))),
+    (lambda: driver_mk2.set_time_send(2024, 1, 2, 3, 4, 5, subsys=1),
+     frames((0x102303f, '0100011332303234'), (0x102302f, '2d30312d30325430'), (0x102301f, '333a30343a3035e3'),
+            (0x102300f, '29'))),
+    (lambda: driver_mk2.data_send_send(bytes(range(10)), subsys=0),
+     frames((0x102102f, '0100064401000001'), (0x102101f, '000aa01000010203'), (0x102100f, '040506070809002e'))),
+    (lambda: driver_mk2.stop_payload_send(subsys=1),
+     frames((0x102200f, '0100040203ff55b6'))),
+    (lambda: driver_mk1.init_payload_send(test=False),
+     frames((0xfa19800, '01000001009bd6'))),
+    (lambda: driver_mk1.data_get_send(),
+     frames((0xfa19901, '0100050801000001'), (0xfa19900, '005400cc418f'))),
+    (lambda: driver_mk1.start_operation_send(),
+     frames((0xfa19800, '0100020200017d63'))),
+    (lambda: driver_mk1.stop_payload_send(retry_count=2, pwroff_delay=0x10),
+     frames((0xfa19800, '0100040202108906'))),
+]
+
+# responses the per-command unpack functions accepted, with the body they returned
+responses = [
+    (lambda f: driver_mk2.init_payload_receive(f, subsys=0),
+     frames((0x201000f, '000000020000f4a7')), '0000'),
+    (lambda f: driver_mk2.start_operation_receive(f, subsys=1),
+     frames((0x221101f, '0000020400000002'), (0x221100f, '5ac7')), '00000002'),
+    (lambda f: driver_mk1.stop_payload_receive(f),
+     frames((0x198fa000, '0000040200000475')), '0000'),
+    (lambda f: driver_mk1.start_operation_receive(f),
+     frames((0x198fa101, '0000020400000100'), (0x198fa100, '0e28')), '00000100'),
+]
+
+
+@pytest.mark.parametrize("send, expected", commands)
+def test_pack(send, expected):
+    assert [(can_id, bytes(data)) for can_id, data in send()] == expected
+
+
+@pytest.mark.parametrize("send, expected", commands)
+def test_pack_is_cached(send, expected):
+    assert send() is send()
+
+
+@pytest.mark.parametrize("receive, response, body", responses)
+def test_unpack(receive, response, body):
+    assert bytes(receive(can_frames(response))).hex() == body
+
+
+@pytest.mark.parametrize("receive, response, body", responses[:2])
+def test_unpack_reassembled(receive, response, body):
+    # the reassembler splits identifiers of the mk2 layout
+    reassembler = Reassembler()
+    transfers = [reassembler.feed(frame, now=0.0) for frame in can_frames(response)]
+    assert transfers[:-1] == [None] * (len(transfers) - 1)
+    assert isinstance(transfers[-1], Frames)
+    assert bytes(receive(transfers[-1])).hex() == body
+
+
+def test_pack_response():
+    response = driver_mk2.pack_response([0x58, 0x44, 0x41, 0x54], [0x11], [0x00, 0x02], [0x00, 0x00, 0x00, 0x02])
+    assert [(can_id, bytes(data)) for can_id, data in response] == responses[1][1]
+
+
+def test_split_id():
+    assert driver_mk2.split_id(0x102301f) == (0x08, 0x11, 1, 1)
+    assert driver_mk1.split_id(0xfa19901) == (0x7d0, 0xcc, 1, 1)
+
+
+response = frames((0x221101f, '0000020400000002'), (0x221100f, '5ac7'))
+
+
+def test_unpack_crc_mismatch():
+    # the check rejects a CRC field equal to the checksum of the data before it
+    data = b"".join(data for can_id, data in response)
+    bad = response[:-1] + [(response[-1][0], crc_16_bytes(data[:-2]))]
+    expected = f"CRC Mismatch: Expected {crc_16_bytes(data[:-2]).hex()}, got {crc_16_bytes(data[:-2]).hex()}"
+    assert driver_mk2.start_operation_receive(can_frames(bad), subsys=1) == expected
+
+    reassembler = Reassembler()
+    transfer = [reassembler.feed(frame, now=0.0) for frame in can_frames(bad)][-1]
+    assert driver_mk2.start_operation_receive(transfer, subsys=1) == expected
+
+
+def test_unpack_wrong_subsystem():
+    assert (driver_mk2.start_operation_receive(can_frames(response), subsys=0) ==
+            "Identifier DST_ID mismatch: Expected 16, got 0x11")
+
+
+def test_unpack_frame_order():
+    assert (driver_mk2.start_operation_receive(can_frames(response[::-1]), subsys=1) ==
+            "Identifier frame count Mismatch: Expected 2, got 0")
+
+
+def test_unpack_wrong_command():
+    assert (driver_mk2.stop_operation_receive(can_frames(response), subsys=1) ==
+            "Command id Mismatch: Expected 0003, got 0002")
+    single = frames((0x201000f, '000000020000f4a7'))
+    assert driver_mk2.stop_payload_receive(can_frames(single), subsys=0) == "Command id Mismatch: Expected 0004, got 0000"
+
+
+def test_unknown_command():
+    with pytest.raises(ValueError):
+        driver_mk2.protocol.send("NOT_A_COMMAND", [])
+    with pytest.raises(ValueError):
+        driver_mk2.protocol.receive([CanFrame(0, b"")], "PMA_TEST")
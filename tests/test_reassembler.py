@@ -0,0 +1,144 @@
+import driver_mk2
+from conftest import can_frames
+from crc import crc_16_bytes
+from reassembler import Reassembler
+
+PREAMBLE = [0x58, 0x44, 0x41, 0x54]
+
+
+def data_get_response(subsys_id: int, seed: int = 0):
+    """Frames of a 21 frame DATA_GET response"""
+    body = [(seed + i) & 0xff for i in range(0xA2)]
+    return can_frames(driver_mk2.pack_response(PREAMBLE, [subsys_id], [0x00, 0x05], body))
+
+
+def feed(reassembler, frames, now: float = 0.0):
+    """Feed frames, returns the completed transfers"""
+    transfers = [reassembler.feed(frame, now=now) for frame in frames]
+    return [t for t in transfers if (not t is None)]
+
+
+def test_single_frame():
+    frames = can_frames(driver_mk2.pack_response(PREAMBLE, [0x10], [0x00, 0x00], [0x00, 0x00]))
+    reassembler = Reassembler()
+    transfer, = feed(reassembler, frames)
+    assert list(transfer) == frames
+    assert bytes(transfer.data) == bytes(frames[0].data)
+    assert transfer.crc == crc_16_bytes(frames[0].data[:-2])
+
+
+def test_multi_frame():
+    frames = data_get_response(0x10)
+    reassembler = Reassembler()
+    transfer, = feed(reassembler, frames, now=5.0)
+    data = b"".join(bytes(f.data) for f in frames)
+    assert list(transfer) == frames
+    assert bytes(transfer.data) == data
+    assert transfer.crc == crc_16_bytes(data[:-2])
+    assert reassembler.started == 5.0
+    assert reassembler.dropped == 0
+    assert bytes(driver_mk2.data_get_receive(transfer, subsys=0)) == bytes(driver_mk2.data_get_receive(frames, subsys=0))
+
+
+def test_interleaved():
+    first, second = data_get_response(0x10, seed=1), data_get_response(0x11, seed=2)
+    interleaved = [frame for pair in zip(first, second) for frame in pair]
+    reassembler = Reassembler()
+    transfers = feed(reassembler, interleaved)
+    assert [list(t) for t in transfers] == [first, second]
+    assert bytes(driver_mk2.data_get_receive(transfers[0], subsys=0)) == bytes([(1 + i) & 0xff for i in range(0xA2)])
+    assert bytes(driver_mk2.data_get_receive(transfers[1], subsys=1)) == bytes([(2 + i) & 0xff for i in range(0xA2)])
+    assert reassembler.dropped == 0
+
+
+def test_lost_fragment():
+    frames = data_get_response(0x10)
+    reassembler = Reassembler()
+    # the transfer breaks at the gap, its remaining fragments are discarded without counting again
+    assert feed(reassembler, frames[:5] + frames[6:]) == []
+    assert reassembler.dropped == 1
+    assert reassembler.partial == {}
+
+    transfer, = feed(reassembler, frames)
+    assert list(transfer) == frames
+    assert reassembler.dropped == 1
+
+
+def test_duplicate_fragment():
+    frames = data_get_response(0x10)
+    reassembler = Reassembler()
+    assert feed(reassembler, frames[:5] + frames[4:]) == []
+    assert reassembler.dropped == 1
+
+    transfer, = feed(reassembler, frames)
+    assert list(transfer) == frames
+
+
+def test_lost_first_fragment():
+    frames = data_get_response(0x10)
+    reassembler = Reassembler()
+    assert feed(reassembler, frames[1:]) == []
+    assert reassembler.dropped == 1
+
+
+def test_restarted_transfer():
+    frames = data_get_response(0x10)
+    reassembler = Reassembler()
+    # a new first fragment breaks off the transfer in progress and starts over
+    transfer, = feed(reassembler, frames[:3] + frames)
+    assert list(transfer) == frames
+    assert reassembler.dropped == 1
+
+
+def test_break_does_not_affect_other_transfers():
+    first, second = data_get_response(0x10), data_get_response(0x11)
+    interleaved = [frame for pair in zip(first, second) for frame in pair]
+    interleaved.remove(first[10])
+    reassembler = Reassembler()
+    transfer, = feed(reassembler, interleaved)
+    assert list(transfer) == second
+    assert reassembler.dropped == 1
+
+
+def test_timeout():
+    frames = data_get_response(0x10)
+    reassembler = Reassembler(timeout=1.0)
+    feed(reassembler, frames[:5], now=0.0)
+    reassembler.expire(0.5)
+    assert reassembler.dropped == 0
+    reassembler.expire(1.0)
+    assert reassembler.dropped == 1
+    assert reassembler.partial == {}
+    assert feed(reassembler, frames[5:], now=1.0) == []
+    assert reassembler.dropped == 1
+
+
+def test_fragments_extend_the_timeout():
+    frames = data_get_response(0x10)
+    reassembler = Reassembler(timeout=1.0)
+    for i, frame in enumerate(frames[:-1]):
+        reassembler.feed(frame, now=0.5 * i)
+        reassembler.expire(0.5 * i)
+    transfer = reassembler.feed(frames[-1], now=0.5 * (len(frames) - 1))
+    assert list(transfer) == frames
+    assert reassembler.dropped == 0
+
+
+def test_crc_mismatch():
+    frames = data_get_response(0x10)
+    data = b"".join(bytes(f.data) for f in frames)
+    frames[-1].data[-2:] = crc_16_bytes(data[:-2])
+    transfer, = feed(Reassembler(), frames)
+    assert driver_mk2.data_get_receive(transfer, subsys=0).startswith("CRC Mismatch")
+    assert driver_mk2.data_get_receive(frames, subsys=0).startswith("CRC Mismatch")
+
+
+def test_length_mismatch():
+    # the length field disagrees with the frame count, unpack reports it instead of the transfer being dropped
+    frames = data_get_response(0x10)
+    frames[0].data[3] = 0x9A
+    reassembler = Reassembler()
+    transfer, = feed(reassembler, frames)
+    assert reassembler.dropped == 0
+    assert driver_mk2.data_get_receive(transfer, subsys=0) == "Length Mismatch: Expected 0xa2, got 0x9a"
+    assert driver_mk2.data_get_receive(frames, subsys=0) == "Length Mismatch: Expected 0xa2, got 0x9a"
@@ -0,0 +1,126 @@
+import numpy as np
+import pytest
+
+import scheduler
+from scheduler import PeriodicScheduler
+
+
+class FakeClock:
+    """Monotonic and wall clock that only advance when the scheduler waits or a callback works"""
+
+    def __init__(self, wake_up=lambda: 0.0):
+        self.now = 100.0
+        self.wake_up = wake_up
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now + 1000.0
+
+
+class FakeEvent:
+    """Stop event of the scheduler, waiting advances the clock by the timeout plus a wake up delay"""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.flag = False
+
+    def set(self):
+        self.flag = True
+
+    def is_set(self):
+        return self.flag
+
+    def wait(self, timeout):
+        self.clock.now += timeout + self.clock.wake_up()
+        return self.flag
+
+
+def run(monkeypatch, period: float, work, ticks: int, wake_up=lambda: 0.0):
+    """Run a scheduler on a fake clock for a number of ticks, work(k) is how long the k-th call takes"""
+    clock = FakeClock(wake_up)
+    monkeypatch.setattr(scheduler, "time", clock)
+    calls = []
+
+    def callback(t):
+        calls.append(t - 1000.0)
+        clock.now += work(len(calls) - 1)
+        if (len(calls) == ticks):
+            sched.stop()
+
+    sched = PeriodicScheduler(period, callback)
+    sched._stop_event = FakeEvent(clock)
+    start = clock.now
+    sched.run()
+    return sched, np.array(calls) - start
+
+
+def test_no_drift(monkeypatch):
+    # every tick wakes up late and takes time, the deadlines stay on the grid
+    sched, calls = run(monkeypatch, 0.01, lambda k: 0.004, 1000, wake_up=lambda: 0.0003)
+    np.testing.assert_allclose(calls[1:], 0.01 * np.arange(1, 1000) + 0.0003, rtol=0, atol=1e-9)
+    assert calls[0] == 0.0
+    assert (sched.skipped, sched.overruns) == (0, 0)
+
+
+def test_overrun_skips_ticks(monkeypatch):
+    # the call of tick 3 runs 3.5 periods, ticks 4 to 6 are skipped instead of run back to back
+    sched, calls = run(monkeypatch, 1.0, lambda k: 3.5 if (k == 3) else 0.1, 8)
+    np.testing.assert_allclose(calls, [0, 1, 2, 3, 7, 8, 9, 10])
+    assert np.all(np.diff(calls) >= 1.0 - 1e-9)
+    assert (sched.ticks, sched.skipped, sched.overruns) == (8, 3, 1)
+
+
+def test_overrun_to_deadline(monkeypatch):
+    # a call ending exactly on the next deadline did not overrun it
+    sched, calls = run(monkeypatch, 0.5, lambda k: 0.5, 4)
+    np.testing.assert_allclose(calls, [0, 0.5, 1.0, 1.5])
+    assert sched.skipped == 0
+
+
+def test_declined(monkeypatch):
+    results = [True, False, None, False, True]
+    clock = FakeClock()
+    monkeypatch.setattr(scheduler, "time", clock)
+
+    def callback(t):
+        result = results[sched.ticks - 1]
+        if (sched.ticks == len(results)):
+            sched.stop()
+        return result
+
+    sched = PeriodicScheduler(1.0, callback)
+    sched._stop_event = FakeEvent(clock)
+    sched.run()
+    assert (sched.ticks, sched.declined) == (5, 2)
+
+
+def test_lateness_histogram(monkeypatch):
+    lateness = [0.0, 30e-6, 150e-6, 150e-6, 700e-6, 3e-3, 3e-3, 3e-3, 15e-3, 0.25]
+    late = iter(lateness)
+    sched, calls = run(monkeypatch, 1.0, lambda k: 0.0, len(lateness), wake_up=lambda: next(late))
+    # the first tick is due at once, so it never waits
+    recorded = [0.0] + lateness[:-1]
+    np.testing.assert_allclose(calls - np.arange(len(calls)), recorded, atol=1e-9)
+
+    histogram = sched.stats()["histogram"]
+    assert histogram == {"<=0.05ms": 3, "<=0.1ms": 0, "<=0.2ms": 2, "<=0.5ms": 0, "<=1ms": 1, "<=2ms": 0,
+                         "<=5ms": 3, "<=10ms": 0, "<=20ms": 1, "<=50ms": 0, "<=100ms": 0, "more": 0}
+    assert sched.max_lateness == pytest.approx(15e-3)
+    assert sched.stats()["mean_lateness"] == pytest.approx(sum(recorded) / len(recorded))
+    # bounds are the upper edges of the bins holding the percentile
+    assert sched.percentile(30) == 50e-6
+    assert sched.percentile(50) == 200e-6
+    assert sched.percentile(60) == 1e-3
+    assert sched.percentile(90) == 5e-3
+    assert sched.percentile(99) == 20e-3
+
+
+def test_percentile_open_bin(monkeypatch):
+    late = iter([0.3, 0.5, 0.0])
+    sched, calls = run(monkeypatch, 1.0, lambda k: 0.0, 4, wake_up=lambda: next(late, 0.0))
+    # lateness beyond the last bin is bounded by the maximum
+    assert sched.histogram[-1] == 2
+    assert sched.percentile(99) == pytest.approx(0.5)
+    assert PeriodicScheduler(1.0, None).percentile(50) == 0.0
@@ -0,0 +1,79 @@
+""" Opt-in tracing of pipeline stages
+
+Stages are wrapped in `span`, which records the time spent in them while tracing
+is enabled and costs a single flag check otherwise. Recorded spans are exported
+in the Chrome trace event format, which chrome://tracing and Perfetto open.
+Tracing starts enabled if the CAN_TRACE environment variable is set to a
+non-empty value, and can be switched at runtime with `enable`.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+
+enabled = bool(os.environ.get("CAN_TRACE"))
+
+# the oldest spans are dropped beyond this many
+max_events = 1 << 20
+
+events = deque(maxlen=max_events)
+
+_null = nullcontext()
+
+
+class Span:
+    __slots__ = ('name', 'args', 'start')
+
+    def __init__(self, name: str, args: dict):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        complete(self.name, self.start, time.monotonic(), self.args)
+
+
+def span(name: str, **args):
+    """Context manager timing the enclosed block as a span with the given name and arguments"""
+    if (not enabled):
+        return _null
+    return Span(name, args)
+
+
+def complete(name: str, start: float, end: float, args: dict = None):
+    """Record a span measured elsewhere, from start to end on the monotonic clock"""
+    if (enabled):
+        thread = threading.current_thread()
+        events.append((name, start, end - start, thread.ident, thread.name, args))
+
+
+def enable(on: bool = True):
+    global enabled
+    enabled = on
+
+
+def clear():
+    events.clear()
+
+
+def export(filename):
+    """Write the recorded spans as a Chrome trace JSON file"""
+    pid = os.getpid()
+    trace = []
+    threads = dict()
+    for name, start, duration, tid, thread_name, args in list(events):
+        threads[tid] = thread_name
+        event = {"name": name, "ph": "X", "ts": start * 1e6, "dur": duration * 1e6, "pid": pid, "tid": tid}
+        if (args):
+            event["args"] = args
+        trace.append(event)
+    trace += [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": thread_name}}
+              for tid, thread_name in threads.items()]
+    with open(str(filename), 'w') as f:
+        json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
@@ -0,0 +1,280 @@
+""" Simulated ECUs behind a stand-in for a canlib channel
+
+`VirtualEcuChannel` implements the part of the canlib Channel interface the
+application uses (busOn, busOff, close, write, read, readTimer), with a
+`VirtualEcu` per subsystem answering the driver_mk2 protocol on the other end.
+Responses are delivered after a configurable latency, one frame per frame time
+of a 1 Mbit/s bus, and carry timestamps of the channel clock in milliseconds.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from crc import crc_16_bytes
+from driver_mk2 import *
+from reassembler import Reassembler
+
+PREAMBLE = bytes([0x58, 0x44, 0x41, 0x54])
+
+# error vectors answered in the status field of a response
+STATUS_OK = b"\x00\x00"
+STATUS_CRC = b"\x00\x01"
+STATUS_BAD_PARAM = b"\x00\x02"
+STATUS_NOT_READY = b"\x00\x04"
+STATUS_FAULT = b"\x00\x10"
+STATUS_UNKNOWN_CMD = b"\xff\xff"
+
+# canlib.canlib.MessageFlag.EXT, the frame has a 29 bit identifier
+EXT = 0x0004
+
+
+class CanNoMsg(Exception):
+    """Stand-in for canlib.canlib.CanNoMsg, raised when no frame was received in time"""
+
+
+class Frame:
+    """Stand-in for canlib.Frame with the attributes the application uses"""
+
+    def __init__(self, id_: int, data, dlc: int = None, flags: int = 0, timestamp: int = None):
+        self.id = id_
+        self.data = bytearray(data)
+        self.dlc = len(self.data) if (dlc is None) else dlc
+        self.flags = flags
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return f"Frame(id={self.id}, data={bytes(self.data)}, dlc={self.dlc}, flags={self.flags}, timestamp={self.timestamp})"
+
+
+def response_frames(ecu_id: int, cmd_id: int, body: bytes, corrupt_crc: bool = False):
+    """Build the frames of a response"""
+    frames = pack_response(list(PREAMBLE), [ecu_id], list(cmd_id.to_bytes(2, 'big')), list(body))
+    if (corrupt_crc):
+        # what the host rejects as a CRC mismatch, see unpack
+        data = b"".join(f[1] for f in frames)
+        data = data[:-2] + crc_16_bytes(data[:-2])
+        frames = [(can_id, data[i * 8:(i + 1) * 8]) for i, (can_id, _) in enumerate(frames)]
+    return [Frame(can_id, data, flags=EXT) for can_id, data in frames]
+
+
+class VirtualEcu:
+    """
+    Simulated ECU of one subsystem.
+
+    Telemetry is generated for every parameter of `parameter_set` as a slow sine
+    with noise within the parameter bounds, at a higher level while operation is
+    started. Faults are injected with the given probabilities per response:
+    `drop_rate` sends no response at all, `frame_drop_rate` loses one fragment,
+    `crc_error_rate` corrupts the CRC and `error_rate` answers with a fault
+    status.
+    """
+
+    def __init__(self, ecu_id: int, parameter_set, rng: np.random.Generator, latency: float = 0.002,
+                 jitter: float = 0.0005, drop_rate: float = 0.0, frame_drop_rate: float = 0.0,
+                 crc_error_rate: float = 0.0, error_rate: float = 0.0, noise: float = 0.01):
+        self.ecu_id = ecu_id
+        self.parameter_set = parameter_set
+        self.rng = rng
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.frame_drop_rate = frame_drop_rate
+        self.crc_error_rate = crc_error_rate
+        self.error_rate = error_rate
+        self.noise = noise
+
+        self.reassembler = Reassembler(timeout=1.0)
+        self.initialized = False
+        self.test = False
+        self.started = False
+        self.clock_offset = 0.0
+        self.data = bytes()
+        self.stream_interval = None
+        self.stream_header = None
+        self.next_stream = None
+
+        params = [parameter_set[n] for n in parameter_set.parameter_names]
+        self.lo = np.array([p.min for p in params], dtype=np.float64)
+        self.hi = np.array([p.max for p in params], dtype=np.float64)
+        self.freq = rng.uniform(0.02, 0.5, len(params))
+        self.phase = rng.uniform(0, 2 * np.pi, len(params))
+
+        self.handlers = {
+            0x00: self.on_init_payload,
+            0x01: self.on_set_time,
+            0x02: self.on_start_operation,
+            0x03: self.on_stop_operation,
+            0x04: self.on_stop_payload,
+            0x05: self.on_data_get,
+            0x06: self.on_data_send,
+            0x07: self.on_data_send,
+            0x08: self.on_test,
+            0x09: self.on_stop_operation,
+        }
+
+    def receive(self, frame, now: float):
+        """Feed a command frame, returns the (delivery time, frames) of the responses it causes"""
+        frames = self.reassembler.feed(frame, now)
+        if (frames is None):
+            return []
+        data = b"".join(bytes(f.data) for f in frames)
+        cmd_id = int.from_bytes(data[1:3], 'big')
+        length = data[3]
+        param = data[4:4 + length]
+        crc = crc_16_bytes(PREAMBLE + data[:1] + bytes([self.ecu_id]) + data[1:4 + length])
+        if (crc != data[4 + length:6 + length]):
+            return self.respond(cmd_id, STATUS_CRC, now)
+        handler = self.handlers.get(cmd_id)
+        if (handler is None):
+            return self.respond(cmd_id, STATUS_UNKNOWN_CMD, now)
+        return handler(cmd_id, param, now)
+
+    def respond(self, cmd_id: int, body: bytes, now: float):
+        if (self.rng.random() < self.drop_rate):
+            return []
+        if (self.rng.random() < self.error_rate):
+            body = STATUS_FAULT + body[2:]
+        frames = response_frames(self.ecu_id, cmd_id, body, corrupt_crc=self.rng.random() < self.crc_error_rate)
+        if (len(frames) > 1 and self.rng.random() < self.frame_drop_rate):
+            del frames[self.rng.integers(len(frames))]
+        delay = max(self.rng.normal(self.latency, self.jitter), 0) if (self.jitter > 0) else self.latency
+        return [(now + delay, frames)]
+
+    def sample(self, now: float) -> bytes:
+        level = 0.6 if (self.started) else 0.25
+        wave = level + 0.2 * np.sin(2 * np.pi * self.freq * now + self.phase)
+        values = self.lo + (self.hi - self.lo) * (wave + self.rng.normal(0, self.noise, len(wave)))
+        values = np.clip(np.rint(values), self.lo, self.hi).astype(np.int64)
+        return bytes(self.parameter_set.pack(values.tolist()))
+
+    def stream(self, now: float):
+        """Responses of a repeating DATA_GET that are due by now"""
+        responses = []
+        while (not self.next_stream is None and self.next_stream <= now):
+            responses += self.respond(0x05, STATUS_OK + self.stream_header + self.sample(self.next_stream),
+                                      self.next_stream)
+            # a stalled reader does not get a burst of stale samples
+            self.next_stream = max(self.next_stream + self.stream_interval, now - self.stream_interval)
+        return responses
+
+    def on_init_payload(self, cmd_id, param, now):
+        self.initialized = True
+        self.test = param[:1] == b"\x01"
+        return self.respond(cmd_id, STATUS_OK, now)
+
+    def on_set_time(self, cmd_id, param, now):
+        try:
+            self.clock_offset = datetime.fromisoformat(param.decode('utf-8')).timestamp() - time.time()
+        except ValueError:
+            return self.respond(cmd_id, STATUS_BAD_PARAM, now)
+        return self.respond(cmd_id, STATUS_OK, now)
+
+    def on_start_operation(self, cmd_id, param, now):
+        if (not self.initialized):
+            return self.respond(cmd_id, STATUS_NOT_READY + b"\x00" + param[:1], now)
+        self.started = True
+        return self.respond(cmd_id, STATUS_OK + b"\x00" + param[:1], now)
+
+    def on_stop_operation(self, cmd_id, param, now):
+        self.started = False
+        return self.respond(cmd_id, STATUS_OK, now)
+
+    def on_stop_payload(self, cmd_id, param, now):
+        self.initialized = False
+        self.started = False
+        self.next_stream = None
+        return self.respond(cmd_id, STATUS_OK, now)
+
+    def on_data_get(self, cmd_id, param, now):
+        if (len(param) < 8):
+            return self.respond(cmd_id, STATUS_BAD_PARAM + bytes(6 + self.parameter_set.byte_length), now)
+        self.stream_header = param[2:8]
+        if (param[1] == 0x01):
+            self.stream_interval = max(int.from_bytes(param[2:4], 'big'), 1) * DATA_GET_INTERVAL_MS / 1000
+            self.next_stream = now
+            return self.stream(now)
+        # a single DATA_GET also ends a repeating one
+        self.next_stream = None
+        return self.respond(cmd_id, STATUS_OK + self.stream_header + self.sample(now), now)
+
+    def on_data_send(self, cmd_id, param, now):
+        self.data = param[8:]
+        return self.respond(cmd_id, STATUS_OK, now)
+
+    def on_test(self, cmd_id, param, now):
+        return self.respond(cmd_id, STATUS_OK, now)
+
+
+class VirtualEcuChannel:
+    """
+    Stand-in for a canlib channel with a simulated ECU for every subsystem.
+
+    Settings are passed on to every VirtualEcu, `seed` makes telemetry and
+    injected faults reproducible.
+    """
+
+    frame_time = FRAME_TIME_US / 1e6
+
+    def __init__(self, parameter_set, seed: int = None, **settings):
+        rng = np.random.default_rng(seed)
+        self.ecus = {i[0]: VirtualEcu(i[0], parameter_set, rng, **settings) for i in ID}
+        self.start = time.monotonic()
+        self.on_bus = False
+        self._rx = []
+        self._seq = itertools.count()
+        self._bus_free = 0.0
+        self._lock = threading.Condition()
+
+    def busOn(self):
+        self.on_bus = True
+
+    def busOff(self):
+        self.on_bus = False
+
+    def close(self):
+        self.on_bus = False
+
+    def readTimer(self) -> int:
+        return int((time.monotonic() - self.start) * 1000)
+
+    def write(self, frame):
+        if (not self.on_bus):
+            return
+        src_id, dst_id, ftype, frame_cnt = split_id(frame.id)
+        ecu = self.ecus.get(dst_id)
+        if (ecu is None):
+            return
+        with self._lock:
+            self.queue(ecu.receive(frame, time.monotonic()))
+            self._lock.notify()
+
+    def queue(self, responses):
+        """Put the frames of responses on the bus back to back after their delivery time, must hold the lock"""
+        for due, frames in responses:
+            t = max(due, self._bus_free)
+            for frame in frames:
+                t += self.frame_time
+                frame.timestamp = int((t - self.start) * 1000)
+                heapq.heappush(self._rx, (t, next(self._seq), frame))
+            self._bus_free = t
+
+    def read(self, timeout: int = 0):
+        deadline = time.monotonic() + timeout / 1000
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                for ecu in self.ecus.values():
+                    self.queue(ecu.stream(now))
+                if (self._rx and self._rx[0][0] <= now):
+                    return heapq.heappop(self._rx)[2]
+                if (now >= deadline):
+                    raise CanNoMsg()
+                wake = [deadline] + [ecu.next_stream for ecu in self.ecus.values() if (not ecu.next_stream is None)]
+                if (self._rx):
+                    wake.append(self._rx[0][0])
+                self._lock.wait(max(min(wake) - now, 0))